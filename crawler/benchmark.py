@@ -0,0 +1,642 @@
+"""
+Offline benchmarks for parts of the crawler, run on pages saved by an earlier crawl.
+
+Usage:
+python crawler/benchmark.py links <output directory> [--start-url URL] [--max-pages N]
+python crawler/benchmark.py prune <output directory> [--max-pages N]
+python crawler/benchmark.py dedup <output directory> [--max-pages N] [--threshold T]
+python crawler/benchmark.py metadata <output directory> [--max-pages N]
+python crawler/benchmark.py frontier <output directory> [--max-pages N]
+python crawler/benchmark.py pipeline <output directory> [--max-pages N] [--save-results FILE] [--compare-results FILE]
+python crawler/benchmark.py fetch [--pages N] [--links N] [--words N] [--latency MS] [--concurrency N] [--settings FILE]
+"""
+import argparse
+import contextlib
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from unittest import mock
+
+from bs4 import BeautifulSoup, Tag, NavigableString
+from datasketch import MinHash, MinHashLSH
+import requests
+
+import crawl_stats
+import crawler
+import dom_pruning
+import frontier
+import handle_settings
+import html_archive
+import link_filter
+import page_extraction
+import remove_doublons
+
+
+def reference_filter_links(hrefs, base_url, base_url_pattern, ignored_pages):
+    """
+    Link filter as implemented before LinkFilter (one regex call per check and anchor), used as reference
+    """
+    ignored_page_types = re.compile(r'.*\.(png|pdf|jpg)')
+    absolute_url_pattern = re.compile(r'^(?:[a-z+]+:)?\/\/')
+    links = []
+    for link in hrefs:
+        if re.match(base_url_pattern, link):
+            if not re.match(ignored_page_types, link):
+                if not ignored_pages or re.search(ignored_pages, link) is None:
+                    links.append(link)
+        if not re.match(absolute_url_pattern, link):
+            full_link = base_url + link if len(link) > 0 and link[0] == '/' else base_url + '/' + link
+            if not re.match(ignored_page_types, link):
+                if not ignored_pages or not re.search(ignored_pages, link):
+                    links.append(full_link)
+    return links
+
+
+def benchmark_links(folder, start_url=None, max_pages=None, repeat=5):
+    """
+    Compares LinkFilter with the reference implementation on the anchors of all saved pages
+    """
+    settings = handle_settings.read_settings_file(folder)
+    pages_to_be_ignored = settings['general']['pages_to_be_ignored']
+
+    anchor_lists = []
+    for url, html in html_archive.iter_saved_pages(folder, max_pages):
+        start_url = start_url or url
+        soup = BeautifulSoup(html, 'lxml')
+        anchor_lists.append([a.get('href') for a in soup.find_all('a', href=True)])
+    num_anchors = sum(len(hrefs) for hrefs in anchor_lists)
+    print(f'{len(anchor_lists)} pages, {num_anchors} anchors')
+
+    base_url = re.match(r"https?://[^/]*", start_url).group()
+    base_url_pattern = r'(https?://)?' + re.escape(re.match(r'https?://?([^[^/]+)', base_url).group(1))
+    ignored_pages = link_filter.build_ignored_pages_pattern(pages_to_be_ignored)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        reference_results = [reference_filter_links(hrefs, base_url, base_url_pattern, ignored_pages) for hrefs in anchor_lists]
+    reference_time = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        # New filter (and thus empty cache) per repetition, the cache only fills up during the crawl
+        LinkFilter = link_filter.LinkFilter(base_url, base_url_pattern, pages_to_be_ignored)
+        results = [LinkFilter.filter_links(hrefs) for hrefs in anchor_lists]
+    filter_time = (time.perf_counter() - start) / repeat
+
+    mismatches = sum(set(a) != set(b) for a, b in zip(reference_results, results))
+    print(f'reference:  {reference_time*1000:.1f} ms ({num_anchors/reference_time:.0f} anchors/s)')
+    print(f'LinkFilter: {filter_time*1000:.1f} ms ({num_anchors/filter_time:.0f} anchors/s)')
+    print(f'speedup {reference_time/filter_time:.1f}x, {mismatches} pages with different links')
+
+
+# Exact copy of decompose_tree of the original crawler (Crawler._extract_text), used as reference - do not change it
+def reference_decompose_tree(tag, match_func, del_matches=False):
+    """
+    Decomposes the bs4 soup: \n
+    (del_matches = False)   Keep only matched tags, but with general structure intact \n
+    (del_matches = True)    Delete all matched tags
+    Args: 
+    match func: A function checking whether a tag has one of the selected patterns - returns True or False
+    del_matches: If True, all matching tags are deleted. If False, all matching tags are kept, any other deleted. 
+    """
+    def _decompose_rec(tag, match_func, del_matches, level): 
+        """
+        Leaves root intact, decomposes anything else recursively. 
+        """
+        for c in list(tag.children): 
+            if isinstance(c, NavigableString): 
+                c.replace_with('')
+            elif isinstance(c, Tag): 
+                # Deleting matches from tree
+                if del_matches: 
+                    if match_func(c): 
+                        c.decompose()
+                    elif c.find(match_func): 
+                        _decompose_rec(c, match_func, del_matches, level+1)
+                # Keep only matches in tree
+                else: 
+                    if match_func(c): # c matches a pattern
+                        pass # Keep tag and children
+                    elif c.find(match_func): # descendants of c match patterns
+                        _decompose_rec(c, match_func, del_matches, level+1)
+                    else: # c and descendants don't match patterns (due to recursive nature: parents also don't match patterns)
+                        c.decompose()
+            else: 
+                try: 
+                    c.decompose()
+                except Exception as e: 
+                    print(e)
+
+        if not level == 0: 
+            if not tag.get_text(strip=True): # (This should not delete <br> as those are inline and thus protected where matched)
+                tag.decompose() 
+
+    level = 0
+    _decompose_rec(tag, match_func, del_matches, level)
+
+
+def benchmark_prune(folder, max_pages=None):
+    """
+    Runs the text extraction of each saved page with dom_pruning.prune_tree and with the reference implementation,
+    comparing run time and extracted text
+    """
+    settings = handle_settings.read_settings_file(folder)
+    extractor = page_extraction.PageExtractor(settings)
+
+    reference_time = 0
+    prune_time = 0
+    num_pages = 0
+    mismatches = []
+    for url, html in html_archive.iter_saved_pages(folder, max_pages):
+        soup = BeautifulSoup(html, 'lxml')
+        start = time.perf_counter()
+        result = extractor.extract_text(soup)
+        prune_time += time.perf_counter() - start
+
+        soup = BeautifulSoup(html, 'lxml')
+        with mock.patch.object(dom_pruning, 'prune_tree', reference_decompose_tree):
+            start = time.perf_counter()
+            reference_result = extractor.extract_text(soup)
+            reference_time += time.perf_counter() - start
+
+        num_pages += 1
+        if result != reference_result:
+            mismatches.append(url)
+
+    print(f'{num_pages} pages (time includes html2text)')
+    print(f'reference:  {reference_time:.2f} s ({num_pages/reference_time:.1f} pages/s)')
+    print(f'prune_tree: {prune_time:.2f} s ({num_pages/prune_time:.1f} pages/s)')
+    print(f'speedup {reference_time/prune_time:.1f}x, {len(mismatches)} pages with different text')
+    for url in mismatches[:20]:
+        print('  different text:', url)
+
+
+class ReferenceMinHashFilter:
+    """
+    Duplicate filter as implemented before MinHashFilter.check_and_add (text hashed twice, one shingle at a time), used as reference
+    """
+    def __init__(self, threshold) -> None:
+        self.lsh = MinHashLSH(threshold=threshold, num_perm=128)
+
+    def check_and_add(self, text, url):
+        if self.lsh.query(self._get_minhash(text)):
+            return False
+        self.lsh.insert(url, self._get_minhash(text))
+        return True
+
+    def _get_minhash(self, text, num_perm=128):
+        tokens = [token.lower() for token in text.split() if len(token) > 1]
+        n = 3
+        shingles = set()
+        for i in range(len(tokens) - n + 1):
+            shingles.add(' '.join(tokens[i:i + n]))
+        m = MinHash(num_perm=num_perm)
+        for s in shingles:
+            m.update(s.encode('utf8'))
+        return m
+
+
+def benchmark_dedup(folder, max_pages=None, threshold=None):
+    """
+    Runs the duplicate filter with MinHashFilter.check_and_add and with the reference implementation
+    on the texts extracted from all saved pages, comparing throughput and duplicate decisions
+    """
+    settings = handle_settings.read_settings_file(folder)
+    threshold = threshold or settings['output']['file']['doublons']['threshold_value']
+    extractor = page_extraction.PageExtractor(settings)
+    texts = [(url, extractor.extract(html)['text']) for url, html in html_archive.iter_saved_pages(folder, max_pages)]
+    num_words = sum(len(text.split()) for _, text in texts)
+    print(f'{len(texts)} pages, {num_words} words')
+
+    reference_filter = ReferenceMinHashFilter(threshold)
+    start = time.perf_counter()
+    reference_decisions = [reference_filter.check_and_add(text, url) for url, text in texts]
+    reference_time = time.perf_counter() - start
+
+    duplicate_filter = remove_doublons.MinHashFilter(threshold)
+    start = time.perf_counter()
+    decisions = [duplicate_filter.check_and_add(text, url, verbose=False) for url, text in texts]
+    filter_time = time.perf_counter() - start
+
+    mismatches = [url for (url, _), a, b in zip(texts, reference_decisions, decisions) if a != b]
+    print(f'reference:     {reference_time:.2f} s ({len(texts)/reference_time:.1f} pages/s)')
+    print(f'check_and_add: {filter_time:.2f} s ({len(texts)/filter_time:.1f} pages/s)')
+    print(f'speedup {reference_time/filter_time:.1f}x, {len(decisions) - sum(decisions)} duplicates, {len(mismatches)} different decisions')
+    for url in mismatches[:20]:
+        print('  different decision:', url)
+
+
+def reference_extract_metadata(extractor, soup):
+    """
+    Metadata extraction as implemented before the compiled rules of PageExtractor (one find_all and json.loads per field,
+    fallback date searched in the whole text), used as reference
+    """
+    def check_if_match(settings):
+        if 'json_pattern' in settings.keys() and settings['json_pattern']: 
+            yoast_text = ''
+            for tag in soup.find_all(settings['tag']):
+                if settings['attrib'] and settings['name']:
+                    if tag.has_attr(settings['attrib']) and settings['name'] in tag.get(settings['attrib'], []):
+                        yoast_text = tag.get_text()
+                        break
+                else:
+                    yoast_text = tag.get_text()
+                    break
+            if yoast_text: 
+                return page_extraction.find_in_json_rec(json.loads(yoast_text), settings['json_pattern'])
+        elif settings['tag']:
+            for tag in soup.find_all(settings['tag']):
+                if settings['attrib'] and settings['name']:
+                    if tag.has_attr(settings['attrib']) and settings['name'] in tag.get(settings['attrib'], []):
+                        return tag.get('content', '') or tag.get_text() or tag.get('value', '')
+                elif settings['attrib']: 
+                    return tag.get(settings['attrib'])
+                else:
+                    return tag.get_text(separator=' ')
+        return None
+
+    metadata_settings = extractor.settings['metadata']
+    title = check_if_match(metadata_settings['title'])
+    date = check_if_match(metadata_settings['date'])
+    author = check_if_match(metadata_settings['author'])
+    date_fallback = False
+    if not date and metadata_settings['date']['use_fallback_method']:
+        date_match = re.search(extractor.date_pattern, soup.get_text())
+        if date_match:
+            date = date_match.group()
+            date_fallback = True
+    volume = None
+    if metadata_settings['volume']['extract_volume'] and title is not None:
+        vol_match = re.search(extractor.volume_pattern, title)
+        if vol_match:
+            volume = vol_match.group(1)
+    return title, date, date_fallback, author, volume
+
+
+def benchmark_metadata(folder, max_pages=None):
+    """
+    Runs the metadata extraction of each saved page with PageExtractor.extract_metadata and with the reference implementation,
+    comparing run time and results (the fallback date may only differ if it lies beyond fallback_window)
+    """
+    settings = handle_settings.read_settings_file(folder)
+    extractor = page_extraction.PageExtractor(settings)
+
+    reference_time = 0
+    extract_time = 0
+    num_pages = 0
+    mismatches = []
+    for url, html in html_archive.iter_saved_pages(folder, max_pages):
+        soup = BeautifulSoup(html, 'lxml')
+        start = time.perf_counter()
+        result = extractor.extract_metadata(soup)
+        extract_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        reference_result = reference_extract_metadata(extractor, soup)
+        reference_time += time.perf_counter() - start
+
+        num_pages += 1
+        if result != reference_result:
+            mismatches.append((url, reference_result, result))
+
+    print(f'{num_pages} pages')
+    print(f'reference:        {reference_time:.2f} s ({num_pages/reference_time:.1f} pages/s)')
+    print(f'extract_metadata: {extract_time:.2f} s ({num_pages/extract_time:.1f} pages/s)')
+    print(f'speedup {reference_time/extract_time:.1f}x, {len(mismatches)} pages with different metadata')
+    for url, reference_result, result in mismatches[:20]:
+        print(f'  different metadata: {url}\n    reference: {reference_result}\n    now:       {result}')
+
+
+def simulate_crawl(pages, start_url, queue, LinkFilter):
+    """
+    Replays a crawl over the saved pages, handing out urls in the order of queue
+    Args:
+    pages: dict url -> (hrefs, value, good) of all saved pages, urls not in it count as failed
+    queue: frontier.Frontier, or a set for the arbitrary order used before the frontier
+    Returns:
+    List with True for each loaded good page (text passing word_count_limit), in the order of loading
+    """
+    base_scheme = start_url.split('://')[0]
+    seen = {start_url}
+    depths = {start_url: 0}
+    queue.add(start_url) if isinstance(queue, set) else queue.add(start_url, 0)
+    results = []
+    while queue:
+        url = queue.pop()
+        hrefs, value, good = pages.get(url, ([], 0, False))
+        results.append(good)
+        depth = depths.pop(url) if isinstance(queue, set) else queue.get_depth(url)
+        for link in LinkFilter.filter_links(hrefs):
+            link = frontier.canonicalize_url(link, base_scheme)
+            if link not in seen:
+                seen.add(link)
+                if isinstance(queue, set):
+                    queue.add(link)
+                    depths[link] = depth + 1
+                else:
+                    queue.add(link, depth + 1)
+        if not isinstance(queue, set):
+            queue.done(url, value)
+    return results
+
+
+def benchmark_frontier(folder, max_pages=None):
+    """
+    Replays the crawl of the saved pages with the arbitrary order of a set, breadth first and with the priority frontier,
+    comparing how many good pages each has loaded after a share of all pages (as for a crawl stopped early)
+    """
+    settings = handle_settings.read_settings_file(folder)
+    extractor = page_extraction.PageExtractor(settings)
+    word_count_limit = settings['output']['file']['word_count_limit']
+    pages = {}
+    start_url = None
+    for url, html in html_archive.iter_saved_pages(folder, max_pages):
+        start_url = start_url or url
+        page_data = extractor.extract(html)
+        good = word_count_limit == -1 or len(page_data['text'].split()) >= word_count_limit
+        # As in Crawler._process_page, with the duplicate filter left out
+        value = 0.5*good + 0.2*(page_data['title'] is not None) + 0.2*(page_data['date'] is not None) + 0.1*min(1, page_data['percentage']/100)
+        pages[url] = (page_data['hrefs'], value, good)
+    print(f'{len(pages)} pages, {sum(good for _, _, good in pages.values())} good pages')
+
+    base_url = re.match(r"https?://[^/]*", start_url).group()
+    base_url_pattern = r'(https?://)?' + re.escape(re.match(r'https?://?([^[^/]+)', base_url).group(1))
+    shares = (0.1, 0.25, 0.5, 1)
+    print('good pages after loading ' + ', '.join(f'{share:.0%}' for share in shares))
+    for name, queue in (('set', set()), ('breadth_first', frontier.Frontier(prioritize=False)), ('priority', frontier.Frontier())):
+        LinkFilter = link_filter.LinkFilter(base_url, base_url_pattern, settings['general']['pages_to_be_ignored'])
+        results = simulate_crawl(pages, start_url, queue, LinkFilter)
+        counts = [sum(results[:max(1, round(share*len(results)))]) for share in shares]
+        print(f'{name:14s} ' + ', '.join(str(count) for count in counts) + f' ({len(results)} urls)')
+
+
+def get_page_result(url, page_data, written):
+    """
+    Returns the outcome of the extraction of a page, as compared by benchmark_pipeline (text as hash)
+    """
+    return {'url': url, 
+            'hrefs': len(page_data['hrefs']), 
+            'title': page_data['title'], 
+            'date': page_data['date'], 
+            'author': page_data['author'], 
+            'volume': page_data['volume'], 
+            'percentage': page_data['percentage'], 
+            'text': hashlib.blake2b(page_data['text'].encode('utf-8'), digest_size=16).hexdigest(), 
+            'written': written}
+
+
+def print_stage_table(stages):
+    """
+    Prints the per-stage summary of a CrawlStats snapshot
+    """
+    print(f'{"stage":12s} {"total s":>9s} {"mean ms":>9s} {"p50 ms":>9s} {"p95 ms":>9s} {"p99 ms":>9s}')
+    for stage, summary in stages.items():
+        print(f'{stage:12s} {summary["mean_ms"]*summary["count"]/1000:9.2f} {summary["mean_ms"]:9.3f} {summary["p50_ms"]:9.3f} '
+              f'{summary["p95_ms"]:9.3f} {summary["p99_ms"]:9.3f}')
+
+
+def benchmark_pipeline(folder, max_pages=None, save_results=None, compare_results=None):
+    """
+    Replays the saved pages through the whole extraction pipeline (parsing, metadata, pruning, html2text, duplicate filter), 
+    reporting throughput and time per stage, then peak memory per stage in a second pass (with tracemalloc, which slows everything down).
+    With save_results, the outcome of each page is saved - compare_results checks a later run against such a file, 
+    so that changes to the pipeline can be verified to give the same output.
+    """
+    settings = handle_settings.read_settings_file(folder)
+    extractor = page_extraction.PageExtractor(settings)
+    doublons_settings = settings['output']['file']['doublons']
+    duplicate_filter = remove_doublons.MinHashFilter(doublons_settings['threshold_value']) if doublons_settings['remove_doublons'] else None
+    pages = list(html_archive.iter_saved_pages(folder, max_pages))
+    num_bytes = sum(len(html) for _, html in pages)
+    print(f'{len(pages)} pages, {num_bytes/1e6:.1f} MB of html')
+
+    stats = crawl_stats.CrawlStats()
+    results = []
+    start = time.perf_counter()
+    for url, html in pages:
+        page_data = extractor.extract(html)
+        stats.record_timings(page_data['timings'])
+        written = None
+        if duplicate_filter is not None:
+            with crawl_stats.StageTimer(stats, 'dedup'):
+                written = duplicate_filter.check_and_add(page_data['text'], url, verbose=False)
+        results.append(get_page_result(url, page_data, written))
+    total_time = time.perf_counter() - start
+    print(f'total: {total_time:.2f} s ({len(pages)/total_time:.1f} pages/s, {num_bytes/1e6/total_time:.2f} MB/s)')
+    print_stage_table(stats.snapshot()['stages'])
+
+    # Memory: the steps of PageExtractor.extract one by one, peak of each measured on its own
+    peaks = {'parse': [], 'metadata': [], 'text': [], 'dedup': []}
+    duplicate_filter = remove_doublons.MinHashFilter(doublons_settings['threshold_value']) if doublons_settings['remove_doublons'] else None
+    tracemalloc.start()
+    for url, html in pages:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        soup = BeautifulSoup(html, 'lxml')
+        peaks['parse'].append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        extractor.extract_metadata(soup)
+        peaks['metadata'].append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        _, text, _ = extractor.extract_text(soup)
+        peaks['text'].append(tracemalloc.get_traced_memory()[1] - base)
+        del soup
+        if duplicate_filter is not None:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            duplicate_filter.check_and_add(text, url, verbose=False)
+            peaks['dedup'].append(tracemalloc.get_traced_memory()[1] - base)
+    index_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('peak memory per page (mean / max):')
+    for stage, values in peaks.items():
+        if values:
+            print(f'  {stage:10s} {sum(values)/len(values)/1e6:8.2f} MB / {max(values)/1e6:8.2f} MB')
+    print(f'  held after all pages (mainly duplicate index): {index_size/1e6:.2f} MB')
+
+    if save_results:
+        with open(save_results, 'w', encoding='utf-8') as fw:
+            for result in results:
+                fw.write(json.dumps(result, ensure_ascii=False) + '\n')
+        print(f'Saved the results of {len(results)} pages to {save_results}')
+    if compare_results:
+        with open(compare_results, 'r', encoding='utf-8') as fr:
+            expected = {result['url']: result for result in map(json.loads, fr)}
+        differences = []
+        for result in results:
+            expected_result = expected.get(result['url'])
+            if expected_result is None:
+                continue
+            fields = [field for field in result if result[field] != expected_result.get(field)]
+            if fields:
+                differences.append((result['url'], fields))
+        compared = sum(result['url'] in expected for result in results)
+        print(f'{compared} pages compared with {compare_results}, {len(differences)} with different results')
+        for url, fields in differences[:20]:
+            print(f'  different {", ".join(fields)}: {url}')
+
+
+class SyntheticSite:
+    """
+    Local HTTP server for the fetch benchmark: a website of *num_pages* generated pages (/page/0 to /page/n-1),
+    each with *links* links to other pages, *words* words of text and a delay of *latency* seconds before answering.
+    The same parameters always give the same site.
+    """
+    def __init__(self, num_pages=500, links=20, words=500, latency=0.05, seed=0) -> None:
+        self.num_pages = num_pages
+        self.links = links
+        self.words = words
+        self.latency = latency
+        self.seed = seed
+        self.requests = 0
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def get_page(self, index):
+        rng = random.Random(self.seed*1000003 + index)
+        vocabulary = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do', 
+                      'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua']
+        paragraphs = []
+        for start in range(0, self.words, 80):
+            paragraphs.append('<p>' + ' '.join(rng.choice(vocabulary) + str(rng.randrange(1000)) for _ in range(min(80, self.words - start))) + '</p>')
+        links = ''.join(f'<li><a href="/page/{rng.randrange(self.num_pages)}">Article {rng.randrange(10000)}</a></li>' for _ in range(self.links))
+        return (f'<html><head><title>Page {index}</title><meta property="article:published_time" content="2024-{1 + index%12:02d}-15"></head>'
+                f'<body><nav><ul>{links}</ul></nav><article><h1>Page {index}</h1>{"".join(paragraphs)}</article>'
+                f'<footer><p>Synthetic site for the fetch benchmark</p></footer></body></html>').encode('utf-8')
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _make_handler(self):
+        site = self
+        class SiteHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.requests += 1
+                time.sleep(site.latency)
+                match = re.fullmatch(r'/(?:page/(\d+))?', self.path)
+                index = int(match.group(1) or 0) if match else None
+                if index is None or index >= site.num_pages:
+                    self.send_error(404)
+                    return
+                body = site.get_page(index)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        return SiteHandler
+
+
+def benchmark_fetch(settings_path=None, num_pages=500, links=20, words=500, latency=50, concurrency=None, extraction_processes=None):
+    """
+    Crawls a SyntheticSite served on localhost with the real Crawler (end to end: fetching, extraction, output), 
+    reporting throughput and the time per stage recorded by crawl_stats
+    Args:
+    latency: Delay of the server per page in ms
+    concurrency: Pages loaded at the same time (concurrent_requests and max_connections_per_host), default: from the settings
+    """
+    site = SyntheticSite(num_pages, links, words, latency/1000)
+    with tempfile.TemporaryDirectory() as folder:
+        shutil.copyfile(settings_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings_template.yaml'), 
+                        os.path.join(folder, 'settings.yaml'))
+        settings = handle_settings.read_settings_file(folder)
+        settings['dir'] = folder
+        settings['output']['stats']['port'] = None
+        if concurrency:
+            settings['general']['concurrent_requests'] = concurrency
+            settings['general']['max_connections_per_host'] = concurrency
+        if extraction_processes is not None:
+            settings['general']['extraction_processes'] = extraction_processes
+        print(f'{num_pages} pages, {links} links and {words} words per page, {latency} ms latency, '
+              f'{settings["general"]["concurrent_requests"]} concurrent requests, {settings["general"]["extraction_processes"]} extraction processes')
+
+        # The sessions of the crawler go through the VPN proxy - the local server is reached directly
+        with mock.patch.object(crawler.Crawler, '_open_session', lambda self: requests.Session()):
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                site_crawler = crawler.Crawler(settings, site.url)
+                site_crawler.scrape()
+            total_time = time.perf_counter() - start
+    site.close()
+
+    snapshot = site_crawler.stats.snapshot()
+    num_loaded = snapshot['counters'].get('pages', 0)
+    num_bytes = snapshot['counters'].get('bytes', 0)
+    print(f'{num_loaded} pages loaded ({site.requests} requests) in {total_time:.2f} s: '
+          f'{num_loaded/total_time:.1f} pages/s, {num_bytes/1e6/total_time:.2f} MB/s, {snapshot["counters"].get("errors", 0)} errors')
+    print_stage_table(snapshot['stages'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks on the output directory of an earlier crawl')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    links_parser = subparsers.add_parser('links', help='Link filtering in _extract_links')
+    links_parser.add_argument('folder', help='Output directory containing the html archive and settings.yaml')
+    links_parser.add_argument('--start-url', default=None, help='Starting page of the crawl (default: first saved page)')
+    links_parser.add_argument('--max-pages', type=int, default=None)
+    links_parser.add_argument('--repeat', type=int, default=5)
+
+    prune_parser = subparsers.add_parser('prune', help='Tree pruning in _extract_text, checks that the extracted text is unchanged')
+    prune_parser.add_argument('folder', help='Output directory containing the html archive and settings.yaml')
+    prune_parser.add_argument('--max-pages', type=int, default=None)
+
+    dedup_parser = subparsers.add_parser('dedup', help='Duplicate filter in write_output, checks that the decisions are unchanged')
+    dedup_parser.add_argument('folder', help='Output directory containing the html archive and settings.yaml')
+    dedup_parser.add_argument('--max-pages', type=int, default=None)
+    dedup_parser.add_argument('--threshold', type=float, default=None, help='Default: threshold_value from the settings')
+
+    metadata_parser = subparsers.add_parser('metadata', help='Metadata extraction in extract_metadata, checks that the results are unchanged')
+    metadata_parser.add_argument('folder', help='Output directory containing the html archive and settings.yaml')
+    metadata_parser.add_argument('--max-pages', type=int, default=None)
+
+    frontier_parser = subparsers.add_parser('frontier', help='Queue order, replays the crawl and counts good pages loaded early')
+    frontier_parser.add_argument('folder', help='Output directory containing the html archive and settings.yaml')
+    frontier_parser.add_argument('--max-pages', type=int, default=None)
+
+    pipeline_parser = subparsers.add_parser('pipeline', help='Whole extraction pipeline, time and memory per stage, optionally compared with the results of an earlier run')
+    pipeline_parser.add_argument('folder', help='Output directory containing the html archive (or all_pages_html.txt) and settings.yaml')
+    pipeline_parser.add_argument('--max-pages', type=int, default=None)
+    pipeline_parser.add_argument('--save-results', default=None, help='File to save the results of each page to (.jsonl)')
+    pipeline_parser.add_argument('--compare-results', default=None, help='File saved with --save-results by an earlier run, to compare the results with')
+
+    fetch_parser = subparsers.add_parser('fetch', help='End to end crawl of a synthetic website served on localhost')
+    fetch_parser.add_argument('--settings', default=None, help='Settings file (default: settings_template.yaml)')
+    fetch_parser.add_argument('--pages', type=int, default=500, help='Number of pages of the website')
+    fetch_parser.add_argument('--links', type=int, default=20, help='Links per page')
+    fetch_parser.add_argument('--words', type=int, default=500, help='Words of text per page')
+    fetch_parser.add_argument('--latency', type=float, default=50, help='Delay of the server per page in ms')
+    fetch_parser.add_argument('--concurrency', type=int, default=None, help='Pages loaded at the same time (default: from the settings)')
+    fetch_parser.add_argument('--extraction-processes', type=int, default=None, help='Default: from the settings')
+
+    args = parser.parse_args()
+    if args.benchmark == 'links':
+        benchmark_links(args.folder, args.start_url, args.max_pages, args.repeat)
+    elif args.benchmark == 'prune':
+        benchmark_prune(args.folder, args.max_pages)
+    elif args.benchmark == 'dedup':
+        benchmark_dedup(args.folder, args.max_pages, args.threshold)
+    elif args.benchmark == 'metadata':
+        benchmark_metadata(args.folder, args.max_pages)
+    elif args.benchmark == 'frontier':
+        benchmark_frontier(args.folder, args.max_pages)
+    elif args.benchmark == 'pipeline':
+        benchmark_pipeline(args.folder, args.max_pages, args.save_results, args.compare_results)
+    elif args.benchmark == 'fetch':
+        benchmark_fetch(args.settings, args.pages, args.links, args.words, args.latency, args.concurrency, args.extraction_processes)
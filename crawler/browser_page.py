@@ -0,0 +1,228 @@
+import time
+from urllib.parse import urlsplit
+
+from page_extraction import METADATA_FIELDS
+
+
+# Runs in every document before its own scripts: notes the time of the last change to the content of the page
+# (attribute changes are left out, as animations and carousels change them continuously)
+MUTATION_OBSERVER_SCRIPT = """
+window.__lastMutation = performance.now();
+new MutationObserver(() => { window.__lastMutation = performance.now(); })
+    .observe(document, {childList: true, subtree: true, characterData: true});
+"""
+# Reduces the DOM of a rendered page before it is transferred: returns the hrefs of all links (also those in hidden menus,
+# which are collected first), then removes the elements of the body matching remove_selectors, all invisible elements
+# and all elements outside of those matching include_selectors (kept with their subtree and ancestors, as in dom_pruning.prune_tree).
+# As the text outside the included elements never reaches the extraction, the share of the visible text they contain is returned,
+# measured with innerText (without whitespace) before and after this last step.
+# Elements matching keep_selectors (metadata) are kept with their ancestors, the head is never changed.
+# Elements are checked in document order, so that nothing inside an already removed element is checked again.
+REDUCE_DOM_SCRIPT = """
+(options) => {
+    const hrefs = Array.from(document.querySelectorAll('a[href]'), a => a.getAttribute('href'));
+    const body = document.body;
+    if (!body) return {hrefs: hrefs, removed: 0, text_share: null};
+    const select = selector => {
+        try { return Array.from(body.querySelectorAll(selector)); } catch (e) { return []; }  // Invalid selector in the settings
+    };
+    const addWithAncestors = (set, el) => {
+        for (let node = el; node && node !== body && !set.has(node); node = node.parentElement) set.add(node);
+    };
+    const keep = new Set();
+    for (const selector of options.keep_selectors) select(selector).forEach(el => addWithAncestors(keep, el));
+    let removed = 0;
+    const remove = el => {
+        if (el.isConnected && !keep.has(el)) { el.remove(); removed++; }
+    };
+    for (const selector of options.remove_selectors) select(selector).forEach(remove);
+    for (const el of body.querySelectorAll('*')) {
+        if (!el.isConnected || keep.has(el)) continue;
+        const style = window.getComputedStyle(el);
+        // Elements collapsed to zero width or height only hide content which does not overflow them
+        // (not e.g. containers of floating elements, or elements with display: contents)
+        const collapsed = (el.offsetWidth === 0 && style.overflowX !== 'visible') || (el.offsetHeight === 0 && style.overflowY !== 'visible');
+        if (style.display === 'none' || style.visibility === 'hidden' || style.opacity === '0' || collapsed) remove(el);
+    }
+    // Without any match, nothing is removed - the page is left to the extraction, as for the other patterns
+    let text_share = null;
+    const included = options.include_selectors.flatMap(select).filter(el => el.isConnected);
+    if (included.length) {
+        const textLength = () => body.innerText.replace(/\\s+/g, '').length;
+        const completeLength = textLength();
+        const ancestors = new Set();
+        included.forEach(el => addWithAncestors(ancestors, el));
+        const subtrees = new Set(included);
+        for (const el of body.querySelectorAll('*')) {
+            if (!el.isConnected) continue;
+            if (subtrees.has(el) || subtrees.has(el.parentElement)) subtrees.add(el);
+            else if (!ancestors.has(el)) remove(el);
+        }
+        text_share = completeLength > 0 ? textLength() / completeLength : 1;
+    }
+    return {hrefs: hrefs, removed: removed, text_share: text_share};
+}
+"""
+# Requests which stay open as long as the page is (server-sent events) would never let the network become idle
+UNTRACKED_RESOURCE_TYPES = ('eventsource', 'websocket')
+# Time (in s) between two checks whether the page has settled
+POLL_INTERVAL = 0.05
+
+
+class ResourceBlocker:
+    """
+    Route handler for a playwright browser context, aborting requests for resources the crawler does not need:
+    all requests of the resource types *resource_types* (e.g. 'image', 'media', 'font')
+    and all requests to *domains* and their subdomains (e.g. trackers, ad servers).
+    Navigation requests (the page itself) are never blocked.
+    """
+    def __init__(self, resource_types=None, domains=None, stats=None) -> None:
+        """
+        Args:
+        stats: CrawlStats counting the blocked requests, if given
+        """
+        self.resource_types = set(resource_types or [])
+        self.domains = tuple(domain.lower().lstrip('.') for domain in domains or [])
+        self.stats = stats
+
+    def __bool__(self):
+        return bool(self.resource_types or self.domains)
+
+    def is_blocked(self, url, resource_type):
+        if resource_type in self.resource_types:
+            return True
+        if self.domains:
+            host = (urlsplit(url).hostname or '').lower()
+            return any(host == domain or host.endswith('.' + domain) for domain in self.domains)
+        return False
+
+    def handle_route(self, route):
+        request = route.request
+        if not request.is_navigation_request() and self.is_blocked(request.url, request.resource_type):
+            if self.stats is not None:
+                self.stats.count('blocked_requests')
+            route.abort('blockedbyclient')
+        else:
+            route.continue_()
+
+
+class NetworkTracker:
+    """
+    Counts the requests of a playwright page still running, from its request events
+    (only updated while playwright is waiting for the page, e.g. in page.wait_for_timeout)
+    """
+    def __init__(self, page) -> None:
+        self.in_flight = set()
+        self.last_activity = time.monotonic()
+        page.on('request', self._on_start)
+        page.on('requestfinished', self._on_end)
+        page.on('requestfailed', self._on_end)
+
+    def idle_time(self):
+        """
+        Returns the time (in s) since the last request ended, 0 while requests are running
+        """
+        return 0 if self.in_flight else time.monotonic() - self.last_activity
+
+    def _on_start(self, request):
+        if request.resource_type not in UNTRACKED_RESOURCE_TYPES:
+            self.in_flight.add(request)
+            self.last_activity = time.monotonic()
+
+    def _on_end(self, request):
+        if request in self.in_flight:
+            self.in_flight.discard(request)
+            self.last_activity = time.monotonic()
+
+
+def wait_until_settled(page, network, quiet_time, timeout):
+    """
+    Waits until no request is running and the content of the page has not changed for *quiet_time* seconds,
+    at most *timeout* seconds
+    Args:
+    network: NetworkTracker of the page
+    Returns:
+    True if the page settled, False if the timeout was reached first
+    """
+    end = time.monotonic() + timeout
+    while True:
+        page.wait_for_timeout(POLL_INTERVAL*1000)
+        dom_quiet_time = page.evaluate('() => (performance.now() - (window.__lastMutation || 0))/1000')
+        if min(network.idle_time(), dom_quiet_time) >= quiet_time:
+            return True
+        if time.monotonic() >= end:
+            return False
+
+
+def scroll_to_bottom(page, network, quiet_time, timeout, max_steps):
+    """
+    Scrolls down one screen height at a time, until the end of the page. Steps which make the page load or change
+    something wait until it has settled again, others go on at once - at the end, the page is given time to load more content
+    (infinite scroll), after which scrolling continues. Stops after *max_steps* steps.
+    Args:
+    timeout: Upper bound (in s) of each wait, see wait_until_settled
+    Returns:
+    Number of steps scrolled
+    """
+    for step in range(1, max_steps + 1):
+        activity = network.last_activity
+        at_end, scroll_time = page.evaluate("""() => {
+            window.scrollBy(0, window.innerHeight);
+            return [window.scrollY + window.innerHeight >= document.documentElement.scrollHeight - 2, performance.now()];
+        }""")
+        page.wait_for_timeout(POLL_INTERVAL*1000)
+        dom_changed = page.evaluate('() => window.__lastMutation || 0') > scroll_time
+        if at_end or dom_changed or network.last_activity != activity or network.in_flight:
+            wait_until_settled(page, network, quiet_time, timeout)
+            if at_end and page.evaluate('() => window.scrollY + window.innerHeight >= document.documentElement.scrollHeight - 2'):
+                return step
+    return max_steps
+
+
+def _css_string(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def get_metadata_selectors(metadata_settings):
+    """
+    Returns CSS selectors for the tags configured in metadata (fields without tag are only found in the head or in JSON scripts),
+    which are kept when reducing the DOM - together with all JSON scripts
+    """
+    selectors = ['script[type*="json"]']
+    for field in METADATA_FIELDS:
+        field_settings = metadata_settings[field]
+        if field_settings['tag']:
+            # As in PageExtractor.extract_metadata, the name only has to be contained in the attribute
+            name = field_settings['name'] or ''
+            selectors.append(field_settings['tag'] + (f'[{field_settings["attrib"]}*={_css_string(name)}]' if field_settings['attrib'] and name else ''))
+    return selectors
+
+
+def get_pattern_selectors(patterns):
+    """
+    Returns CSS selectors matching the same tags as the patterns of text_extraction (specific_tags_include, specific_tags_exclude)
+    in PageExtractor.extract_text: tag, and/or attrib with all words of name among its values
+    """
+    selectors = []
+    for pattern in patterns or []:
+        if pattern['attrib'] and not pattern['name']:
+            continue
+        selector = pattern['tag'] or ''
+        if pattern['attrib']:
+            selector += ''.join(f'[{pattern["attrib"]}~={_css_string(name)}]' for name in pattern['name'].split())
+        if selector:
+            selectors.append(selector)
+    return selectors
+
+
+def reduce_dom(page, keep_selectors, include_selectors, remove_selectors):
+    """
+    Runs REDUCE_DOM_SCRIPT on the page - page.content() then only returns the visible (and included) part of the body
+    Returns:
+    hrefs of all links of the page before the reduction, number of removed elements,
+    share of the visible text kept by include_selectors (None if they were not applied)
+    """
+    result = page.evaluate(REDUCE_DOM_SCRIPT, {'keep_selectors': keep_selectors,
+                                               'include_selectors': include_selectors,
+                                               'remove_selectors': remove_selectors})
+    return result['hrefs'], result['removed'], result['text_share']
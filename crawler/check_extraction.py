@@ -0,0 +1,297 @@
+"""
+Regression check of the text extraction: runs PageExtractor.extract_text and the implementation it replaced
+(Crawler._extract_text of the original crawler, copied unchanged below) on the pages saved in regression_pages,
+with several text_extraction settings and both parsers used by the crawler, and fails if any output differs.
+
+Usage:
+python crawler/check_extraction.py [--pages DIR] [--verbose]
+"""
+import argparse
+import copy
+import os
+import re
+import sys
+
+from bs4 import BeautifulSoup, Tag, NavigableString
+import html2text
+import yaml
+
+import page_extraction
+
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regression_pages')
+# text_extraction settings each page is extracted with, on top of settings_template.yaml
+EMPTY_PATTERNS = [{'tag': None, 'attrib': None, 'name': None}]
+SETTINGS_VARIANTS = {
+    'template': {},
+    'all_text': {'only_paragraphs_and_headers': False},
+    'only_paragraphs': {'only_paragraphs': True, 'only_paragraphs_and_headers': False},
+    'include_tag': {'only_paragraphs_and_headers': False, 
+                    'specific_tags_include': [{'tag': 'article', 'attrib': None, 'name': None}, {'tag': 'td', 'attrib': 'class', 'name': 'main-col'}]},
+    'include_attrib': {'only_paragraphs_and_headers': False, 
+                       'specific_tags_include': [{'tag': None, 'attrib': 'class', 'name': 'content'}]},
+    'exclude': {'specific_tags_exclude': [{'tag': 'div', 'attrib': 'class', 'name': 'share social'}, {'tag': 'footer', 'attrib': None, 'name': None}, 
+                                          {'tag': None, 'attrib': 'class', 'name': 'reviews'}]},
+    'include_and_exclude': {'only_paragraphs_and_headers': False, 
+                            'specific_tags_include': [{'tag': 'main', 'attrib': None, 'name': None}, {'tag': 'div', 'attrib': 'class', 'name': 'thread'}], 
+                            'specific_tags_exclude': [{'tag': 'aside', 'attrib': None, 'name': None}, {'tag': 'blockquote', 'attrib': None, 'name': None}]},
+}
+# lxml for pages rendered by playwright, html.parser for pages loaded with requests (as in the original crawler)
+PARSERS = ('lxml', 'html.parser')
+
+
+class BaselineExtractor:
+    """
+    Text extraction as implemented in the original crawler, used as reference - the two methods are exact copies, do not change them
+    """
+    def __init__(self, settings) -> None:
+        self.settings = settings
+
+    def _extract_text(self, soup):     
+         
+        def get_check_pattern_func(valid_patterns:list): 
+            """
+            Returns a filter function, which matches it's tag input to the valid patterns
+            Args: 
+            pattern: A list of dicts, with a single tag configuration (tag, attrib, name) per dict.  
+                All 2 keys have to be presents, values may be empty strings
+            """
+            def check_pattern_func(tag): 
+                """
+                Filter function, checks if input matches valid patterns. 
+                """
+                if tag is not None: 
+                    for pattern in valid_patterns: 
+                        if pattern['tag'] and not pattern['attrib']: # Only tag specified
+                            if tag.name == pattern['tag']: 
+                                return True
+                        elif pattern['tag'] and pattern['attrib']: # Tag and attrib and name specified
+                            assert pattern['name'], "If an 'attrib' is used as selector, please also add a value for 'name'!"
+                            name_values_for_attrib = tag.get(pattern['attrib'], '')
+                            name_values_for_attrib = name_values_for_attrib if isinstance(name_values_for_attrib, list) else name_values_for_attrib.split()
+                            if tag.name == pattern['tag']: 
+                                all_names_match = True
+                                for name in pattern['name'].split():
+                                    if name not in name_values_for_attrib: 
+                                        all_names_match = False
+                                if all_names_match:
+                                    return True
+                        else: # Only attrib and name specified
+                            assert pattern['name'], "If an 'attrib' is used as selector, please also add a value for 'name'!"
+                            name_values_for_attrib = tag.get(pattern['attrib'], '')
+                            name_values_for_attrib = name_values_for_attrib if isinstance(name_values_for_attrib, list) else name_values_for_attrib.split()
+                            all_names_match = True
+                            for name in pattern['name'].split():
+                                if name not in name_values_for_attrib: 
+                                    all_names_match = False
+                            if all_names_match:
+                                return True
+                return False
+            
+            return check_pattern_func
+        
+        def decompose_tree(tag, match_func, del_matches=False):
+            """
+            Decomposes the bs4 soup: \n
+            (del_matches = False)   Keep only matched tags, but with general structure intact \n
+            (del_matches = True)    Delete all matched tags
+            Args: 
+            match func: A function checking whether a tag has one of the selected patterns - returns True or False
+            del_matches: If True, all matching tags are deleted. If False, all matching tags are kept, any other deleted. 
+            """
+            def _decompose_rec(tag, match_func, del_matches, level): 
+                """
+                Leaves root intact, decomposes anything else recursively. 
+                """
+                for c in list(tag.children): 
+                    if isinstance(c, NavigableString): 
+                        c.replace_with('')
+                    elif isinstance(c, Tag): 
+                        # Deleting matches from tree
+                        if del_matches: 
+                            if match_func(c): 
+                                c.decompose()
+                            elif c.find(match_func): 
+                                _decompose_rec(c, match_func, del_matches, level+1)
+                        # Keep only matches in tree
+                        else: 
+                            if match_func(c): # c matches a pattern
+                                pass # Keep tag and children
+                            elif c.find(match_func): # descendants of c match patterns
+                                _decompose_rec(c, match_func, del_matches, level+1)
+                            else: # c and descendants don't match patterns (due to recursive nature: parents also don't match patterns)
+                                c.decompose()
+                    else: 
+                        try: 
+                            c.decompose()
+                        except Exception as e: 
+                            print(e)
+
+                if not level == 0: 
+                    if not tag.get_text(strip=True): # (This should not delete <br> as those are inline and thus protected where matched)
+                        tag.decompose() 
+
+            level = 0
+            _decompose_rec(tag, match_func, del_matches, level)
+
+
+        # Remove invisible elements
+        if soup.find(lambda tag: tag.has_attr('data-visible')): # If playwright was used
+            pass
+            # Deletes all non-visible elements as long as they are tags (pure strings directly in the html are ignored)
+            match_func = lambda tag: (not tag.has_attr('data-visible') or tag['data-visible'] != 'true') if isinstance(tag, Tag) else True
+            #decompose_tree(soup, match_func, del_matches=True)
+        else: 
+            match_func = lambda tag: ('display: none' or 'visibility: hidden' or 'opacity: 0' or 'font-size:0px') in tag.get('style', '').lower()
+            decompose_tree(soup, match_func, del_matches=True)
+
+        # Remove all links without text and all images
+        match_func = lambda tag: tag.name == 'img' or (tag.name == 'a' and tag.get_text(strip=True) == '')
+        decompose_tree(soup, match_func, del_matches=True)
+
+        complete_text = self._html_to_text(soup)
+
+        extraction_settings = self.settings['text_extraction']
+        patterns_include = extraction_settings['specific_tags_include']
+        patterns_exclude = extraction_settings['specific_tags_exclude']
+
+        include_tags_specified = False
+        exclude_tags_specified = False
+        for el in patterns_include: 
+            if el['tag'] or el['attrib'] or el['name']: 
+                include_tags_specified = True
+                break
+        for el in patterns_exclude: 
+            if el['tag'] or el['attrib'] or el['name']: 
+                exclude_tags_specified = True
+                break
+        tree_pruned = False
+        # Extract text by tags if settings contain specified tags
+        if include_tags_specified: 
+            include_match_func = get_check_pattern_func(patterns_include)
+            decompose_tree(soup, include_match_func)
+            tree_pruned = True
+        if exclude_tags_specified: 
+            exclude_match_func = get_check_pattern_func(patterns_exclude)
+            decompose_tree(soup, exclude_match_func, del_matches=True)
+            tree_pruned = True
+        # Extract text by <p> (html paragraphs)
+        if extraction_settings['only_paragraphs']:
+            include_match_func = get_check_pattern_func([{'tag': 'p', 'attrib': '', 'name': ''}])
+            decompose_tree(soup, include_match_func)
+            tree_pruned = True
+        # Extract text by paragraphs and headers
+        elif extraction_settings['only_paragraphs_and_headers']:
+            include_match_func = get_check_pattern_func([{'tag': 'p', 'attrib': '', 'name': ''}, \
+                                                {'tag': 'h1', 'attrib': '', 'name': ''}, \
+                                                {'tag': 'h2', 'attrib': '', 'name': ''}, \
+                                                {'tag': 'h3', 'attrib': '', 'name': ''}, \
+                                                {'tag': 'h4', 'attrib': '', 'name': ''}, \
+                                                {'tag': 'h5', 'attrib': '', 'name': ''}, \
+                                                {'tag': 'h6', 'attrib': '', 'name': ''}])
+            decompose_tree(soup, include_match_func)
+            tree_pruned = True
+        if tree_pruned: 
+            text = self._html_to_text(soup)
+        else: # Fallback option: Extract all text
+            text = complete_text
+        percentage = round((len(text) / len(complete_text) if len(complete_text) > 0 else 1)*100)
+
+        return complete_text, text, percentage
+
+
+    def _html_to_text(self, soup): 
+        """
+        Converts the soup to plain text using html2text. 
+        Creates a new html2text object each time to reduce the impact of a html2text bug, 
+        where part of the content is accumulated at the end of the Markdown text. 
+        *markdownify* would be an alternative, but html2text output is more similar to the website formatting
+        """
+        def text_cleanup(text):
+            """
+            Can be used to clean the Markdown output of html2text. 
+            """
+            # Cleanup spaces
+            text = re.sub(r'---LINE_BREAK_PLACEHOLDER---', '\n', text)
+            text = re.sub(r'[\u200B-\u200D\uFEFF]', ' ', text)# Remove zero-width-spaces
+            text = re.sub(r'^\s+\n', '', text) # Remove spaces at start of text
+            #text = re.sub(r'[^\S\r\n]*\n[^\S\r\n]*',  '\n', text) # Summarize leading spaces + linebreak + trailing spaces as single linebreak
+            text = re.sub(r'\s+\Z', '', text) # Remove trailing whitespaces - leading whitespaces already removed by summarizing
+            text = re.sub(r'\n\s*\n', '\n\n', text) # Combine multi-linebreaks into one
+
+            # Cleanup markdown
+            # To reformat / clean up links: (?<![!\\\s*_])\[\s*(.*?)\s*\]
+
+            #text = re.sub(r'^[^\S\r\n]*\\?-\s*', '- ', text, flags=re.MULTILINE) # Escapte Aufzählungsstriche zu normalen 
+            #text = re.sub(r'\\\.', '.', text) # Escapte Punkte zu normalen Punkten
+            #text = re.sub(r'^>\s*', r'', text, flags=re.MULTILINE) # Einschub mit > entfernen
+            #text = re.sub(r'^([^\S\r\n]*\*[^\S\r\n]*){2,}', r'* ', text, flags=re.MULTILINE) # Mehrere Sterne zu einem 
+            #text = re.sub(r'^([^\S\r\n]*\*[^\S\r\n]*)+\n', r'\n', text, flags=re.MULTILINE) # Verirrte Sterne löschen
+            
+            return text
+        
+        h = html2text.HTML2Text()
+        h.ignore_links = False
+        h.ignore_images = True
+        h.single_line_break = False
+        h.asterisk_emphasis = True
+        h.body_width = 0
+        h.unicode_snob = True
+        h.ignore_tables = True
+        h.escape_snob = True
+        h.dash_unordered_list = True
+        h.protect_links = True
+        #print(soup)
+        return text_cleanup(h.handle(str(soup)))
+
+
+def get_settings(variant):
+    template_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(template_dir, 'settings_template.yaml'), 'r') as fr:
+        settings = yaml.safe_load(fr)
+    extraction_settings = settings['text_extraction']
+    extraction_settings['specific_tags_include'] = copy.deepcopy(EMPTY_PATTERNS)
+    extraction_settings['specific_tags_exclude'] = copy.deepcopy(EMPTY_PATTERNS)
+    extraction_settings.update(copy.deepcopy(SETTINGS_VARIANTS[variant]))
+    return settings
+
+
+def check_pages(pages_dir, verbose=False):
+    """
+    Returns:
+    Number of checked extractions, list of (page, settings variant, parser) with a different output
+    """
+    paths = sorted(os.path.join(pages_dir, name) for name in os.listdir(pages_dir) if name.endswith('.html'))
+    checked_count = 0
+    mismatches = []
+    for variant in SETTINGS_VARIANTS:
+        settings = get_settings(variant)
+        extractor = page_extraction.PageExtractor(settings)
+        baseline_extractor = BaselineExtractor(settings)
+        for path in paths:
+            with open(path, 'rb') as fr:
+                html = fr.read()
+            for parser in PARSERS:
+                result = extractor.extract_text(BeautifulSoup(html, parser))
+                reference_result = baseline_extractor._extract_text(BeautifulSoup(html, parser))
+                checked_count += 1
+                if result != reference_result:
+                    mismatches.append((os.path.basename(path), variant, parser))
+                    if verbose:
+                        print(f'--- {os.path.basename(path)} ({variant}, {parser})')
+                        print(f'reference: {reference_result!r}')
+                        print(f'current:   {result!r}')
+    return checked_count, mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checks that the text extraction gives exactly the same output as the original implementation on saved pages')
+    parser.add_argument('--pages', default=PAGES_DIR, help='Directory with .html pages (default: regression_pages)')
+    parser.add_argument('--verbose', action='store_true', help='Print both outputs of each page with a different output')
+    args = parser.parse_args()
+
+    checked_count, mismatches = check_pages(args.pages, args.verbose)
+    for page, variant, parser_name in mismatches:
+        print(f'DIFFERENT: {page} ({variant}, {parser_name})')
+    print(f'{checked_count} extractions checked, {len(mismatches)} with a different output')
+    sys.exit(1 if mismatches or not checked_count else 0)
@@ -0,0 +1,215 @@
+import collections
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+
+
+STATS_FILENAME = 'crawl_stats.json'
+# Durations kept per stage for the percentiles - older ones are dropped
+ROLLING_WINDOW = 2000
+# Period (in s) over which the current rates (pages/s, bytes/s, errors) are computed
+RATE_WINDOW = 60
+
+
+class CrawlStats:
+    """
+    Timings and counters of a crawl, recorded from any thread.
+
+    Each stage (fetch, parse, html2text, ...) keeps the durations of its last ROLLING_WINDOW pages,
+    from which percentiles are computed only when a snapshot is taken - recording a value is a single append,
+    so the instrumentation can always stay active.
+    Counters (pages, bytes, errors) are totals, the rates are computed over the last RATE_WINDOW seconds.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.durations = {} # stage -> deque of the last durations (in s)
+        self.stage_totals = {} # stage -> number of timings, total duration
+        self.counters = collections.Counter()
+        self.errors = collections.Counter() # error description -> number of pages
+        # (time, counters) at each snapshot, for the rates
+        self.history = collections.deque()
+
+    def record(self, stage, duration):
+        """
+        Adds the duration (in s) of a stage for one page
+        """
+        with self.lock:
+            if stage not in self.durations:
+                self.durations[stage] = collections.deque(maxlen=ROLLING_WINDOW)
+                self.stage_totals[stage] = [0, 0.0]
+            self.durations[stage].append(duration)
+            totals = self.stage_totals[stage]
+            totals[0] += 1
+            totals[1] += duration
+
+    def record_timings(self, timings):
+        """
+        Adds several stages at once: dict stage -> duration, e.g. the timings returned with an extraction
+        """
+        for stage, duration in timings.items():
+            self.record(stage, duration)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def count_error(self, error):
+        """
+        Counts a failed page attempt, grouped by its error (e.g. 'HTTP 503', 'Timeout')
+        """
+        with self.lock:
+            self.counters['errors'] += 1
+            self.errors[error] += 1
+
+    def snapshot(self, gauges=None):
+        """
+        Args:
+        gauges: dict of current values to add, e.g. queue size
+        Returns:
+        dict with totals, current rates and per-stage percentiles (in ms), ready to be written as JSON
+        """
+        now = time.time()
+        with self.lock:
+            durations = {stage: list(values) for stage, values in self.durations.items()}
+            stage_totals = {stage: tuple(totals) for stage, totals in self.stage_totals.items()}
+            counters = dict(self.counters)
+            errors = dict(self.errors.most_common(20))
+            self.history.append((now, counters))
+            while len(self.history) > 2 and self.history[1][0] <= now - RATE_WINDOW:
+                self.history.popleft()
+            window_start, window_counters = self.history[0]
+
+        elapsed = max(now - self.start_time, 1e-9)
+        window = now - window_start
+        def rate(name, since_start=False):
+            if since_start:
+                return round(counters.get(name, 0) / elapsed, 3)
+            return round((counters.get(name, 0) - window_counters.get(name, 0)) / window, 3) if window > 0 else None
+
+        attempts = counters.get('pages', 0) + counters.get('errors', 0)
+        stats = {'time': now,
+                 'elapsed': round(elapsed, 1),
+                 'counters': counters,
+                 'rates': {'pages_per_s': rate('pages'),
+                           'bytes_per_s': rate('bytes'),
+                           'errors_per_s': rate('errors'),
+                           'pages_per_s_total': rate('pages', since_start=True),
+                           'bytes_per_s_total': rate('bytes', since_start=True)},
+                 'error_rate': round(counters.get('errors', 0) / attempts, 4) if attempts else 0,
+                 'errors': errors,
+                 'stages': {stage: self._summarize(values, *stage_totals[stage]) for stage, values in durations.items()}}
+        if gauges:
+            stats['gauges'] = gauges
+        return stats
+
+    def _summarize(self, values, count, total):
+        """
+        Returns count and mean (over all pages) and p50/p95/p99/max (over the rolling window) in ms
+        """
+        values.sort()
+        def percentile(p):
+            return round(1000*values[min(len(values) - 1, int(p*len(values)))], 3)
+        return {'count': count,
+                'mean_ms': round(1000*total/count, 3),
+                'p50_ms': percentile(0.5),
+                'p95_ms': percentile(0.95),
+                'p99_ms': percentile(0.99),
+                'max_ms': round(1000*values[-1], 3)}
+
+
+class StageTimer:
+    """
+    Context manager timing a stage: with StageTimer(stats, 'parse'): ...
+    """
+    def __init__(self, stats, stage) -> None:
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class StatsReporter:
+    """
+    Writes snapshots of CrawlStats every *interval* seconds to crawl_stats.json in the output directory
+    and, if a port is given, serves the current snapshot as JSON over HTTP (GET /stats on localhost).
+    """
+    def __init__(self, stats, folder, interval=10, port=None, get_gauges=None) -> None:
+        """
+        Args:
+        get_gauges: Function without arguments returning a dict of current values (queue size etc.) added to each snapshot
+        """
+        self.stats = stats
+        self.path = os.path.join(folder, STATS_FILENAME)
+        self.interval = interval
+        self.get_gauges = get_gauges
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.server = None
+        if port:
+            self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port), self._make_handler())
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            logging.info(f"Crawl stats served on http://127.0.0.1:{self.server.server_port}/stats\n")
+            print(f"Crawl stats served on http://127.0.0.1:{self.server.server_port}/stats")
+        self.thread.start()
+
+    def get_snapshot(self):
+        return self.stats.snapshot(self.get_gauges() if self.get_gauges else None)
+
+    def write(self):
+        """
+        Writes a snapshot to the stats file - replaced atomically, so readers never see a partial file
+        """
+        snapshot = self.get_snapshot()
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as fw:
+            json.dump(snapshot, fw, indent=1)
+        os.replace(temp_path, self.path)
+        return snapshot
+
+    def close(self):
+        """
+        Stops reporting, after writing a last snapshot
+        """
+        self.stop_event.set()
+        self.thread.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        snapshot = self.write()
+        logging.info(f"Crawl stats: {json.dumps(snapshot)}\n")
+
+    def _work(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e: # Monitoring must never stop the crawl
+                logging.warning(f"Could not write crawl stats: {e}\n")
+
+    def _make_handler(self):
+        reporter = self
+        class StatsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/stats'):
+                    self.send_error(404)
+                    return
+                body = json.dumps(reporter.get_snapshot()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        return StatsHandler
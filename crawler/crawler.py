@@ -1,112 +1,436 @@
 import requests
 from requests.exceptions import ConnectionError, Timeout, RequestException
-from bs4 import BeautifulSoup, Tag, NavigableString
+import hashlib
+import heapq
+import random
 import re
+import time
 import handle_output
+import fetcher
+import crawl_stats
+import browser_page
+import frontier
+import link_filter
+import page_extraction
+import site_seeding
 import logging
-import html2text
-import json
+import multiprocessing
+from concurrent import futures
+
+
+# Sitemap entries are added to the queue in batches of this size
+SITEMAP_BATCH_SIZE = 10000
+# Status codes of temporary errors (e.g. too many requests, overloaded server) - pages are loaded again, see general.max_attempts
+RETRYABLE_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
 
 
 class Crawler: 
-    def __init__(self, settings, starting_url) -> None:
-        # Browser config
+    def __init__(self, settings, starting_url, resume=False, request_slots=None) -> None:
+        """
+        Args: 
+        resume: Continue the crawl saved in settings['dir']
+        request_slots: Semaphore shared with other crawls running at the same time, limiting their requests in total (see run_batch.py)
+        """
+        # Fetch config
         self.playwright_mode = settings['general']['playwright']
-        if self.playwright_mode:
-            from playwright.sync_api import sync_playwright
-            self.p = sync_playwright().start()
-            self.browser = self.p.chromium.launch(headless=True, proxy={'server': 'socks5://10.64.0.1:1080'})
+        if self.playwright_mode: 
+            self.concurrent_requests = max(1, settings['general']['playwright_pages'])
         else: 
-            # Add proxies for use with VPN
-            proxies = {'http': 'socks5h://10.64.0.1:1080',
-                    'https': 'socks5h://10.64.0.1:1080'}
-            self.session = requests.Session()
-            self.session.proxies.update(proxies)
+            self.concurrent_requests = max(1, settings['general']['concurrent_requests'])
+        self.host_limiter = fetcher.HostLimiter(settings['general']['max_connections_per_host'], 
+                                                settings['general']['min_host_interval']/1000, 
+                                                adaptive=settings['general']['adaptive_throttling'], 
+                                                max_interval=settings['general']['max_host_interval']/1000, 
+                                                request_slots=request_slots)
+        # Retry config - pages failing with a temporary error are loaded again after an exponentially growing wait
+        self.max_attempts = max(1, settings['general']['max_attempts'])
+        self.retry_backoff = settings['general']['retry_backoff']/1000
+        self.retry_queue = [] # Heap of (time when due, url)
+        self.failed_attempts = {} # url -> number of failed attempts, for pages waiting for a retry
+
+        # Timings of each stage and counters, written to crawl_stats.json (see crawl_stats)
+        self.stats = crawl_stats.CrawlStats()
+        # Playwright: requests for resources not needed for the text are aborted
+        self.resource_blocker = browser_page.ResourceBlocker(settings['general']['block_resources'], 
+                                                             settings['general']['block_domains'], 
+                                                             stats=self.stats)
+        # Playwright: invisible elements (and optionally all but the included / the excluded tags of text_extraction) are removed 
+        # in the browser, so that only the visible part of the page is transferred and parsed
+        self.browser_pruning = settings['general']['browser_pruning']
+        self.keep_selectors = browser_page.get_metadata_selectors(settings['metadata'])
+        self.include_selectors = []
+        if settings['general']['browser_include']: 
+            self.include_selectors = browser_page.get_pattern_selectors(settings['text_extraction']['specific_tags_include'])
+        self.remove_selectors = []
+        if settings['general']['browser_exclude']: 
+            self.remove_selectors = browser_page.get_pattern_selectors(settings['text_extraction']['specific_tags_exclude'])
 
         # Output config
-        text_output_path = 'scraped_pages_' + re.sub('(?<=_)_|(?<=^)_|_+$', '', re.sub(r'\W|https?|html', '_', starting_url[:100])) + '.txt'
-        self.OutputHandler = handle_output.TerminalOutput(settings['output'], folder=settings['dir'], filename=text_output_path)
+        text_output_path = handle_output.get_output_filename(starting_url)
+        self.OutputHandler = handle_output.TerminalOutput(settings['output'], folder=settings['dir'], filename=text_output_path, stats=self.stats)
 
         # Crawler config
         self.settings = settings
         self.base_url, self.base_url_pattern = self._get_base_url(starting_url)
-        self.queue = set([starting_url])
-        self.visited = set()
-       
-        self.ignored_pages =  re.sub(r'(/|\\)', r'\\\1', '|'.join(self.settings['general']['pages_to_be_ignored'])) \
-            if self.settings['general']['pages_to_be_ignored'] else ''
-        self.ignored_page_types = re.compile(r'.*\.(png|pdf|jpg)')
-        self.absolute_url_pattern = re.compile(r'^(?:[a-z+]+:)?\/\/') # matches absolute urls paths as compared to relative ones
-
-        date_pattern_str = r'(?i)\d{1,4}\D{1,3}(\d{1,2}|janvier|février|fevrier|mars|avril|mai|juin|juillet|aout|août|septembre|octobre|novembre|décembre|decembre)\D{1,3}\d{1,4}'
-        self.date_pattern = re.compile(date_pattern_str)
-
-        volume_string = r'\b(?:[Vv]ol(?:ume)?|[Nn]um(?:éro)?|[Nn]o?|[ÉéEe]d(?:ition)?|Issue|Iss|Livraison|Livr)[\Wº°]{1,3}([IVXLC]+|\d+)'
-        self.volume_pattern = re.compile(volume_string) # group 1 returns the number either in arabic or roman numerals
+        self.base_scheme = self.base_url.split('://')[0]
+        self.link_filter = link_filter.LinkFilter(self.base_url, self.base_url_pattern, self.settings['general']['pages_to_be_ignored'])
+
+        # Extraction config - parsing and extraction run in this process or in *extraction_processes* separate processes
+        self.extractor = page_extraction.PageExtractor(settings)
+        self.extraction_processes = max(0, settings['general']['extraction_processes'])
+        # Pages waiting for extraction at most, before no further results are taken from the fetch workers
+        self.max_pending_extractions = 2*self.extraction_processes
+
+        # Crawl state config - queue and visited pages are saved to disk at each checkpoint
+        self.state_store = frontier.CrawlStateStore(settings['dir'])
+        self.checkpoint_interval = max(1, settings['general']['checkpoint_interval'])
+        # All urls that ever entered the queue (queued, loading or visited)
+        if self.settings['general']['url_index'] == 'bloom': 
+            self.seen_urls = frontier.UrlIndex(self.settings['general']['bloom_capacity'], self.settings['general']['bloom_error_rate'])
+        else: 
+            self.seen_urls = frontier.UrlIndex()
+        # Queued urls - most promising first (url patterns of valuable pages, low link depth) or breadth first
+        if settings['general']['queue_order'] not in ('priority', 'breadth_first'): 
+            raise ValueError(f"Unknown queue_order '{settings['general']['queue_order']}', use 'priority' or 'breadth_first'")
+        self.queue = frontier.Frontier(prioritize=settings['general']['queue_order'] == 'priority')
+        # Incremental recrawl - pages unchanged since the previous run are not extracted again
+        self.page_cache = None
+        if settings['general']['previous_run_dir']: 
+            self.page_cache = frontier.PageCache(settings['general']['previous_run_dir'])
+        self.unchanged_count = 0
+        # robots.txt and sitemaps are loaded once before the crawl, with a separate session
+        seeding_session = None
+        if settings['general']['robots_txt'] or (settings['general']['sitemaps'] and not resume): 
+            seeding_session = self._open_session()
+        robots = site_seeding.fetch_robots(seeding_session, self.base_url) if seeding_session is not None else None
+        # Pages disallowed by robots.txt are not loaded, its Crawl-delay is used as minimal interval
+        self.robots = robots if settings['general']['robots_txt'] else None
+        if self.robots is not None: 
+            crawl_delay = self.robots.crawl_delay
+            if crawl_delay and crawl_delay > self.host_limiter.min_interval: 
+                self.host_limiter.set_min_interval(crawl_delay)
+                logging.info(f"Using Crawl-delay of robots.txt: {crawl_delay} s between requests\n")
+                print(f"Using Crawl-delay of robots.txt: {crawl_delay} s between requests\n")
+        if resume: 
+            for url, visited, depth in self.state_store.iter_pages(): 
+                self.seen_urls.add(url)
+                # Pages added to the blacklist in the meantime are not loaded
+                if not visited and not self.link_filter.is_ignored(url) and self._is_allowed(url): 
+                    self.queue.add(url, depth or 0)
+            for url, attempts, _, _ in self.state_store.iter_errors(final=False): 
+                self.failed_attempts[url] = attempts
+            self.OutputHandler.restore_file_sizes(self.state_store.get_file_sizes())
+            # Near-duplicates of the pages written before are still filtered out
+            restored_count = self.OutputHandler.restore_duplicate_filter()
+            if restored_count: 
+                logging.info(f"Added {restored_count} pages of the output to the duplicate filter\n")
+            logging.info(f"Resuming crawl: {len(self.seen_urls) - len(self.queue)} pages already visited, {len(self.queue)} pages in queue\n")
+            print(f"Resuming crawl: {len(self.seen_urls) - len(self.queue)} pages already visited, {len(self.queue)} pages in queue\n")
+        else: 
+            self.state_store.set_info('starting_url', starting_url)
+            self._add_to_queue([starting_url], depth=0)
+            if settings['general']['sitemaps']: 
+                self._add_sitemaps_to_queue(seeding_session, robots)
+            self.state_store.checkpoint(self.OutputHandler.get_file_sizes())
+        if seeding_session is not None: 
+            self._close_session(seeding_session)
         
     def scrape(self): 
         """
-        Iterates over queue, calling scraping and output functions
+        Iterates over queue, calling scraping and output functions. 
+        Keeps up to *concurrent_requests* pages loading in worker threads. 
+        Links, metadata and text of finished pages are extracted in this thread or, with *extraction_processes*, 
+        in a pool of separate processes - queue, duplicate filter and output always stay in this process. 
         """
-        browser_visit_count = 0
         if self.playwright_mode: 
-            context = self.browser.new_context()
-            self.page = context.new_page()
-
-        while self.queue:
-            # re-init web browser each 100 visited pages (deletes cookies etc.)
-            if browser_visit_count == 50: 
-                if self.playwright_mode: 
-                    context.close()
-                    context = self.browser.new_context()
-                    self.page = context.new_page()
+            client_functions = {'open_client': self._open_browser, 
+                                'recycle_client': self._recycle_browser, 
+                                'close_client': self._close_browser}
+        else: 
+            client_functions = {'open_client': self._open_session, 
+                                'recycle_client': self._recycle_session, 
+                                'close_client': self._close_session}
+        pool = fetcher.FetchWorkerPool(self.concurrent_requests, 
+                                       fetch_page=self._fetch_page, 
+                                       host_limiter=self.host_limiter, 
+                                       stats=self.stats, 
+                                       **client_functions)
+        extraction_pool = None
+        if self.extraction_processes: 
+            # 'spawn' as fork is unsafe with the fetch threads already running
+            extraction_pool = futures.ProcessPoolExecutor(self.extraction_processes, 
+                                                          mp_context=multiprocessing.get_context('spawn'), 
+                                                          initializer=page_extraction.init_worker, 
+                                                          initargs=(self.settings,))
+        pending_extractions = {} # future -> url, content, page_info
+        self.pages_since_checkpoint = 0
+        # Read by the reporter thread - only sizes, which are safe to read while the crawl changes them
+        def get_gauges(): 
+            return {'queue': len(self.queue), 
+                    'retry_queue': len(self.retry_queue), 
+                    'in_flight': pool.in_flight, 
+                    'pending_extractions': len(pending_extractions), 
+                    'writer_queue': self.OutputHandler.Writer.queue_depth, 
+                    'seen_urls': len(self.seen_urls)}
+        stats_settings = self.settings['output']['stats']
+        stats_reporter = None
+        try: 
+            stats_reporter = crawl_stats.StatsReporter(self.stats, self.settings['dir'], 
+                                                       interval=max(1, stats_settings['interval']), 
+                                                       port=stats_settings['port'], 
+                                                       get_gauges=get_gauges)
+            while self.queue or self.retry_queue or pool.in_flight or pending_extractions:
+                # Pages whose wait is over go back to the queue
+                while self.retry_queue and self.retry_queue[0][0] <= time.monotonic(): 
+                    url = heapq.heappop(self.retry_queue)[1]
+                    if self.link_filter.is_ignored(url): # Added to the blacklist in the meantime
+                        del self.failed_attempts[url]
+                        self.state_store.remove_error(url)
+                        self._finish_page(url)
+                    else: 
+                        self.queue.add(url)
+
+                # Hand out new urls as long as workers are free
+                while self.queue and pool.in_flight < self.concurrent_requests: 
+                    pool.submit(self.queue.pop())
+
+                if pending_extractions: 
+                    # Waits for an extraction if too many are pending or no page is loading anymore
+                    wait_for_extraction = len(pending_extractions) >= self.max_pending_extractions or not pool.in_flight
+                    done, _ = futures.wait(pending_extractions, timeout=None if wait_for_extraction else 0, 
+                                           return_when=futures.FIRST_COMPLETED)
+                    for future in done: 
+                        url, content, page_info = pending_extractions.pop(future)
+                        page_data = future.result()
+                        self.stats.record_timings(page_data['timings'])
+                        value = self._process_page(url, content, page_data, page_info)
+                        self._finish_page(url, value)
+                    if wait_for_extraction: 
+                        continue
+
+                if not pool.in_flight: # Only pages waiting for a retry left, if any (the last one may have been dropped above)
+                    if self.retry_queue: 
+                        time.sleep(max(0, self.retry_queue[0][0] - time.monotonic()))
+                    continue
+
+                status, url, content, page_info = pool.get_result()
+                if status: 
+                    self.stats.count('pages')
+                    if content is not None: 
+                        self.stats.count('bytes', len(content) if isinstance(content, bytes) else len(content.encode('utf-8')))
                 else: 
-                    proxies = {'http': 'socks5h://10.64.0.1:1080',
-                    'https': 'socks5h://10.64.0.1:1080'}
-                    self.session = requests.Session()
-                    self.session.proxies.update(proxies)
-                browser_visit_count = 0
-                print('INFO: Restarted browser session.\n')
-            browser_visit_count += 1
-            
-            status, url, soup = self._scrape_single_page_from_queue()
-            if status:
-                self.OutputHandler.save_html(soup, url)
-                # Adding new links to queue
-                self._extract_links(soup)
-                # Extracting metadata
-                title, date, date_fallback_flag, author, volume = self._extract_metadata(soup)
-                # Extracting text
-                complete_text, text, percentage = self._extract_text(soup) # Modifies soup! 
-                
-                self.OutputHandler.record_output(len(self.queue), url, text, percentage, title, date, date_fallback_flag, author, volume)
-                self.OutputHandler.write_output(url, text, title, date, author, volume, percentage)
+                    self.stats.count_error(page_info['error'])
+                if not status and self._schedule_retry(url, page_info): 
+                    self.stats.count('retries')
+                    continue
+                if status and url in self.failed_attempts: 
+                    del self.failed_attempts[url]
+                    self.state_store.remove_error(url)
+                value = 0 # Failed pages make similar urls less promising
+                if status and page_info['unchanged']: 
+                    self._reuse_cached_page(url, page_info)
+                    value = None
+                elif status and extraction_pool is not None: 
+                    pending_extractions[extraction_pool.submit(page_extraction.extract_in_worker, content)] = (url, content, page_info)
+                    continue
+                elif status:
+                    page_data = self.extractor.extract(content)
+                    self.stats.record_timings(page_data['timings'])
+                    value = self._process_page(url, content, page_data, page_info)
+                self._finish_page(url, value)
+            self.state_store.checkpoint(self.OutputHandler.get_file_sizes())
+            self.OutputHandler.finish()
+            failed_count = sum(1 for _ in self.state_store.iter_errors(final=True))
+            if failed_count: 
+                logging.warning(f"{failed_count} pages could not be loaded, see table 'errors' in {frontier.CrawlStateStore.filename}\n")
+                print(f"WARNING: {failed_count} pages could not be loaded, see table 'errors' in {frontier.CrawlStateStore.filename}\n")
+            if self.page_cache is not None: 
+                logging.info(f"{self.unchanged_count} pages unchanged since previous run\n")
+                print(f"{self.unchanged_count} pages unchanged since previous run\n")
+        finally: 
+            pool.close()
+            if stats_reporter is not None: 
+                stats_reporter.close()
+            if extraction_pool is not None: 
+                extraction_pool.shutdown(cancel_futures=True)
+            # Write all buffers to files - anything after the last checkpoint is removed again when resuming
+            self.OutputHandler.close()
+            self.state_store.close()
+            if self.page_cache is not None: 
+                self.page_cache.close()
+
+
+    def _process_page(self, url, content, page_data, page_info): 
+        """
+        Saves a successfully loaded page and hands the results of its extraction to queue and output
+        Args: 
+        content: The page as received by _fetch_page
+        page_data: Result of PageExtractor.extract for content
+        page_info: Validators and content hash of the page, and the links collected in the browser, as returned by _fetch_page
+        Returns: 
+        Value of the page for the priority of similar urls, between 0 and 1: 
+        half for a text passing the quality checks and duplicate filter, the rest for title, date and share of extracted text
+        """
+        with crawl_stats.StageTimer(self.stats, 'save_html'): 
+            self.OutputHandler.save_html(url, content, page_info['status_code'], page_info['headers'])
+        if page_info['link_hrefs'] is not None: # Also contains the links removed from content with the invisible elements
+            page_data['hrefs'] = page_info['link_hrefs']
+        if page_info['text_share'] is not None: 
+            # Only the included tags were transferred (browser_include) - the percentage refers to the whole visible text again
+            page_data['percentage'] = round(page_data['percentage']*page_info['text_share'])
+        # Adding new links to queue
+        with crawl_stats.StageTimer(self.stats, 'links'): 
+            self._add_to_queue(self.link_filter.filter_links(page_data['hrefs']), self.queue.get_depth(url) + 1)
+        
+        self.OutputHandler.record_output(len(self.queue), url, page_data['text'], page_data['percentage'], page_data['title'], 
+                                         page_data['date'], page_data['date_fallback_flag'], page_data['author'], page_data['volume'])
+        written = self.OutputHandler.write_output(url, page_data['text'], page_data['title'], page_data['date'], 
+                                                  page_data['author'], page_data['volume'], page_data['percentage'])
+        self.state_store.save_page_cache(url, page_info['etag'], page_info['last_modified'], page_info['content_hash'], page_data['hrefs'])
+        return 0.5*written + 0.2*(page_data['title'] is not None) + 0.2*(page_data['date'] is not None) + 0.1*min(1, page_data['percentage']/100)
+
+
+    def _reuse_cached_page(self, url, page_info): 
+        """
+        Handles a page unchanged since the previous run: parsing, extraction and output are skipped, 
+        only its links are followed, using the hrefs saved in the page cache
+        """
+        with crawl_stats.StageTimer(self.stats, 'links'): 
+            self._add_to_queue(self.link_filter.filter_links(page_info['hrefs']), self.queue.get_depth(url) + 1)
+        self.state_store.save_page_cache(url, page_info['etag'], page_info['last_modified'], page_info['content_hash'], page_info['hrefs'])
+        self.unchanged_count += 1
+        self.stats.count('pages_unchanged')
+        logging.info(f"Unchanged since previous run: {url}\n")
+
+
+    def _schedule_retry(self, url, error_info): 
+        """
+        Records a failed page in the error list and, if the error is temporary and attempts are left, 
+        schedules it for another attempt after retry_backoff * 2^(attempts-1) (with jitter) or the wait requested by the server
+        Args: 
+        error_info: page_info returned by _fetch_page for a failed page
+        Returns: 
+        True if the page will be loaded again, False if it is given up
+        """
+        attempts = self.failed_attempts.pop(url, 0) + 1
+        retry = error_info['retryable'] and attempts < self.max_attempts
+        self.state_store.save_error(url, attempts, error_info['error'], final=not retry)
+        if not retry: 
+            if attempts > 1: 
+                logging.warning(f"Giving up on {url} after {attempts} attempts: {error_info['error']}\n")
+                print(f"WARNING: Giving up on {url} after {attempts} attempts: {error_info['error']}")
+            return False
+
+        wait = max(self.retry_backoff * 2**(attempts - 1) * random.uniform(0.8, 1.2), error_info['retry_after'] or 0)
+        self.failed_attempts[url] = attempts
+        heapq.heappush(self.retry_queue, (time.monotonic() + wait, url))
+        logging.info(f"Retrying {url} in {wait:.0f} s (attempt {attempts + 1} of {self.max_attempts})\n")
+        return True
+
+
+    def _finish_page(self, url, value=None): 
+        """
+        Marks a page as visited once it is completely processed, saving the crawl state every *checkpoint_interval* pages
+        Args: 
+        value: Value of the page for the priority of similar urls (see _process_page), None if unknown
+        """
+        self.queue.done(url, value)
+        self.state_store.mark_visited(url)
+        self.pages_since_checkpoint += 1
+        if self.pages_since_checkpoint == self.checkpoint_interval: 
+            with crawl_stats.StageTimer(self.stats, 'checkpoint'): 
+                self.state_store.checkpoint(self.OutputHandler.get_file_sizes())
+            self.pages_since_checkpoint = 0
+
+
+    def _open_session(self): 
+        session = requests.Session()
+        # Add proxies for use with VPN
+        proxies = {'http': 'socks5h://10.64.0.1:1080',
+                'https': 'socks5h://10.64.0.1:1080'}
+        session.proxies.update(proxies)
+        return session
+
+
+    def _recycle_session(self, session): 
+        self._close_session(session)
+        return self._open_session()
+
+
+    def _close_session(self, session): 
+        session.close()
 
-        # Write all buffers to files
-        self.OutputHandler.flush_buffers()
-        if self.playwright_mode: 
-            self.p.stop()
-                
 
-    def _scrape_single_page_from_queue(self): 
-        url = self.queue.pop()
-        self.visited.add(url)
+    def _open_browser(self): 
+        """
+        Starts a separate playwright instance and browser for the calling worker thread, as sync playwright objects 
+        can only be used from the thread which created them - each of the *playwright_pages* workers thus runs its own 
+        chromium process (with its own memory), not only its own context. 
+        """
+        from playwright.sync_api import sync_playwright
+        p = sync_playwright().start()
+        browser = p.chromium.launch(headless=True, proxy={'server': 'socks5://10.64.0.1:1080'})
+        client = {'playwright': p, 'browser': browser}
+        self._open_browser_context(client)
+        return client
+
+
+    def _open_browser_context(self, client): 
+        """
+        Adds a new browser context and page to client: unneeded resources are blocked (*block_resources*, *block_domains*), 
+        changes to the content and running requests are tracked to know when the page has settled (see browser_page)
+        """
+        context = client['browser'].new_context()
+        context.add_init_script(browser_page.MUTATION_OBSERVER_SCRIPT)
+        if self.resource_blocker: 
+            context.route('**/*', self.resource_blocker.handle_route)
+        client['context'] = context
+        client['page'] = context.new_page()
+        client['network'] = browser_page.NetworkTracker(client['page'])
+
+
+    def _recycle_browser(self, client): 
+        client['context'].close()
+        self._open_browser_context(client)
+        return client
+
+
+    def _close_browser(self, client): 
+        client['browser'].close()
+        client['playwright'].stop()
+
+
+    def _fetch_page(self, client, url): 
+        """
+        Loads a single page, never raises
+        Args: 
+        client: playwright objects in playwright mode, else requests session
+        Returns: 
+        status (1 if successful, else 0), content (the page as received: string in playwright mode, else bytes), 
+        page_info (dict with validators, content hash, status code and headers and - if unchanged since the previous run - cached hrefs; 
+            if not successful: dict with error, retryable and retry_after)
+        """
+        cached = self.page_cache.get(url) if self.page_cache is not None else None
+        response_headers = {}
+        status_code = None # Stays None in playwright mode, where the final DOM is saved instead of the response
+        link_hrefs = None # Hrefs of all links, if collected in the browser (see browser_pruning)
+        text_share = None # Share of the visible text kept in the browser by browser_include
+        # Description of the error if not successful, and whether it may be temporary
+        error = None
+        retryable = False
+        start_time = time.monotonic()
         try:
             if self.playwright_mode:
-                self.page.goto(url, timeout=240000)
+                page = client['page']
+                network = client['network']
+                # Each wait ends once no request is running and the page has not changed for *settle_time*, after *delay* at the latest
+                max_wait = self.settings['general']['delay']/1000
+                quiet_time = self.settings['general']['settle_time']/1000
+                page.goto(url, timeout=240000, wait_until='domcontentloaded')
+                browser_page.wait_until_settled(page, network, quiet_time, max_wait)
                 
-                # Scroll page
-                delay_time = self.settings['general']['delay']/50
-                self.page.evaluate('''
-                    async (delay_time) => {
-                        const delay = ms => new Promise(resolve => setTimeout(resolve, ms));
-                        for (let i = 0; i < document.body.scrollHeight; i += 100) {
-                            window.scrollTo(0, i);
-                            await delay(delay_time);  // Use the passed delay_time
-                        }
-                    }
-                ''', delay_time)  
-                self.page.wait_for_timeout(self.settings['general']['delay']/2)
+                # Scroll page, so that content loaded only when scrolled to (e.g. infinite scroll) appears
+                browser_page.scroll_to_bottom(page, network, quiet_time, max_wait, self.settings['general']['max_scroll_steps'])
 
                 # Click all buttons on the page
                 if self.settings['general']['click_buttons']:
@@ -114,330 +438,163 @@ class Crawler:
                     # Iterate over all selectors defined in the settings
                     for selector in self.settings['general']['click_buttons']:
                         # Fetch all elements that match the current selector and extend the button list
-                        buttons.extend(self.page.query_selector_all(selector))
+                        buttons.extend(page.query_selector_all(selector))
                     for el in buttons:
                         el.dispatch_event('click')
-                    self.page.wait_for_timeout(self.settings['general']['delay']/2)
-
-                # Mark visible elements
-                self.page.evaluate("""() => {
-                        document.querySelectorAll('*').forEach(el => {
-                            const style = window.getComputedStyle(el);
-                             const isVisible = style.display !== 'none' && style.visibility !== 'hidden' && style.opacity !== '0' 
-                             && el.offsetWidth > 0 && el.offsetHeight > 0;
-                            if (isVisible) {
-                                el.setAttribute('data-visible', 'true');
-                            }
-                        });
-                    }""")
-
-                html_content = self.page.content()
-                soup = BeautifulSoup(html_content, 'lxml')
+                    browser_page.wait_until_settled(page, network, quiet_time, max_wait)
+
+                if self.browser_pruning: 
+                    # Links are taken from the whole page, before hidden elements (e.g. dropdown menus) are removed
+                    pruning_start = time.perf_counter()
+                    link_hrefs, removed_count, text_share = browser_page.reduce_dom(page, self.keep_selectors, self.include_selectors, self.remove_selectors)
+                    self.stats.record('browser_pruning', time.perf_counter() - pruning_start)
+                    self.stats.count('removed_elements', removed_count)
+                else: 
+                    # Mark visible elements
+                    page.evaluate("""() => {
+                            document.querySelectorAll('*').forEach(el => {
+                                const style = window.getComputedStyle(el);
+                                 const isVisible = style.display !== 'none' && style.visibility !== 'hidden' && style.opacity !== '0' 
+                                 && el.offsetWidth > 0 && el.offsetHeight > 0;
+                                if (isVisible) {
+                                    el.setAttribute('data-visible', 'true');
+                                }
+                            });
+                        }""")
+
+                content = page.content()
                 status = 1 # Placeholder, webpage status in playwright not directly returned
                 
                      
             else:
-                r = self.session.get(url, timeout=30)
-                status = 1 if r.status_code == 200 else 0
-                if r.status_code != 200:
-                    logging.info(f"Error when loading page {url}: {r.status_code}\n")
-                    print(f"Error when loading page {url}: {r.status_code}\n")
-                soup = BeautifulSoup(r.content, 'html.parser')
+                headers = {}
+                if cached is not None: 
+                    # Conditional request - the server answers 304 without content if the page did not change
+                    if cached['etag']: 
+                        headers['If-None-Match'] = cached['etag']
+                    if cached['last_modified']: 
+                        headers['If-Modified-Since'] = cached['last_modified']
+                r = client.get(url, timeout=30, headers=headers)
+                response_headers = r.headers
+                status_code = r.status_code
+                if r.status_code == 304 and cached is not None: 
+                    status = 1
+                    content = None
+                else: 
+                    status = 1 if r.status_code == 200 else 0
+                    if r.status_code != 200:
+                        logging.info(f"Error when loading page {url}: {r.status_code}\n")
+                        print(f"Error when loading page {url}: {r.status_code}\n")
+                        error = f"HTTP {r.status_code}"
+                        retryable = r.status_code in RETRYABLE_STATUS_CODES
+                    content = r.content
 
         except ConnectionError:
             logging.warning(f"Connection error on {url}\n")
             print(f"WARNING: Connection error on {url}")
             status = 0
-            soup = None
+            content = None
+            error = "Connection error"
+            retryable = True
         except Timeout:
             logging.warning(f"Request timed out on {url}\n")
             print(f"WARNING: Request timed out on {url}")
             status = 0
-            soup = None
+            content = None
+            error = "Timeout"
+            retryable = True
         except RequestException:
             logging.warning(f"Request exception on {url}\n")
             print(f"WARNING: Request exception on {url}")
             status = 0
-            soup = None
+            content = None
+            error = "Request exception"
         except Exception as e:
             logging.warning(f"Unknown exception on {url}: {e}\n")
             print(f"WARNING: Unknown exception on {url}: {e}")
             status = 0
-            soup = None 
-
-        return status, url, soup
-
-
-    def _extract_links(self, soup): 
-        def test_variants_visited(link): 
-            """
-            Checks for all equivalent versions of a url if they were already visited. 
-            Returns: True if already visited
-            """
-            variants = [link]
-            if link[-2:] == '/#':
-                variants.append(link[:-1])
-                variants.append(link[:-2])
-            elif link[-1:] == '/': 
-                variants.append(link[:-1])
-            else: 
-                variants.append(link + '/')
-                variants.append(link + '/#')
-
-            for v in variants: 
-                if v in self.visited: 
-                    return True
-            return False
-
-        raw_links = soup.find_all('a')
-        for raw_link in raw_links: 
-            
-            link = raw_link.get('href') 
-            if link is not None: 
-                # Checks if link is on same site
-                if re.match(self.base_url_pattern, link):
-                    if not re.match(self.ignored_page_types, link):
-                        if not self.ignored_pages or re.search(self.ignored_pages, link) is None: # Checks if is a png/jpg/pdf or in blacklist
-                            if not test_variants_visited(link): # Checks if already visited
-                                self.queue.add(link)
-                # If link not on same site: outside -> ignore, relative link -> combine with base url
-                if not re.match(self.absolute_url_pattern, link): # If absolute and not on same website: ignored
-                    full_link = self.base_url + link if len(link) > 0 and link[0] == '/' else self.base_url + '/' + link
-                    if not re.match(self.ignored_page_types, link):
-                        if not self.ignored_pages or not re.search(self.ignored_pages, link): # Checks if is a png/jpg/pdf or in blacklist
-                            if not test_variants_visited(full_link): # Checks if already visited
-                                self.queue.add(full_link)
-
-
-    def _extract_text(self, soup):     
-         
-        def get_check_pattern_func(valid_patterns:list): 
-            """
-            Returns a filter function, which matches it's tag input to the valid patterns
-            Args: 
-            pattern: A list of dicts, with a single tag configuration (tag, attrib, name) per dict.  
-                All 2 keys have to be presents, values may be empty strings
-            """
-            def check_pattern_func(tag): 
-                """
-                Filter function, checks if input matches valid patterns. 
-                """
-                if tag is not None: 
-                    for pattern in valid_patterns: 
-                        if pattern['tag'] and not pattern['attrib']: # Only tag specified
-                            if tag.name == pattern['tag']: 
-                                return True
-                        elif pattern['tag'] and pattern['attrib']: # Tag and attrib and name specified
-                            assert pattern['name'], "If an 'attrib' is used as selector, please also add a value for 'name'!"
-                            name_values_for_attrib = tag.get(pattern['attrib'], '')
-                            name_values_for_attrib = name_values_for_attrib if isinstance(name_values_for_attrib, list) else name_values_for_attrib.split()
-                            if tag.name == pattern['tag']: 
-                                all_names_match = True
-                                for name in pattern['name'].split():
-                                    if name not in name_values_for_attrib: 
-                                        all_names_match = False
-                                if all_names_match:
-                                    return True
-                        else: # Only attrib and name specified
-                            assert pattern['name'], "If an 'attrib' is used as selector, please also add a value for 'name'!"
-                            name_values_for_attrib = tag.get(pattern['attrib'], '')
-                            name_values_for_attrib = name_values_for_attrib if isinstance(name_values_for_attrib, list) else name_values_for_attrib.split()
-                            all_names_match = True
-                            for name in pattern['name'].split():
-                                if name not in name_values_for_attrib: 
-                                    all_names_match = False
-                            if all_names_match:
-                                return True
-                return False
-            
-            return check_pattern_func
-        
-        def decompose_tree(tag, match_func, del_matches=False):
-            """
-            Decomposes the bs4 soup: \n
-            (del_matches = False)   Keep only matched tags, but with general structure intact \n
-            (del_matches = True)    Delete all matched tags
-            Args: 
-            match func: A function checking whether a tag has one of the selected patterns - returns True or False
-            del_matches: If True, all matching tags are deleted. If False, all matching tags are kept, any other deleted. 
-            """
-            def _decompose_rec(tag, match_func, del_matches, level): 
-                """
-                Leaves root intact, decomposes anything else recursively. 
-                """
-                for c in list(tag.children): 
-                    if isinstance(c, NavigableString): 
-                        c.replace_with('')
-                    elif isinstance(c, Tag): 
-                        # Deleting matches from tree
-                        if del_matches: 
-                            if match_func(c): 
-                                c.decompose()
-                            elif c.find(match_func): 
-                                _decompose_rec(c, match_func, del_matches, level+1)
-                        # Keep only matches in tree
-                        else: 
-                            if match_func(c): # c matches a pattern
-                                pass # Keep tag and children
-                            elif c.find(match_func): # descendants of c match patterns
-                                _decompose_rec(c, match_func, del_matches, level+1)
-                            else: # c and descendants don't match patterns (due to recursive nature: parents also don't match patterns)
-                                c.decompose()
-                    else: 
-                        try: 
-                            c.decompose()
-                        except Exception as e: 
-                            print(e)
-
-                if not level == 0: 
-                    if not tag.get_text(strip=True): # (This should not delete <br> as those are inline and thus protected where matched)
-                        tag.decompose() 
-
-            level = 0
-            _decompose_rec(tag, match_func, del_matches, level)
+            content = None 
+            error = f"Unknown exception: {e}"
+            # In playwright mode mostly timeouts of page.goto
+            retryable = self.playwright_mode
+
+        # Feedback for the adaptive throttling of the host
+        retry_after = fetcher.parse_retry_after(response_headers.get('Retry-After')) if status_code in RETRYABLE_STATUS_CODES else None
+        self.host_limiter.report(url, time.monotonic() - start_time, 
+                                 throttled=error is not None and retryable, 
+                                 retry_after=retry_after)
+
+        if not status: 
+            return status, content, {'error': error, 'retryable': retryable, 'retry_after': retry_after}
+        if content is None: # Not modified, validators only sent again by some servers
+            page_info = {'etag': response_headers.get('ETag') or cached['etag'], 
+                         'last_modified': response_headers.get('Last-Modified') or cached['last_modified'], 
+                         'content_hash': cached['content_hash'], 
+                         'hrefs': cached['hrefs'], 
+                         'unchanged': True}
+        else: 
+            content_hash = hashlib.blake2b(content if isinstance(content, bytes) else content.encode('utf-8'), digest_size=16).hexdigest()
+            unchanged = cached is not None and cached['content_hash'] == content_hash
+            page_info = {'etag': response_headers.get('ETag'), 
+                         'last_modified': response_headers.get('Last-Modified'), 
+                         'content_hash': content_hash, 
+                         'hrefs': cached['hrefs'] if unchanged else None, 
+                         'unchanged': unchanged, 
+                         'status_code': status_code, 
+                         # Raw headers, as sent by the server (incl. repeated ones)
+                         'headers': list(r.raw.headers.items()) if status_code is not None else None, 
+                         'link_hrefs': link_hrefs, 
+                         'text_share': text_share}
+        return status, content, page_info
+
+
+    def _add_to_queue(self, links, depth, lastmods=None): 
+        """
+        Canonicalizes the links and adds those never seen before (and allowed by robots.txt) to the queue
+        Args: 
+        depth: Link depth of the links (depth of the page they were found on + 1)
+        lastmods: For links from a sitemap, list of the lastmod of each link
+        """
+        new_links = []
+        new_lastmods = []
+        for i, link in enumerate(links): 
+            link = frontier.canonicalize_url(link, self.base_scheme)
+            if link not in self.seen_urls and self._is_allowed(link): # Checks if already queued or visited
+                self.seen_urls.add(link)
+                self.queue.add(link, depth)
+                new_links.append(link)
+                if lastmods is not None: 
+                    new_lastmods.append(lastmods[i])
+        self.state_store.add_to_queue(new_links, depth, new_lastmods if lastmods is not None else None)
+
+
+    def _is_allowed(self, url): 
+        """
+        Returns False if robots.txt disallows loading url
+        """
+        return self.robots is None or self.robots.can_fetch(url)
 
 
-        # Remove invisible elements
-        if soup.find(lambda tag: tag.has_attr('data-visible')): # If playwright was used
-            pass
-            # Deletes all non-visible elements as long as they are tags (pure strings directly in the html are ignored)
-            match_func = lambda tag: (not tag.has_attr('data-visible') or tag['data-visible'] != 'true') if isinstance(tag, Tag) else True
-            #decompose_tree(soup, match_func, del_matches=True)
-        else: 
-            match_func = lambda tag: ('display: none' or 'visibility: hidden' or 'opacity: 0' or 'font-size:0px') in tag.get('style', '').lower()
-            decompose_tree(soup, match_func, del_matches=True)
-
-        # Remove all links without text and all images
-        match_func = lambda tag: tag.name == 'img' or (tag.name == 'a' and tag.get_text(strip=True) == '')
-        decompose_tree(soup, match_func, del_matches=True)
-
-        complete_text = self._html_to_text(soup)
-
-        extraction_settings = self.settings['text_extraction']
-        patterns_include = extraction_settings['specific_tags_include']
-        patterns_exclude = extraction_settings['specific_tags_exclude']
-
-        include_tags_specified = False
-        exclude_tags_specified = False
-        for el in patterns_include: 
-            if el['tag'] or el['attrib'] or el['name']: 
-                include_tags_specified = True
-                break
-        for el in patterns_exclude: 
-            if el['tag'] or el['attrib'] or el['name']: 
-                exclude_tags_specified = True
-                break
-        tree_pruned = False
-        # Extract text by tags if settings contain specified tags
-        if include_tags_specified: 
-            include_match_func = get_check_pattern_func(patterns_include)
-            decompose_tree(soup, include_match_func)
-            tree_pruned = True
-        if exclude_tags_specified: 
-            exclude_match_func = get_check_pattern_func(patterns_exclude)
-            decompose_tree(soup, exclude_match_func, del_matches=True)
-            tree_pruned = True
-        # Extract text by <p> (html paragraphs)
-        if extraction_settings['only_paragraphs']:
-            include_match_func = get_check_pattern_func([{'tag': 'p', 'attrib': '', 'name': ''}])
-            decompose_tree(soup, include_match_func)
-            tree_pruned = True
-        # Extract text by paragraphs and headers
-        elif extraction_settings['only_paragraphs_and_headers']:
-            include_match_func = get_check_pattern_func([{'tag': 'p', 'attrib': '', 'name': ''}, \
-                                                {'tag': 'h1', 'attrib': '', 'name': ''}, \
-                                                {'tag': 'h2', 'attrib': '', 'name': ''}, \
-                                                {'tag': 'h3', 'attrib': '', 'name': ''}, \
-                                                {'tag': 'h4', 'attrib': '', 'name': ''}, \
-                                                {'tag': 'h5', 'attrib': '', 'name': ''}, \
-                                                {'tag': 'h6', 'attrib': '', 'name': ''}])
-            decompose_tree(soup, include_match_func)
-            tree_pruned = True
-        if tree_pruned: 
-            text = self._html_to_text(soup)
-        else: # Fallback option: Extract all text
-            text = complete_text
-        percentage = round((len(text) / len(complete_text) if len(complete_text) > 0 else 1)*100)
-
-        return complete_text, text, percentage
-
-
-    def _extract_metadata(self, soup):
-
-        def check_if_match(settings):
-
-            def find_in_json_rec(d, target_key): 
-                if isinstance(d, dict):
-                    for key, value in d.items():
-                        if key == target_key:
-                            return value
-                        elif isinstance(value, dict):
-                            result = find_in_json_rec(value, target_key)
-                            if result:
-                                return result
-                        elif isinstance(value, list):
-                            for item in value:
-                                result = find_in_json_rec(item, target_key)
-                                if result:
-                                    return result
-                return None
-            
-            # Extraction from yoast seo script 
-            if 'json_pattern' in settings.keys() and settings['json_pattern']: 
-                tags = soup.find_all(settings['tag'])
-                yoast_text = ''
-                for tag in tags:
-                    if settings['attrib'] and settings['name']:
-                        if tag.has_attr(settings['attrib']) and settings['name'] in tag.get(settings['attrib'], []):
-                            yoast_text = tag.get_text()
-                            break
-                    else:
-                        yoast_text =  tag.get_text()
-                        break
-
-                if yoast_text: 
-                    yoast_data = json.loads(yoast_text)
-                    return find_in_json_rec(yoast_data, settings['json_pattern'])
-            else: 
-                # Robust extraction from normal html
-                if settings['tag']:
-                    tags = soup.find_all(settings['tag'])
-                    for tag in tags:
-                        if settings['attrib'] and settings['name']:
-                            if tag.has_attr(settings['attrib']) and settings['name'] in tag.get(settings['attrib'], []):
-                                return tag.get('content', '') or tag.get_text() or tag.get('value', '')
-                        elif settings['attrib']: 
-                            return tag.get(settings['attrib'])
-                        else:
-                            return tag.get_text(separator=' ')
-            return None
-
-        date_settings = self.settings['metadata']['date']
-        title_settings = self.settings['metadata']['title']
-        author_settings = self.settings['metadata']['author']
-        volume_settings = self.settings['metadata']['volume']
-
-        title = check_if_match(title_settings)
-        date = check_if_match(date_settings)
-        author = check_if_match(author_settings)
-
-        # Date: Fallback method - extract first date-like string from website text
-        date_fallback = False
-        if not date:
-            if date_settings['use_fallback_method']:
-                date_match = re.search(self.date_pattern, soup.get_text())
-                if date_match:
-                    date = date_match.group()
-                    date_fallback = True # Flag used in output
-
-        # Automatical extraction of volume numbers from title
-        volume = None
-        if volume_settings['extract_volume'] and title is not None:
-            vol_match = re.search(self.volume_pattern, title)
-            if vol_match:
-                volume = vol_match.group(1)
-
-        return title, date, date_fallback, author, volume
+    def _add_sitemaps_to_queue(self, session, robots): 
+        """
+        Adds all pages of the website listed in its sitemaps (as given in robots.txt, else /sitemap.xml) to the queue, 
+        so that articles are found without loading every category and pagination page first
+        """
+        sitemap_urls = (robots.sitemaps if robots is not None else None) or [self.base_url + '/sitemap.xml']
+        queue_size = len(self.queue)
+        links = []
+        lastmods = []
+        for url, lastmod in site_seeding.iter_sitemap_urls(session, sitemap_urls): 
+            for link in self.link_filter.filter_url(url): 
+                links.append(link)
+                lastmods.append(lastmod)
+            if len(links) >= SITEMAP_BATCH_SIZE: 
+                self._add_to_queue(links, 1, lastmods)
+                links = []
+                lastmods = []
+        self._add_to_queue(links, 1, lastmods)
+        logging.info(f"Added {len(self.queue) - queue_size} pages from sitemaps to the queue\n")
+        print(f"Added {len(self.queue) - queue_size} pages from sitemaps to the queue\n")
 
 
     def _get_base_url(self, url):
@@ -459,48 +616,3 @@ class Crawler:
 
         #return 'https://web.archive.org/web/20230501054741/https://fr.novopress.info/', '(https?://)?web.archive.org/web/\d+/https://fr.novopress.info/'
         return raw_base_url, full_pattern # pattern to match website
-
-
-    def _html_to_text(self, soup): 
-        """
-        Converts the soup to plain text using html2text. 
-        Creates a new html2text object each time to reduce the impact of a html2text bug, 
-        where part of the content is accumulated at the end of the Markdown text. 
-        *markdownify* would be an alternative, but html2text output is more similar to the website formatting
-        """
-        def text_cleanup(text):
-            """
-            Can be used to clean the Markdown output of html2text. 
-            """
-            # Cleanup spaces
-            text = re.sub(r'---LINE_BREAK_PLACEHOLDER---', '\n', text)
-            text = re.sub(r'[\u200B-\u200D\uFEFF]', ' ', text)# Remove zero-width-spaces
-            text = re.sub(r'^\s+\n', '', text) # Remove spaces at start of text
-            #text = re.sub(r'[^\S\r\n]*\n[^\S\r\n]*',  '\n', text) # Summarize leading spaces + linebreak + trailing spaces as single linebreak
-            text = re.sub(r'\s+\Z', '', text) # Remove trailing whitespaces - leading whitespaces already removed by summarizing
-            text = re.sub(r'\n\s*\n', '\n\n', text) # Combine multi-linebreaks into one
-
-            # Cleanup markdown
-            # To reformat / clean up links: (?<![!\\\s*_])\[\s*(.*?)\s*\]
-
-            #text = re.sub(r'^[^\S\r\n]*\\?-\s*', '- ', text, flags=re.MULTILINE) # Escapte Aufzählungsstriche zu normalen 
-            #text = re.sub(r'\\\.', '.', text) # Escapte Punkte zu normalen Punkten
-            #text = re.sub(r'^>\s*', r'', text, flags=re.MULTILINE) # Einschub mit > entfernen
-            #text = re.sub(r'^([^\S\r\n]*\*[^\S\r\n]*){2,}', r'* ', text, flags=re.MULTILINE) # Mehrere Sterne zu einem 
-            #text = re.sub(r'^([^\S\r\n]*\*[^\S\r\n]*)+\n', r'\n', text, flags=re.MULTILINE) # Verirrte Sterne löschen
-            
-            return text
-        
-        h = html2text.HTML2Text()
-        h.ignore_links = False
-        h.ignore_images = True
-        h.single_line_break = False
-        h.asterisk_emphasis = True
-        h.body_width = 0
-        h.unicode_snob = True
-        h.ignore_tables = True
-        h.escape_snob = True
-        h.dash_unordered_list = True
-        h.protect_links = True
-        #print(soup)
-        return text_cleanup(h.handle(str(soup)))
\ No newline at end of file
@@ -0,0 +1,85 @@
+from bs4 import Tag, NavigableString
+
+
+def prune_tree(root, match_func, del_matches=False):
+    """
+    Decomposes the bs4 soup in linear time: \n
+    (del_matches = False)   Keep only matched tags, but with general structure intact \n
+    (del_matches = True)    Delete all matched tags
+
+    Gives the same result as the former recursive decompose_tree, which searched the whole subtree of each tag
+    again (tag.find(match_func)) on every level: here, all matches are evaluated once in a bottom-up pass,
+    then the tree is pruned top-down.
+    Leaves root intact. Strings directly inside root or inside any tag containing a match are removed,
+    tags left without text are deleted.
+    Args:
+    match_func: A function checking whether a tag has one of the selected patterns - returns True or False
+    del_matches: If True, all matching tags are deleted. If False, all matching tags are kept, any other deleted.
+    """
+    annotations = _annotate(root, match_func)
+    _prune(root, annotations, del_matches)
+
+
+def _annotate(root, match_func):
+    """
+    Evaluates the (unmodified) tree bottom-up
+    Returns:
+    dict id(tag) -> (tag matches, any descendant matches, set of string types with visible text in the subtree)
+    """
+    annotations = {}
+    tags = [root]
+    tags.extend(root.find_all(True))
+    # Reversed document order: all descendants of a tag are handled before the tag itself
+    for tag in reversed(tags):
+        descendant_matches = False
+        string_types = set()
+        for child in tag.contents:
+            if isinstance(child, Tag):
+                child_matches, child_descendant_matches, child_string_types = annotations[id(child)]
+                descendant_matches = descendant_matches or child_matches or child_descendant_matches
+                string_types |= child_string_types
+            elif isinstance(child, NavigableString):
+                if child.strip():
+                    string_types.add(type(child))
+        tag_matches = match_func(tag) if tag is not root else False
+        annotations[id(tag)] = (tag_matches, descendant_matches, string_types)
+    return annotations
+
+
+def _prune(root, annotations, del_matches):
+    # Tags whose children were pruned -> string types with visible text left in the subtree
+    remaining_string_types = {}
+    # Each tag is visited twice: first to prune its children, then (once they are done) to check if text is left
+    stack = [(root, False)]
+    while stack:
+        tag, children_done = stack.pop()
+        if not children_done:
+            stack.append((tag, True))
+            for child in list(tag.contents):
+                if isinstance(child, Tag):
+                    child_matches, child_descendant_matches, _ = annotations[id(child)]
+                    if child_matches:
+                        if del_matches:
+                            child.decompose()
+                        # else: keep tag and children
+                    elif child_descendant_matches:
+                        stack.append((child, False))
+                    elif not del_matches: # child and descendants don't match patterns
+                        child.decompose()
+                else:
+                    child.extract()
+        elif tag is not root:
+            # Same check as tag.get_text(strip=True), based on the string types get_text considers for this tag
+            string_types = set()
+            for child in tag.contents:
+                if id(child) in remaining_string_types:
+                    string_types |= remaining_string_types[id(child)]
+                else:
+                    string_types |= annotations[id(child)][2]
+            interesting_string_types = tag.interesting_string_types if tag.interesting_string_types is not None else Tag.MAIN_CONTENT_STRING_TYPES
+            if isinstance(interesting_string_types, type):
+                interesting_string_types = {interesting_string_types}
+            if string_types.isdisjoint(interesting_string_types):
+                tag.decompose()
+            else:
+                remaining_string_types[id(tag)] = string_types
@@ -0,0 +1,290 @@
+import logging
+import math
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+
+# Adaptive throttling: interval added after the first slow or refused request, and removed again per normal response (in s)
+THROTTLE_INITIAL_DELAY = 0.5
+THROTTLE_DECREASE_STEP = 0.1
+# A response counts as slow if it takes *latency_factor* times longer than the fastest average of the host - and at least this long (in s)
+SLOW_RESPONSE_MIN_LATENCY = 1.0
+# Longest pause accepted from a Retry-After header (in s)
+MAX_RETRY_AFTER = 600
+
+
+def parse_retry_after(value): 
+    """
+    Returns the wait time (in s) requested by a Retry-After header (seconds or HTTP date), None if missing or invalid
+    """
+    if not value: 
+        return None
+    value = value.strip()
+    if value.isdigit(): 
+        seconds = int(value)
+    else: 
+        try: 
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError): 
+            return None
+    return min(MAX_RETRY_AFTER, max(0, seconds))
+
+
+class HostLimiter:
+    """
+    Politeness towards the crawled websites:
+    Limits the number of simultaneous connections per host and enforces a minimal interval
+    between the start of two requests to the same host.
+
+    With *adaptive*, the interval follows the responses of the host (AIMD): each refused (429, 5xx), failed or 
+    unusually slow request doubles the additional interval up to *max_interval*, each normal response reduces it 
+    by a small fixed step - the crawl thus stays close to the highest rate the host accepts. 
+    A Retry-After sent by the host pauses all requests to it for the requested time. 
+    """
+    def __init__(self, max_connections_per_host=2, min_interval=0, adaptive=False, max_interval=30, latency_factor=3, request_slots=None) -> None:
+        """
+        Args:
+        max_connections_per_host: Maximal number of requests to a single host at the same time
+        min_interval: Minimal time (in s) between the start of two requests to the same host
+        adaptive: Adapt the interval to errors and response times of each host
+        max_interval: Maximal time (in s) between two requests with *adaptive*
+        latency_factor: With *adaptive*, a response counts as slow if it takes this many times longer than usual for the host
+        request_slots: Semaphore limiting the number of requests at the same time over several crawls (e.g. of a batch crawl), or None
+        """
+        self.max_connections = max_connections_per_host
+        self.min_interval = min_interval
+        self.adaptive = adaptive
+        self.max_interval = max(max_interval, min_interval)
+        self.latency_factor = latency_factor
+        self.request_slots = request_slots
+        self.lock = threading.Lock()
+        self.host_semaphores = {}
+        self.next_request_time = {}
+        # Per host: interval added by adaptive throttling, smoothed and lowest smoothed response time
+        self.host_delays = {}
+        self.latencies = {}
+        self.base_latencies = {}
+        self.last_slowdowns = {}
+
+    @contextmanager
+    def slot(self, url):
+        """
+        Blocks until a request to the host of *url* is allowed, the slot is released when leaving the context
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.max_connections)
+            semaphore = self.host_semaphores[host]
+
+        semaphore.acquire()
+        try:
+            # Reserve the next free time slot for this host
+            with self.lock:
+                now = time.monotonic()
+                start_time = max(now, self.next_request_time.get(host, now))
+                self.next_request_time[host] = start_time + self.get_interval(host)
+            if start_time > now:
+                time.sleep(start_time - now)
+            if self.request_slots is None:
+                yield
+            else:
+                with self.request_slots:
+                    yield
+        finally:
+            semaphore.release()
+
+    def set_min_interval(self, min_interval):
+        """
+        Changes the minimal interval (in s) for all hosts, e.g. to the Crawl-delay of robots.txt
+        """
+        with self.lock:
+            self.min_interval = min_interval
+            self.max_interval = max(self.max_interval, min_interval)
+
+    def get_interval(self, host):
+        """
+        Returns the current interval (in s) between two requests to host
+        """
+        return min(self.max_interval, self.min_interval + self.host_delays.get(host, 0))
+
+    def report(self, url, latency, throttled=False, retry_after=None):
+        """
+        Feedback on a finished request, called by the fetch workers
+        Args:
+        latency: Duration of the request (in s)
+        throttled: True if the host refused the request (429, 5xx) or did not answer
+        retry_after: Wait time (in s) requested by the host, see parse_retry_after
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            if retry_after: 
+                self.next_request_time[host] = max(self.next_request_time.get(host, 0), time.monotonic() + retry_after)
+            if not self.adaptive:
+                return
+            if not throttled: 
+                # Exponentially smoothed response time, compared to the fastest average seen so far
+                latency = self.latencies[host] = 0.8*self.latencies[host] + 0.2*latency if host in self.latencies else latency
+                self.base_latencies[host] = min(self.base_latencies.get(host, latency), latency)
+                throttled = latency > max(self.latency_factor*self.base_latencies[host], SLOW_RESPONSE_MIN_LATENCY)
+
+            delay = self.host_delays.get(host, 0)
+            now = time.monotonic()
+            if throttled: 
+                # Multiplicative decrease of the request rate - at most once per interval, 
+                # as requests sent before the last slowdown still report errors
+                if now - self.last_slowdowns.get(host, -math.inf) < max(self.get_interval(host), latency): 
+                    return
+                new_delay = min(self.max_interval, max(2*delay, THROTTLE_INITIAL_DELAY))
+                self.last_slowdowns[host] = now
+                if new_delay > delay: 
+                    logging.info(f"Throttling requests to {host}: {self.min_interval + new_delay:.1f} s between requests\n")
+            else: 
+                # Additive increase of the request rate
+                new_delay = max(0, delay - THROTTLE_DECREASE_STEP)
+            self.host_delays[host] = new_delay
+
+
+class FetchWorkerPool:
+    """
+    Fixed set of worker threads loading pages in parallel.
+
+    Each worker owns its own client (a requests session or a playwright browser context), which is created by *open_client*,
+    renewed by *recycle_client* every *recycle_after* visits (deletes cookies etc.) and closed by *close_client*.
+    Only the fetching happens inside the workers: results are handed back to the thread calling *get_result*,
+    which thus keeps sole ownership of queue, visited pages and output.
+    """
+    def __init__(self, num_workers, open_client, fetch_page, recycle_client, close_client, host_limiter, recycle_after=50, stats=None) -> None:
+        """
+        Args:
+        num_workers: Number of pages loaded at the same time
+        open_client: Function without arguments, returns a new client
+        fetch_page: Function (client, url) -> (status, content, page_info), must not raise
+        recycle_client: Function (client) -> client, returns a fresh client
+        close_client: Function (client), releases all resources of the client
+        host_limiter: HostLimiter shared by all workers
+        stats: CrawlStats recording the time waited for the host and spent loading each page, if given
+        """
+        self.open_client = open_client
+        self.fetch_page = fetch_page
+        self.recycle_client = recycle_client
+        self.close_client = close_client
+        self.host_limiter = host_limiter
+        self.recycle_after = recycle_after
+        self.stats = stats
+
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.in_flight = 0
+
+        # Workers report back once their client is ready, errors during startup are raised here
+        startup_results = queue.Queue()
+        self.workers = [threading.Thread(target=self._work, args=(startup_results,), daemon=True) for _ in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+        startup_errors = [startup_results.get() for _ in self.workers]
+        startup_errors = [e for e in startup_errors if e is not None]
+        if startup_errors:
+            self.close()
+            raise startup_errors[0]
+
+    def submit(self, url):
+        """
+        Adds an url to be loaded by the next free worker
+        """
+        self.in_flight += 1
+        self.tasks.put(url)
+
+    def get_result(self):
+        """
+        Blocks until a page is loaded, raises RuntimeError if a worker stopped as its client could not be reopened
+        Returns:
+        status, url, content, page_info
+        """
+        result = self.results.get()
+        if isinstance(result, Exception): # A worker could not replace its failed client
+            raise RuntimeError(f'Fetch worker stopped: {result}') from result
+        self.in_flight -= 1
+        return result
+
+    def close(self):
+        """
+        Stops all workers after their current task, unfinished tasks are dropped
+        """
+        try:
+            while True:
+                self.tasks.get_nowait()
+        except queue.Empty:
+            pass
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def _work(self, startup_results):
+        try:
+            client = self.open_client()
+        except Exception as e:
+            logging.error(f"Could not start fetch worker: {e}\n")
+            startup_results.put(e)
+            return
+        startup_results.put(None)
+
+        visit_count = 0
+        try:
+            while True:
+                url = self.tasks.get()
+                if url is None:
+                    break
+                try:
+                    # Re-init client each *recycle_after* visited pages
+                    if visit_count == self.recycle_after:
+                        client = self.recycle_client(client)
+                        visit_count = 0
+                        print('INFO: Restarted browser session.\n')
+                    visit_count += 1
+
+                    wait_start = time.perf_counter()
+                    with self.host_limiter.slot(url):
+                        fetch_start = time.perf_counter()
+                        status, content, page_info = self.fetch_page(client, url)
+                except Exception as e:
+                    # Every task needs a result, else get_result would wait for it forever
+                    logging.error(f"Fetch worker failed on {url}: {e}\n")
+                    print(f"ERROR: Fetch worker failed on {url}: {e}")
+                    self.results.put((0, url, None, {'error': f'Fetch worker error: {e}', 'retryable': True, 'retry_after': None}))
+                    try:
+                        client = self._reopen_client(client)
+                    except Exception as reopen_error:
+                        logging.error(f"Could not reopen fetch client, stopping the crawl: {reopen_error}\n")
+                        print(f"ERROR: Could not reopen fetch client, stopping the crawl: {reopen_error}")
+                        client = None
+                        # Stops the crawl at the next get_result
+                        self.results.put(reopen_error)
+                        return
+                    visit_count = 0
+                    continue
+                if self.stats is not None:
+                    self.stats.record('host_wait', fetch_start - wait_start)
+                    self.stats.record('fetch', time.perf_counter() - fetch_start)
+                self.results.put((status, url, content, page_info))
+        finally:
+            if client is not None:
+                self.close_client(client)
+
+    def _reopen_client(self, client):
+        """
+        Replaces a client which failed (e.g. a browser context which could not be closed or opened again)
+        Returns:
+        The new client, errors when opening it are raised
+        """
+        try:
+            self.close_client(client)
+        except Exception as e:
+            logging.warning(f"Could not close failed fetch client: {e}\n")
+        return self.open_client()
@@ -0,0 +1,417 @@
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+
+# Query parameters used for tracking or sessions - they never change the content of a page
+TRACKING_PARAMETER_PATTERN = re.compile(r'^(utm_\w*|fbclid|gclid|dclid|msclkid|yclid|mc_cid|mc_eid|_ga|_gl|phpsessid|jsessionid|sid|sessionid|session_id)$', re.IGNORECASE)
+SESSION_PATH_PARAMETER_PATTERN = re.compile(r';(jsessionid|phpsessid|sid)=[^/?#]*', re.IGNORECASE)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# Path segments kept as they are in url patterns (e.g. 'tag', 'page', 'en'), all others are generalized
+PATTERN_WORD = re.compile(r'[a-zA-Z_]{1,20}')
+# Frontier: value assumed for url patterns without loaded pages yet, weighted like this many pages
+PRIOR_VALUE = 0.5
+PRIOR_WEIGHT = 2
+# Frontier: subtracted from the value of a pattern per link depth of its next url
+DEPTH_PENALTY = 0.05
+
+
+def canonicalize_url(url, default_scheme='https'): 
+    """
+    Returns the canonical form of an url, so that equivalent urls enter the queue only once: 
+    lowercase scheme and host, no default port, no fragment (except #! routes), 
+    no tracking or session parameters and query parameters in alphabetical order. 
+    Args: 
+    default_scheme: Used for urls without scheme, e.g. 'example.com/page' or '//example.com/page'
+    """
+    if not re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://', url): 
+        url = default_scheme + '://' + url.lstrip('/')
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    try: 
+        port = parts.port
+    except ValueError: # Invalid port, leave url as it is
+        return url
+    netloc = parts.hostname or ''
+    if port and DEFAULT_PORTS.get(scheme) != port: 
+        netloc += f':{port}'
+
+    path = SESSION_PATH_PARAMETER_PATTERN.sub('', parts.path) or '/'
+    # Parameters are filtered and sorted without decoding them, so that the url stays byte-identical otherwise
+    query_parameters = [p for p in parts.query.split('&') if p and not TRACKING_PARAMETER_PATTERN.match(p.split('=', 1)[0])]
+    query = '&'.join(sorted(query_parameters))
+    fragment = parts.fragment if parts.fragment.startswith('!') else ''
+    return urlunsplit((scheme, netloc, path, query, fragment))
+
+
+def url_pattern(url): 
+    """
+    Coarse pattern of an url, grouping pages of the same kind: 
+    first path segment (if it is a plain word, else '*'), number of path segments and names of the query parameters. 
+    E.g. 'https://example.com/tag/politics?page=2' -> 'tag/2?page', 'https://example.com/2024/05/some-article' -> '*/3?'
+    """
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.split('/') if segment]
+    first_segment = segments[0] if segments and PATTERN_WORD.fullmatch(segments[0]) else '*'
+    parameters = ','.join(sorted({p.split('=', 1)[0] for p in parts.query.split('&') if p}))
+    return f'{first_segment}/{len(segments)}?{parameters}'
+
+
+def url_key(url): 
+    """
+    Key identifying a canonical url independently of scheme and trailing slashes 
+    ('http://example.com/page/' and 'https://example.com/page' are the same page)
+    """
+    key = url.split('://', 1)[-1]
+    return re.sub(r'/+(?=\?|#|$)', '', key)
+
+
+class BloomFilter: 
+    """
+    Probabilistic set of byte strings: uses a fixed amount of memory, 
+    but claims to contain a key it never saw with probability *error_rate* (as long as *capacity* is not exceeded). 
+    """
+    def __init__(self, capacity, error_rate) -> None:
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2)**2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def add(self, key:bytes): 
+        for position in self._positions(key): 
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+        if self.count == self.capacity + 1: 
+            logging.warning(f"Bloom filter holds more than {self.capacity} urls, error rate increases - consider a higher bloom_capacity\n")
+
+    def __contains__(self, key:bytes): 
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def _positions(self, key): 
+        # Double hashing: all positions derived from two independent 64 bit hashes
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i*h2) % self.num_bits for i in range(self.num_hashes)]
+
+
+class UrlIndex: 
+    """
+    Compact set of all urls which already entered the queue (i.e. are queued, loading or visited). 
+    Only a 64 bit hash of each url_key is kept - or, with *bloom_capacity*, a Bloom filter of fixed size. 
+    """
+    def __init__(self, bloom_capacity=None, bloom_error_rate=0.000001) -> None:
+        self.bloom_filter = BloomFilter(bloom_capacity, bloom_error_rate) if bloom_capacity else None
+        self.hashes = set()
+        self.count = 0
+
+    def add(self, url): 
+        key = url_key(url).encode('utf-8')
+        if self.bloom_filter is not None: 
+            self.bloom_filter.add(key)
+        else: 
+            self.hashes.add(hashlib.blake2b(key, digest_size=8).digest())
+        self.count += 1
+
+    def __contains__(self, url): 
+        key = url_key(url).encode('utf-8')
+        if self.bloom_filter is not None: 
+            return key in self.bloom_filter
+        return hashlib.blake2b(key, digest_size=8).digest() in self.hashes
+
+    def __len__(self): 
+        return self.count
+
+
+class Frontier: 
+    """
+    Queue of the crawler, handing out the most promising url first instead of in arbitrary order. 
+
+    Urls are grouped by url_pattern (e.g. all '/article/<slug>' pages, all '/tag/<name>' pages), each group ordered by link depth. 
+    pop takes the next url of the group whose pages were most valuable so far (see done), minus a penalty per link depth - 
+    groups without loaded pages yet are rated optimistically, so that each kind of page is tried early on. 
+    With *prioritize* False, urls are handed out breadth first. 
+    Thread-safe, as the blacklist may be applied from another thread. 
+    """
+    def __init__(self, prioritize=True) -> None:
+        self.prioritize = prioritize
+        self.lock = threading.Lock()
+        # url pattern -> heap of (depth, counter, url); entries of removed urls are skipped when they come up
+        self.groups = {}
+        # url -> (counter, depth) of its valid heap entry
+        self.queued = {}
+        # url -> depth, for urls handed out but not done yet
+        self.loading = {}
+        # url pattern -> [number of loaded pages, sum of their values]
+        self.pattern_stats = {}
+        self.counter = 0
+
+    def __len__(self): 
+        return len(self.queued)
+
+    def __contains__(self, url): 
+        return url in self.queued
+
+    def __iter__(self): 
+        with self.lock: 
+            return iter(list(self.queued))
+
+    def add(self, url, depth=None): 
+        """
+        Args: 
+        depth: Link depth of url (0 for the starting page) - None for an url handed out before (e.g. for a retry) keeps its depth
+        """
+        with self.lock: 
+            if url in self.queued: 
+                return
+            if depth is None: 
+                depth = self.loading.get(url, 0)
+            self.counter += 1
+            self.queued[url] = (self.counter, depth)
+            pattern = url_pattern(url) if self.prioritize else ''
+            heapq.heappush(self.groups.setdefault(pattern, []), (depth, self.counter, url))
+
+    def pop(self): 
+        """
+        Returns the next url to be loaded - call done once it is finished
+        """
+        with self.lock: 
+            best_group = None
+            best_score = None
+            for pattern, group in list(self.groups.items()): 
+                while group and self.queued.get(group[0][2], (None,))[0] != group[0][1]: 
+                    heapq.heappop(group)
+                if not group: 
+                    del self.groups[pattern]
+                    continue
+                score = self._get_pattern_value(pattern) - DEPTH_PENALTY*group[0][0]
+                if best_score is None or score > best_score: 
+                    best_group = group
+                    best_score = score
+            if best_group is None: 
+                raise KeyError('pop from an empty frontier')
+            depth, _, url = heapq.heappop(best_group)
+            del self.queued[url]
+            self.loading[url] = depth
+            return url
+
+    def get_depth(self, url): 
+        """
+        Returns the link depth of an url handed out by pop
+        """
+        return self.loading.get(url, 0)
+
+    def done(self, url, value=None): 
+        """
+        Called once an url handed out by pop is finished
+        Args: 
+        value: Value of the page between 0 and 1 (e.g. 0 if it failed, 1 for an article with title and date), None if unknown
+        """
+        with self.lock: 
+            self.loading.pop(url, None)
+            if value is not None and self.prioritize: 
+                stats = self.pattern_stats.setdefault(url_pattern(url), [0, 0.0])
+                stats[0] += 1
+                stats[1] += value
+
+    def discard(self, url): 
+        with self.lock: 
+            self.queued.pop(url, None)
+
+    def remove_matching(self, match_func): 
+        """
+        Removes all queued urls for which match_func returns True
+        Returns: 
+        Number of removed urls
+        """
+        with self.lock: 
+            removed_urls = [url for url in self.queued if match_func(url)]
+            for url in removed_urls: 
+                del self.queued[url]
+        return len(removed_urls)
+
+    def _get_pattern_value(self, pattern): 
+        count, total = self.pattern_stats.get(pattern, (0, 0.0))
+        return (total + PRIOR_VALUE*PRIOR_WEIGHT) / (count + PRIOR_WEIGHT)
+
+
+class CrawlStateStore:
+    """
+    On-disk copy of queue and visited pages in a SQLite database, used to resume an interrupted crawl.
+
+    Changes are only committed at checkpoints, together with the sizes of the output files at that moment.
+    When resuming, the output files are cut back to these sizes and all pages processed since the last
+    checkpoint are loaded again - so no page is lost or written twice.
+    """
+    filename = 'crawl_state.sqlite'
+
+    def __init__(self, folder) -> None:
+        self.connection = sqlite3.connect(os.path.join(folder, self.filename))
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # depth: Link depth from the starting page - lastmod: Date of the last change according to the sitemap, if the page was found there
+        self.connection.execute('CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, visited INTEGER NOT NULL DEFAULT 0, lastmod TEXT, depth INTEGER)')
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(pages)')]
+        for column, column_type in (('lastmod', 'TEXT'), ('depth', 'INTEGER')): 
+            if column not in columns: # Saved by an older version
+                self.connection.execute(f'ALTER TABLE pages ADD COLUMN {column} {column_type}')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value)')
+        # Response validators, content hash and hrefs of each loaded page - used by the next run of an incremental recrawl
+        self.connection.execute('CREATE TABLE IF NOT EXISTS page_cache (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT, hrefs TEXT)')
+        # Pages which could not be loaded - final: 1 once all attempts are used up, else still scheduled for a retry
+        self.connection.execute('CREATE TABLE IF NOT EXISTS errors (url TEXT PRIMARY KEY, attempts INTEGER NOT NULL, error TEXT, final INTEGER NOT NULL DEFAULT 0)')
+        self.connection.commit()
+
+    @classmethod
+    def exists(cls, folder):
+        """
+        Returns True if a crawl state was saved in folder
+        """
+        return os.path.exists(os.path.join(folder, cls.filename))
+
+    @classmethod
+    def has_checkpoint(cls, folder):
+        """
+        Returns True if a crawl state with at least one checkpoint was saved in folder - 
+        a crawl stopped before (e.g. while reading the sitemaps) leaves an empty state, from which it cannot be resumed
+        """
+        if not cls.exists(folder):
+            return False
+        state_store = cls(folder)
+        try:
+            return state_store.get_info('starting_url') is not None and state_store.connection.execute('SELECT 1 FROM pages LIMIT 1').fetchone() is not None
+        finally:
+            state_store.close()
+
+    @classmethod
+    def remove(cls, folder):
+        """
+        Deletes the crawl state saved in folder (incl. the journal files of SQLite)
+        """
+        for suffix in ('', '-wal', '-shm'):
+            path = os.path.join(folder, cls.filename + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def add_to_queue(self, urls, depth=None, lastmods=None):
+        """
+        Args:
+        depth: Link depth of all urls
+        lastmods: List of the lastmod (or None) of each url, for urls from a sitemap
+        """
+        if lastmods is None:
+            lastmods = [None] * len(urls)
+        self.connection.executemany('INSERT OR IGNORE INTO pages (url, visited, lastmod, depth) VALUES (?, 0, ?, ?)', 
+                                    ((url, lastmod, depth) for url, lastmod in zip(urls, lastmods)))
+
+    def mark_visited(self, url):
+        self.connection.execute('INSERT INTO pages (url, visited) VALUES (?, 1) ON CONFLICT(url) DO UPDATE SET visited = 1', (url,))
+
+    def save_page_cache(self, url, etag, last_modified, content_hash, hrefs): 
+        """
+        Args: 
+        hrefs: All hrefs of the page (unfiltered, so that a changed blacklist still applies)
+        """
+        self.connection.execute('INSERT OR REPLACE INTO page_cache (url, etag, last_modified, content_hash, hrefs) VALUES (?, ?, ?, ?, ?)', 
+                                (url, etag, last_modified, content_hash, json.dumps(hrefs)))
+
+    def save_error(self, url, attempts, error, final):
+        self.connection.execute('INSERT OR REPLACE INTO errors (url, attempts, error, final) VALUES (?, ?, ?, ?)', (url, attempts, error, int(final)))
+
+    def remove_error(self, url):
+        """
+        Called once a page loads after failed attempts
+        """
+        self.connection.execute('DELETE FROM errors WHERE url = ?', (url,))
+
+    def iter_errors(self, final=None):
+        """
+        Iterates over the pages which could not be loaded, as saved at the last checkpoint
+        Args:
+        final: True for pages given up, False for pages waiting for a retry, None for all
+        Yields:
+        url, attempts, error, final
+        """
+        query = 'SELECT url, attempts, error, final FROM errors'
+        parameters = ()
+        if final is not None:
+            query += ' WHERE final = ?'
+            parameters = (int(final),)
+        for url, attempts, error, is_final in self.connection.execute(query, parameters):
+            yield url, attempts, error, bool(is_final)
+
+    def set_info(self, key, value):
+        self.connection.execute('INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)', (key, value))
+
+    def get_info(self, key):
+        row = self.connection.execute('SELECT value FROM info WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def checkpoint(self, file_sizes):
+        """
+        Commits all changes since the last checkpoint
+        Args:
+        file_sizes: dict filename -> size in bytes of each output file at this point
+        """
+        for filename, size in file_sizes.items():
+            self.set_info('size:' + filename, size)
+        self.connection.commit()
+
+    def iter_pages(self): 
+        """
+        Iterates over all pages saved at the last checkpoint
+        Yields: 
+        url, visited (True if already visited, False if still in queue), depth (None if saved by an older version)
+        """
+        for url, visited, depth in self.connection.execute('SELECT url, visited, depth FROM pages'): 
+            yield url, bool(visited), depth
+
+    def get_file_sizes(self): 
+        """
+        Returns: 
+        dict filename -> size in bytes of each output file at the last checkpoint
+        """
+        return {key[len('size:'):]: value for key, value in self.connection.execute("SELECT key, value FROM info WHERE key LIKE 'size:%'")}
+
+    def close(self):
+        self.connection.close()
+
+
+class PageCache: 
+    """
+    Read-only access to the page cache of an earlier run (saved in its CrawlStateStore), used for incremental recrawls. 
+    Shared by all fetch workers. 
+    """
+    def __init__(self, folder) -> None:
+        path = os.path.join(folder, CrawlStateStore.filename)
+        if not os.path.exists(path): 
+            raise FileNotFoundError(f"No crawl state found in {folder}, can not be used as previous run")
+        self.connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.available = self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'page_cache'").fetchone() is not None
+        if not self.available: 
+            logging.warning(f"The run in {folder} has no page cache, all pages are loaded completely\n")
+            print(f"WARNING: The run in {folder} has no page cache, all pages are loaded completely")
+
+    def get(self, url): 
+        """
+        Returns: 
+        dict with etag, last_modified, content_hash and hrefs of url in the earlier run - None if it was not loaded then
+        """
+        if not self.available: 
+            return None
+        with self.lock: 
+            row = self.connection.execute('SELECT etag, last_modified, content_hash, hrefs FROM page_cache WHERE url = ?', (url,)).fetchone()
+        if row is None: 
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'content_hash': row[2], 'hrefs': json.loads(row[3])}
+
+    def close(self): 
+        self.connection.close()
@@ -1,20 +1,51 @@
 import logging
 import os
 import re
+import time
 from remove_doublons import MinHashFilter
+from html_archive import ArchiveWriter
+from output_writer import BackgroundWriter
+import scraped_output
+
+def get_output_filename(starting_url): 
+    """
+    Name of the text output of a crawl, e.g. 'https://www.example.com/fr/' -> 'scraped_pages_www_example_com_fr.txt'
+    """
+    return 'scraped_pages_' + re.sub('(?<=_)_|(?<=^)_|_+$', '', re.sub(r'\W|https?|html', '_', starting_url[:100])) + '.txt'
+
 
 class TerminalOutput:
-    def __init__(self, settings, folder, filename) -> None:
+    def __init__(self, settings, folder, filename, stats=None) -> None:
+        """
+        Args: 
+        stats: CrawlStats recording the time spent on duplicate detection and output writing, if given
+        """
         self.dir = folder
+        self.stats = stats
+        # Text output as .txt file with <begin-of-url> blocks and/or as JSON Lines (optionally converted to Parquet at the end)
+        self.output_format = settings['file']['format']
+        if self.output_format not in ('txt', 'jsonl', 'both'): 
+            raise ValueError(f"Unknown output format '{self.output_format}', use 'txt', 'jsonl' or 'both'")
         self.output_file_path = os.path.join(folder, filename)
-        self.html_file_path = 'all_pages_html.txt'
+        self.jsonl_file_path = os.path.splitext(self.output_file_path)[0] + '.jsonl'
+        self.write_parquet = settings['file']['parquet']
+        if self.write_parquet and self.output_format == 'txt': 
+            raise ValueError("Parquet output is converted from the JSON Lines output, please set format to 'jsonl' or 'both'")
+        # All files are written by a separate thread
+        writer_settings = settings['writer']
+        self.Writer = BackgroundWriter(writer_settings['queue_size'], writer_settings['flush_interval'], fsync=writer_settings['fsync'])
+        # Html of all pages, saved as compressed WARC records with an index
+        self.ArchiveWriter = ArchiveWriter(folder, settings['html_archive']['compression'], self.Writer)
         
         self.settings = settings
 
         self.filter_duplicates = False
         if settings ['file']['doublons']['remove_doublons']:
             self.filter_duplicates = True
-            self.DuplicateFilter = MinHashFilter(settings['file']['doublons']['threshold_value'])
+            # Optionally saved to disk and shared with other runs - the output directory identifies this run
+            self.DuplicateFilter = MinHashFilter(settings['file']['doublons']['threshold_value'], 
+                                                 index_path=settings['file']['doublons']['index_path'], 
+                                                 run_id=os.path.abspath(folder))
 
         self.verbose = settings['console']['verbose']
         self.frequency = settings['console']['print_one_per']
@@ -29,29 +60,17 @@ class TerminalOutput:
         self.missing_date_count = 0
         self.missing_title_and_date_count = 0
         self.total_count = 0
-        
-        self.write_count_html = 0
-        self.write_count_scraped = 0
-        self.buffer_size = 1
-        self.html_buffer = [''] * self.buffer_size
-        self.scraped_text_buffer = [''] * self.buffer_size
 
 
-    def save_html(self, soup, url):
+
+    def save_html(self, url, content, status_code=None, headers=None):
         """
-        Writes a soup html object to a file, using the url as filename
+        Adds a page (as received, not re-serialized from the soup) to the html archive
+        Args: 
+        content: Response body as bytes, or html string of a page rendered by playwright
+        status_code, headers: Status and list of (name, value) headers of the HTTP response, None for playwright
         """
-        # Place text in first free field of buffer
-        text = '\n--- Separator ---\n' + url + '\n' + str(soup)
-        self.html_buffer[self.write_count_html%self.buffer_size] = text
-
-        # Write buffer to file if current field is last 
-        if self.write_count_html%self.buffer_size == self.buffer_size-1: 
-            with open(os.path.join(self.dir, self.html_file_path), 'a', encoding='utf-8') as fw:
-                    fw.write(''.join(self.html_buffer))
-
-        # Go to next free field of buffer
-        self.write_count_html += 1
+        self.ArchiveWriter.write_record(url, content, status_code, headers)
         
 
     def record_output(self, queue_len, url, scraped_text, percentage, title, date, date_fallback_flag, author, volume):
@@ -150,52 +169,120 @@ class TerminalOutput:
         Appends the output to a file.
         Differents pages are put into a block of <begin-of-url> ...text <end-of-url>
         Anything else separated via <separate-parts>\n
+        Returns: 
+        True if the text passed the quality checks and duplicate filter and was written
         """
         # Check quality thresholds
         write_text = False
         if self.filter_duplicates: 
-            if self.get_quality_rating(percentage, scraped_text) and self.DuplicateFilter.check_new_article(scraped_text):
-                self.DuplicateFilter.add_article(scraped_text, url)
-                write_text = True
+            if self.get_quality_rating(percentage, scraped_text): 
+                dedup_start = time.perf_counter()
+                write_text = self.DuplicateFilter.check_and_add(scraped_text, url)
+                if self.stats is not None: 
+                    self.stats.record('dedup', time.perf_counter() - dedup_start)
         else: 
             if self.get_quality_rating(percentage, scraped_text): 
                 write_text = True
 
-        # Place text in current field
-        if write_text: 
+        # Only waits for the writer thread if its queue is full, i.e. if the disk is too slow
+        write_start = time.perf_counter()
+        # Hand text to the writer thread
+        if write_text and self.output_format in ('txt', 'both'): 
             text = '<begin-of-url>\n' + url + \
                     '\n<separate-parts>\n' + (title if title else '') + \
                     '\n<separate-parts>\n' + (date if date else '') + \
                     '\n<separate-parts>\n' + (author if author else '') + \
                     '\n<separate-parts>\n' + scraped_text + '\n<end-of-url>\n'
-        else: 
-            text = ''
-        self.scraped_text_buffer[self.write_count_scraped%self.buffer_size] = text
-        
-        # Write buffer to file
-        if self.write_count_scraped%self.buffer_size == self.buffer_size-1: 
-            with open(self.output_file_path, 'a', encoding="utf-8") as fw:
-                fw.write(''.join(self.scraped_text_buffer))
-
-        # Go to next field
-        self.write_count_scraped += 1
+            self.Writer.append(self.output_file_path, text.encode('utf-8'))
+        if write_text and self.output_format in ('jsonl', 'both'): 
+            line = scraped_output.page_to_json(url, title, date, author, volume, percentage, scraped_text)
+            self.Writer.append(self.jsonl_file_path, line.encode('utf-8'))
+        if write_text and self.stats is not None: 
+            self.stats.record('write', time.perf_counter() - write_start)
+            self.stats.count('pages_written')
                
         # Adding linebreak to log, could be solved a lot cleaner
         logging.info(f"\n")
+        return write_text
                 
                     
                
+    def get_file_sizes(self): 
+        """
+        Waits until everything is written to the files
+        Returns: 
+        dict filename -> current size in bytes for all output files
+        """
+        self.flush_buffers()
+        file_sizes = {}
+        for path in self._get_output_paths(): 
+            file_sizes[os.path.basename(path)] = os.path.getsize(path) if os.path.exists(path) else 0
+        return file_sizes
+
+
+    def restore_file_sizes(self, file_sizes): 
+        """
+        Cuts all output files back to the sizes returned by an earlier call of get_file_sizes, 
+        removing any page written since. 
+        """
+        for path in self._get_output_paths(): 
+            size = file_sizes.get(os.path.basename(path), 0)
+            if os.path.exists(path) and os.path.getsize(path) > size: 
+                with open(path, 'r+b') as f: 
+                    f.truncate(size)
+                logging.info(f"Removed everything after the last checkpoint from {path}")
+
+
+    def restore_duplicate_filter(self): 
+        """
+        Called when resuming a crawl, after restore_file_sizes: adds all pages kept in the output to the duplicate filter, 
+        if its index is only kept in memory (a saved index, see index_path, still contains them). 
+        Returns: 
+        Number of pages added
+        """
+        if not self.filter_duplicates or self.settings['file']['doublons']['index_path']: 
+            return 0
+        # JSON Lines keeps the text exactly as it was checked
+        path = self.jsonl_file_path if self.output_format in ('jsonl', 'both') else self.output_file_path
+        if not os.path.exists(path): 
+            return 0
+        urls = set()
+        for page in scraped_output.iter_scraped_pages(path): 
+            if page['url'] not in urls: 
+                urls.add(page['url'])
+                self.DuplicateFilter.add_article(page['text'] or '', page['url'])
+        return len(urls)
+
+
+    def _get_output_paths(self): 
+        return [self.ArchiveWriter.archive_path, self.ArchiveWriter.index_path, self.output_file_path, self.jsonl_file_path]
+
+
     def flush_buffers(self): 
-        with open(os.path.join(self.dir, self.html_file_path), 'a', encoding='utf-8') as fw:
-                    fw.write(''.join(self.html_buffer[:self.write_count_html%self.buffer_size]))
-        self.html_buffer = ['']*self.buffer_size
-        
-        with open(self.output_file_path, 'a', encoding="utf-8") as fw:
-                fw.write(''.join(self.scraped_text_buffer[:self.write_count_scraped%self.buffer_size]))
-        self.scraped_text_buffer = ['']*self.buffer_size
+        """
+        Waits until the writer thread has written everything to the files
+        """
+        self.Writer.drain()
 
-        
+
+    def finish(self): 
+        """
+        Called once the crawl is complete: converts the JSON Lines output to Parquet, if activated
+        """
+        if self.write_parquet: 
+            self.flush_buffers()
+            parquet_path = os.path.splitext(self.jsonl_file_path)[0] + '.parquet'
+            scraped_output.jsonl_to_parquet(self.jsonl_file_path, parquet_path)
+            logging.info(f"Saved output as {parquet_path}\n")
+            print(f"Saved output as {parquet_path}")
 
 
-        
-        
\ No newline at end of file
+    def close(self): 
+        """
+        Writes everything to the files and stops the writer thread
+        """
+        self.Writer.close()
+        if self.filter_duplicates: 
+            self.DuplicateFilter.close()
+        logging.info(f"Output writer: {self.Writer.records_written} writes, {self.Writer.bytes_written} bytes, "
+                     f"at most {self.Writer.max_queue_depth} writes waiting\n")
@@ -2,14 +2,18 @@ import os
 import shutil
 import yaml
 
+import frontier
+
 
 def request_settings(): 
     """
     Returns: 
-    settings (dict)
     dir: path to directory where the output will be saved
+    resume: True if the crawl saved in dir is to be continued
     """
     dir = None
+    resume = False
+    keep_settings = False
     #Creating a directory for the output 
     while True: 
         dir = input("Please enter a name for the output directory: ")
@@ -19,29 +23,63 @@ def request_settings():
             print(f'All data of this run saved under {os.path.abspath(dir)}\n')
             break
         else: 
-            overwrite = input("Folder already exists, enter 'y' if you want to overwrite all content: ")
+            if frontier.CrawlStateStore.exists(dir): 
+                overwrite = input("Folder already exists, enter 'r' to resume the crawl saved in it or 'y' if you want to overwrite all content: ")
+            else: 
+                overwrite = input("Folder already exists, enter 'y' if you want to overwrite all content: ")
+            if overwrite.strip() == 'r' and frontier.CrawlStateStore.exists(dir): 
+                if frontier.CrawlStateStore.has_checkpoint(dir): 
+                    resume = True
+                    print(f'Resuming the crawl saved under {os.path.abspath(dir)}\n')
+                    break
+                # Stopped before its first checkpoint (e.g. while reading the sitemaps) - nothing to resume, 
+                # the crawl is started again with the settings file of the folder
+                frontier.CrawlStateStore.remove(dir)
+                keep_settings = os.path.exists(os.path.join(dir, 'settings.yaml'))
+                print(f'No progress was saved under {os.path.abspath(dir)} yet, starting a new crawl there\n')
+                break
             if overwrite.strip() == 'y':
                 shutil.rmtree(dir)
                 os.makedirs(dir)#exist_ok=True
                 print(f'All data of this run saved under {os.path.abspath(dir)}\n')
                 break
 
-    #Loading settings
-    shutil.copyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings_template.yaml'), f'{os.path.abspath(dir)}/settings.yaml')
+    #Loading settings - when resuming, the settings of the interrupted run are kept
+    if resume or keep_settings: 
+        settings_message = "The settings file of the interrupted run is kept in the directory, please modify it if you want to change the settings."
+    else: 
+        shutil.copyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings_template.yaml'), f'{os.path.abspath(dir)}/settings.yaml')
+        settings_message = "A settings file was created in the directory, please modify it if you want to change the settings."
     while True:
-        continue_check = input("A settings file was created in the directory, please modify it if you want to change the settings. \nEnter 'c' to continue: ")
+        continue_check = input(settings_message + " \nEnter 'c' to continue: ")
         if continue_check.strip() == 'c': 
             break
 
-    return dir
+    return dir, resume
 
 def read_settings_file(dir): 
     settings_path = os.path.join(dir, 'settings.yaml')
     with open(settings_path, 'r') as file:
         settings = yaml.safe_load(file)
 
+    # Settings files of older runs may miss options added since - use the template values for those
+    template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings_template.yaml')
+    with open(template_path, 'r') as file:
+        default_settings = yaml.safe_load(file)
+    _add_missing_settings(settings, default_settings)
+
     return settings
 
+def _add_missing_settings(settings, default_settings): 
+    """
+    Recursively copies every key of default_settings missing in settings (modifies settings in place)
+    """
+    for key, value in default_settings.items(): 
+        if key not in settings: 
+            settings[key] = value
+        elif isinstance(value, dict) and isinstance(settings[key], dict): 
+            _add_missing_settings(settings[key], value)
+
 def request_starting_page(): 
     starting_page = input("Please enter a starting page: ")
     return starting_page
\ No newline at end of file
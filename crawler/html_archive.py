@@ -0,0 +1,238 @@
+import gzip
+import http.client
+import os
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from output_writer import BackgroundWriter
+
+
+ARCHIVE_FILENAME = 'all_pages_html.warc'
+INDEX_FILENAME = 'all_pages_html.idx'
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+# Headers describing the transfer of the body - dropped, as the body is saved decoded
+TRANSFER_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length')
+
+ArchiveRecord = namedtuple('ArchiveRecord', ['url', 'date', 'status_code', 'headers', 'content'])
+
+
+def _get_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Compression 'zstd' needs the package zstandard: pip install zstandard")
+    return zstandard
+
+
+def _escape_url(url):
+    # Urls are saved one per line in the index
+    return url.replace('\t', '%09').replace('\n', '%0A').replace('\r', '%0D')
+
+
+class ArchiveWriter:
+    """
+    Saves the html of all pages as a WARC file, each record compressed as a separate gzip member (or zstd frame).
+    A sidecar index (url, offset, length per line) allows reading any record without decompressing the whole archive,
+    see ArchiveReader.
+
+    Pages loaded with requests are saved as 'response' records with status line and headers,
+    pages rendered by playwright as 'resource' records of the final DOM.
+    Records are compressed in the calling thread and written by a BackgroundWriter.
+    """
+    def __init__(self, folder, compression='gzip', writer=None) -> None:
+        """
+        Args:
+        writer: BackgroundWriter shared with other output files - if None, the archive uses its own
+        """
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError(f"Unknown compression '{compression}' for the html archive, use one of {list(COMPRESSION_EXTENSIONS)}")
+        if compression == 'zstd':
+            self.compressor = _get_zstandard().ZstdCompressor(level=3)
+        self.compression = compression
+        self.archive_path = os.path.join(folder, ARCHIVE_FILENAME + COMPRESSION_EXTENSIONS[compression])
+        self.index_path = os.path.join(folder, INDEX_FILENAME)
+        self.own_writer = writer is None
+        self.writer = BackgroundWriter() if writer is None else writer
+        # Determined on first write, so that the files can still be cut back when resuming
+        self.offset = None
+
+    def write_record(self, url, content, status_code=None, headers=None):
+        """
+        Args:
+        content: The page as received - bytes, or string (saved utf-8 encoded)
+        status_code: HTTP status, None for a page rendered by playwright (saved without HTTP headers)
+        headers: List of (name, value) pairs of the HTTP response
+        """
+        if self.offset is None:
+            self.offset = os.path.getsize(self.archive_path) if os.path.exists(self.archive_path) else 0
+
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        if status_code is None:
+            record_type = 'resource'
+            content_type = 'text/html; charset=utf-8'
+            block = content
+        else:
+            record_type = 'response'
+            content_type = 'application/http;msgtype=response'
+            http_headers = [(name, value) for name, value in (headers or []) if name.lower() not in TRANSFER_HEADERS]
+            http_headers.append(('Content-Length', str(len(content))))
+            http_head = f'HTTP/1.1 {status_code} {http.client.responses.get(status_code, "")}\r\n' + ''.join(f'{name}: {value}\r\n' for name, value in http_headers) + '\r\n'
+            block = http_head.encode('utf-8', errors='replace') + content
+
+        warc_head = ('WARC/1.0\r\n'
+                     f'WARC-Type: {record_type}\r\n'
+                     f'WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n'
+                     f'WARC-Date: {datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}\r\n'
+                     f'WARC-Target-URI: {url}\r\n'
+                     f'Content-Type: {content_type}\r\n'
+                     f'Content-Length: {len(block)}\r\n'
+                     '\r\n')
+        record = warc_head.encode('utf-8') + block + b'\r\n\r\n'
+        if self.compression == 'zstd':
+            record = self.compressor.compress(record)
+        else:
+            record = gzip.compress(record, compresslevel=6, mtime=0)
+
+        self.writer.append(self.archive_path, record)
+        self.writer.append(self.index_path, f'{_escape_url(url)}\t{self.offset}\t{len(record)}\n'.encode('utf-8'))
+        self.offset += len(record)
+
+    def close(self):
+        if self.own_writer:
+            self.writer.close()
+
+
+class ArchiveReader:
+    """
+    Random access to the pages saved by ArchiveWriter:
+    the index is loaded into memory, each record is read and decompressed on its own.
+    """
+    def __init__(self, folder) -> None:
+        self.archive_path = None
+        for compression, extension in COMPRESSION_EXTENSIONS.items():
+            path = os.path.join(folder, ARCHIVE_FILENAME + extension)
+            if os.path.exists(path):
+                self.archive_path = path
+                self.compression = compression
+        if self.archive_path is None:
+            raise FileNotFoundError(f"No html archive found in {folder}")
+        if self.compression == 'zstd':
+            self.decompressor = _get_zstandard().ZstdDecompressor()
+
+        # url -> offset, length - if a page was saved twice, the last record is used
+        self.index = {}
+        # Offsets of all records in the order they were written
+        self.offsets = []
+        with open(os.path.join(folder, INDEX_FILENAME), 'r', encoding='utf-8') as fr:
+            for line in fr:
+                url, offset, length = line.rstrip('\n').split('\t')
+                self.index[url] = (int(offset), int(length))
+                self.offsets.append((int(offset), int(length)))
+        self.archive_file = open(self.archive_path, 'rb')
+
+    def __contains__(self, url):
+        return _escape_url(url) in self.index
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def urls(self):
+        return self.index.keys()
+
+    def get(self, url):
+        """
+        Returns:
+        ArchiveRecord of url, None if it is not in the archive
+        """
+        position = self.index.get(_escape_url(url))
+        if position is None:
+            return None
+        return self._read_record(*position)
+
+    def __iter__(self):
+        """
+        Yields all records in the order they were written
+        """
+        for offset, length in self.offsets:
+            yield self._read_record(offset, length)
+
+    def iter_latest(self):
+        """
+        Yields the records in the order they were written, leaving out those of pages saved again later
+        """
+        latest = set(self.index.values())
+        for offset, length in self.offsets:
+            if (offset, length) in latest:
+                yield self._read_record(offset, length)
+
+    def close(self):
+        self.archive_file.close()
+
+    def _read_record(self, offset, length):
+        self.archive_file.seek(offset)
+        data = self.archive_file.read(length)
+        if self.compression == 'zstd':
+            data = self.decompressor.decompress(data)
+        else:
+            data = gzip.decompress(data)
+
+        warc_head, _, rest = data.partition(b'\r\n\r\n')
+        warc_headers = self._parse_headers(warc_head.decode('utf-8').split('\r\n')[1:])
+        block = rest[:int(warc_headers['content-length'])]
+        if warc_headers['warc-type'] == 'response':
+            http_head, _, content = block.partition(b'\r\n\r\n')
+            http_lines = http_head.decode('utf-8', errors='replace').split('\r\n')
+            status_code = int(http_lines[0].split()[1])
+            headers = [tuple(line.split(': ', 1)) for line in http_lines[1:]]
+        else:
+            status_code = None
+            headers = []
+            content = block
+        return ArchiveRecord(warc_headers['warc-target-uri'], warc_headers['warc-date'], status_code, headers, content)
+
+    def _parse_headers(self, lines):
+        headers = {}
+        for line in lines:
+            name, _, value = line.partition(': ')
+            headers[name.lower()] = value
+        return headers
+
+
+def iter_saved_pages(folder, max_pages=None):
+    """
+    Streams the pages saved in the html archive of an output directory
+    (or in all_pages_html.txt for crawls from before the archive), e.g. to extract them again with new settings
+    Yields:
+    url, html (bytes from the archive, string from all_pages_html.txt)
+    """
+    html_path = os.path.join(folder, 'all_pages_html.txt')
+    if not os.path.exists(html_path):
+        archive = ArchiveReader(folder)
+        for count, record in enumerate(archive.iter_latest()):
+            if max_pages and count >= max_pages:
+                break
+            yield record.url, record.content
+        archive.close()
+        return
+
+    # Each page is saved as '\n--- Separator ---\n' + url + '\n' + html
+    separator = '--- Separator ---\n'
+    url = None
+    lines = []
+    count = 0
+    with open(html_path, 'r', encoding='utf-8') as fr:
+        for line in fr:
+            if line == separator:
+                if url is not None:
+                    yield url, ''.join(lines)[:-1]
+                    count += 1
+                    if max_pages and count >= max_pages:
+                        return
+                url = next(fr, '').strip()
+                lines = []
+            else:
+                lines.append(line)
+    if url is not None:
+        yield url, ''.join(lines)
@@ -0,0 +1,103 @@
+import re
+from functools import lru_cache
+
+
+def build_ignored_pages_pattern(pages_to_be_ignored):
+    """
+    Combines the list *pages_to_be_ignored* from the settings into a single regex string, escaping all slashes
+    """
+    return re.sub(r'(/|\\)', r'\\\1', '|'.join(pages_to_be_ignored)) if pages_to_be_ignored else ''
+
+
+class LinkFilter:
+    """
+    Decides for each href found on a page, which url (if any) is added to the queue.
+
+    All checks are compiled once: the check for the own website is a plain prefix comparison where possible,
+    ignored file types and blacklist are combined into a single regex, and results are cached per href,
+    as navigation links repeat on every page of a website.
+    """
+    ignored_page_types = r'\.(png|pdf|jpg)'
+
+    def __init__(self, base_url, base_url_pattern, pages_to_be_ignored=None, cache_size=100000) -> None:
+        """
+        Args:
+        base_url: Scheme and host of the website, used to complete relative links (e.g. 'https://example.com')
+        base_url_pattern: Regex matched at the start of absolute links of the website
+        pages_to_be_ignored: List of regex strings from the settings
+        """
+        self.base_url = base_url
+        # Fast path for the usual pattern (https?://)?<escaped host>: equivalent to a check of three prefixes
+        self.base_prefixes = None
+        self.base_url_pattern = re.compile(base_url_pattern)
+        pattern_parts = re.fullmatch(r'\(https\?://\)\?(.+)', base_url_pattern)
+        if pattern_parts:
+            base_host = pattern_parts.group(1).replace('\\', '')
+            if re.escape(base_host) == pattern_parts.group(1):
+                self.base_prefixes = ('http://' + base_host, 'https://' + base_host, base_host)
+        self.absolute_url_pattern = re.compile(r'^(?:[a-z+]+:)?\/\/') # matches absolute urls paths as compared to relative ones
+        self.cache_size = cache_size
+        self.ignored_pages = None
+        self.set_ignored_pages(pages_to_be_ignored)
+
+    def set_ignored_pages(self, pages_to_be_ignored):
+        """
+        Replaces the blacklist - may be called from another thread while the crawler is running
+        """
+        ignored_pages = build_ignored_pages_pattern(pages_to_be_ignored)
+        if ignored_pages == self.ignored_pages:
+            return
+        if ignored_pages:
+            rejected_pattern = re.compile(f'(?:{self.ignored_page_types})|(?:{ignored_pages})')
+            ignored_pages_pattern = re.compile(ignored_pages)
+        else:
+            rejected_pattern = re.compile(self.ignored_page_types)
+            ignored_pages_pattern = None
+        # Assigned together with a new cache, so that no result of the old blacklist is used anymore
+        self.ignored_pages = ignored_pages
+        self.ignored_pages_pattern = ignored_pages_pattern
+        self.rejected_pattern = rejected_pattern
+        self.filter_href = lru_cache(maxsize=self.cache_size)(self._filter_href)
+
+    def is_ignored(self, url):
+        """
+        Returns True if url is on the blacklist
+        """
+        pattern = self.ignored_pages_pattern
+        return pattern is not None and pattern.search(url) is not None
+
+    def filter_links(self, hrefs):
+        """
+        Returns a list of all urls to be added to the queue for the hrefs of a page
+        """
+        links = []
+        filter_href = self.filter_href
+        for href in set(hrefs):
+            links.extend(filter_href(href))
+        return links
+
+    def filter_url(self, url):
+        """
+        Like filter_links for a single url from another source (e.g. a sitemap) - not cached, as such urls do not repeat
+        """
+        return self._filter_href(url)
+
+    def _filter_href(self, href):
+        """
+        Returns a tuple of the urls to be queued for a single href (usually zero or one)
+        """
+        # Checks if is a png/jpg/pdf or in blacklist
+        if self.rejected_pattern.search(href):
+            return ()
+        links = ()
+        # Checks if link is on same site
+        if self.base_prefixes is not None:
+            if href.startswith(self.base_prefixes):
+                links = (href,)
+        elif self.base_url_pattern.match(href):
+            links = (href,)
+        # If link not on same site: outside -> ignore, relative link -> combine with base url
+        if not self.absolute_url_pattern.match(href):
+            full_link = self.base_url + href if len(href) > 0 and href[0] == '/' else self.base_url + '/' + href
+            links += (full_link,)
+        return links
@@ -1,5 +1,10 @@
 import xml.etree.ElementTree as ET
+import os
 import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from scraped_output import iter_scraped_pages
 
 def add_txt_file(path): 
     with open(path, 'r') as fr: 
@@ -14,20 +19,25 @@ def add_txt_file(path):
             text = page_data[4]
 
 class XMLWriter:
-    def __init__(self) -> None:
+    """
+    Writes scraped_pages_* files as TEI corpus, one <group> per file. 
+    The corpus is never held in memory: each file is only read in write_to_file, page by page, 
+    and each <text> element is written as soon as it is created - 
+    the output is the same as building the whole tree and serializing it with ET.indent and ElementTree.write. 
+    """
+    indent_space = "    "
 
-        # Create the root element
-        self.root = ET.Element("TEIcorpus")
-        # Create the TEI element with an attribute
-        self.tei = ET.SubElement(self.root, "TEI", type="website")
+    def __init__(self) -> None:
+        # Files to be written as groups: path, group_name, subtype, ana
+        self.groups = []
 
-    def _add_group(self, parent_element: ET.Element, group_name: str, subtype: str, ana: str) -> ET.Element:
-        # Create the group element with attributes under the parent_element
-        return ET.SubElement(parent_element, "group", name=group_name, subtype=subtype, ana=ana)
+    def _create_group(self, group_name: str, subtype: str, ana: str) -> ET.Element:
+        # Create the group element with attributes (written without children)
+        return ET.Element("group", name=group_name, subtype=subtype, ana=ana)
 
-    def _add_text_element(self, parent_element: ET.Element, url: str, title: str, date: str, author: str, body_text: str, header_text: str = None) -> None:
-        # Create the text element with attributes and body content under the parent_element
-        text_elem = ET.SubElement(parent_element, "text", when=date if date else 'na', year="na", who=author if author else 'na', title=title, url=url)
+    def _create_text_element(self, url: str, title: str, date: str, author: str, body_text: str, header_text: str = None) -> ET.Element:
+        # Create the text element with attributes and body content
+        text_elem = ET.Element("text", when=date if date else 'na', year="na", who=author if author else 'na', title=title, url=url)
 
         # Add header and body elements
         if header_text:
@@ -36,27 +46,76 @@ class XMLWriter:
 
         body_elem = ET.SubElement(text_elem, "body")
         body_elem.text = body_text
+        return text_elem
 
 
     def add_txt_file(self, path, group_name= None, subtype=None, ana=None):
-        group_elem = self._add_group(self.root, group_name=group_name if group_name else '', \
-                                     subtype=subtype if subtype else '', \
-                                     ana=ana if ana else '')
-        with open(path, 'r') as fr: 
-            fulltext = fr.read()
-            url_split = re.split(r'<begin-of-url>([\w\W]*?)<end-of-url>', fulltext)
-            for page in url_split: 
-                if page.strip() != '': 
-                    page_data = page.split('<separate-parts>')
-                    url = page_data[0].strip()
-                    title = page_data[1].strip()
-                    date = page_data[2].strip()
-                    author = page_data[3].strip()
-                    text = page_data[4].strip()
-                    self._add_text_element(group_elem, url, title, date, author, text)
-
-    def write_to_file(self, path): 
-        tree = ET.ElementTree(self.root)
-        ET.indent(tree, space="    ", level=0)  # Optional: to pretty print the XML with indentation
-        tree.write(path, encoding="utf-8", xml_declaration=True)
-        
+        """
+        Adds a scraped_pages_* file (.txt or .jsonl) as group - the file is read when writing
+        """
+        self.groups.append((path, group_name if group_name else '', subtype if subtype else '', ana if ana else ''))
+
+    def write_to_file(self, path, processes=1): 
+        """
+        Args: 
+        processes: If > 1, groups are written to temporary files by several processes in parallel and then concatenated
+        """
+        with open(path, 'wb') as fw: 
+            fw.write(b"<?xml version='1.0' encoding='utf-8'?>\n<TEIcorpus>")
+            # Each child of the root is preceded by the indentation of level 1
+            tei_elem = ET.Element("TEI", type="website")
+            fw.write(self._serialize('\n' + self.indent_space + ET.tostring(tei_elem, encoding='unicode')))
+            if processes > 1 and len(self.groups) > 1: 
+                self._write_groups_parallel(fw, os.path.dirname(os.path.abspath(path)), processes)
+            else: 
+                for group in self.groups: 
+                    self._write_group(fw, *group)
+            fw.write(b'\n</TEIcorpus>')
+
+    def _write_groups_parallel(self, fw, temp_dir, processes): 
+        temp_paths = []
+        try: 
+            with ProcessPoolExecutor(processes) as executor: 
+                jobs = []
+                for group in self.groups: 
+                    with tempfile.NamedTemporaryFile(dir=temp_dir, suffix='.xml.part', delete=False) as temp_file: 
+                        temp_paths.append(temp_file.name)
+                    jobs.append(executor.submit(_write_group_to_file, temp_file.name, group))
+                # Groups are concatenated in the order they were added
+                for job, temp_path in zip(jobs, temp_paths): 
+                    job.result()
+                    with open(temp_path, 'rb') as fr: 
+                        shutil.copyfileobj(fr, fw)
+        finally: 
+            for temp_path in temp_paths: 
+                if os.path.exists(temp_path): 
+                    os.remove(temp_path)
+
+    def _write_group(self, fw, path, group_name, subtype, ana): 
+        group_elem = self._create_group(group_name, subtype, ana)
+        # Short form '<group ... />' while the group is empty
+        empty_group = ET.tostring(group_elem, encoding='unicode')
+        group_started = False
+        for page in iter_scraped_pages(path): 
+            if not group_started: 
+                fw.write(self._serialize('\n' + self.indent_space + empty_group[:-len(' />')] + '>'))
+                group_started = True
+            text_elem = self._create_text_element(page['url'] or '', page['title'] or '', page['date'], page['author'], page['text'] or '')
+            ET.indent(text_elem, space=self.indent_space, level=2)
+            fw.write(self._serialize('\n' + 2*self.indent_space + ET.tostring(text_elem, encoding='unicode')))
+        if group_started: 
+            fw.write(self._serialize('\n' + self.indent_space + '</group>'))
+        else: 
+            fw.write(self._serialize('\n' + self.indent_space + empty_group))
+
+    def _serialize(self, text): 
+        # Same encoding as ElementTree.write with encoding="utf-8"
+        return text.encode('utf-8', errors='xmlcharrefreplace')
+
+
+def _write_group_to_file(temp_path, group): 
+    """
+    Writes a single group to temp_path, run in a separate process
+    """
+    with open(temp_path, 'wb') as fw: 
+        XMLWriter()._write_group(fw, *group)
@@ -1,30 +1,15 @@
 import pandas as pd
-import re
 import datetime
 from remove_doublons import MinHashFilter
+from scraped_output import iter_scraped_pages
 
 #filepath = '/home/hoepfl/hiwijob/Laura/crawler/cmpl/serviam_alvarium/scraped_pages_web_archive_org_web_20230321152834_serviam_alvarium_fr.txt'
 filepath = '/home/hoepfl/hiwijob/Laura/crawler/cmpl/arts_enracines/scraped_pages_arts_enracines_fr.txt'
 date_format = ''
 
 
-with open(filepath, 'r') as fr: 
-    indiv_pages = re.findall('<begin-of-url>([\s\S]*?)<end-of-url>', fr.read())
-
-url = []
-title = []
-date = []
-author = []
-text = []
-for i in indiv_pages: 
-    parts = i.split('<separate-parts>\n')
-    url.append(parts[0].strip() if parts[0].strip() else None)
-    title.append(parts[1].strip() if parts[1].strip() else None)
-    date.append(parts[2].strip() if parts[2].strip() else None)
-    author.append(parts[3].strip() if parts[3].strip() else None)
-    text.append(parts[4].strip() if parts[4].strip() else None)
-
-df = pd.DataFrame({'url': url, 'title': title, 'date': date, 'author': author, 'text': text})
+# Works with .txt and .jsonl output, read page by page
+df = pd.DataFrame(iter_scraped_pages(filepath), columns=['url', 'title', 'date', 'author', 'text'])
 
 #Modify date
 df['date'] = pd.to_datetime(df['date'], format='mixed', utc=True)
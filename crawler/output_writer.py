@@ -0,0 +1,135 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+
+FSYNC_POLICIES = ('never', 'checkpoint', 'batch')
+
+
+class BackgroundWriter:
+    """
+    Appends data to the output files in a separate thread, so that slow disks (e.g. NFS) never stall the crawl.
+
+    Writes are handed over through a bounded queue (the crawl only waits if the queue is full) and collected
+    in the buffers of the open files, which are flushed once *flush_bytes* are pending or after *flush_interval* seconds.
+    *fsync* decides when data is forced onto the disk: 'never', at each call of drain ('checkpoint') or after each flush ('batch').
+    """
+    def __init__(self, max_queue_size=1000, flush_interval=1.0, flush_bytes=4*1024*1024, fsync='checkpoint') -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync}', use one of {list(FSYNC_POLICIES)}")
+        self.tasks = queue.Queue(maxsize=max(1, max_queue_size))
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync = fsync
+        # Only used by the writer thread: path -> file opened for appending
+        self.files = {}
+        self.error = None
+        self.closed = False
+
+        # Counters, e.g. for monitoring
+        self.bytes_written = 0
+        self.records_written = 0
+        self.max_queue_depth = 0
+
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        return self.tasks.qsize()
+
+    def get_stats(self):
+        return {'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'bytes_written': self.bytes_written,
+                'records_written': self.records_written}
+
+    def append(self, path, data:bytes):
+        """
+        Appends data to the file at path - returns immediately unless the queue is full
+        """
+        self._raise_error()
+        self.tasks.put(('append', path, data))
+        self.max_queue_depth = max(self.max_queue_depth, self.tasks.qsize())
+
+    def drain(self):
+        """
+        Waits until everything appended so far is written to the files (and, depending on *fsync*, to the disk)
+        """
+        self._raise_error()
+        done = threading.Event()
+        self.tasks.put(('drain', done))
+        done.wait()
+        self._raise_error()
+
+    def close(self):
+        """
+        Writes everything still in the queue and closes all files
+        """
+        if self.closed:
+            return
+        self.closed = True
+        done = threading.Event()
+        self.tasks.put(('stop', done))
+        done.wait()
+        self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise OSError(f"Writing the output failed: {self.error}") from self.error
+
+    def _work(self):
+        pending_bytes = 0
+        last_flush = time.monotonic()
+        while True:
+            # Waits for new data, but at most until the next flush is due
+            timeout = max(0, self.flush_interval - (time.monotonic() - last_flush)) if pending_bytes else None
+            try:
+                task = self.tasks.get(timeout=timeout)
+            except queue.Empty:
+                task = None
+
+            try:
+                if task is not None and task[0] == 'append':
+                    if self.error is None:
+                        _, path, data = task
+                        f = self.files.get(path)
+                        if f is None:
+                            f = self.files[path] = open(path, 'ab')
+                        f.write(data)
+                        pending_bytes += len(data)
+                        self.bytes_written += len(data)
+                        self.records_written += 1
+                    flush = pending_bytes >= self.flush_bytes
+                else:
+                    flush = True
+                if flush and self.error is None:
+                    is_checkpoint = task is not None and task[0] in ('drain', 'stop')
+                    self._flush(fsync=self.fsync == 'batch' or (is_checkpoint and self.fsync == 'checkpoint'))
+                    pending_bytes = 0
+                    last_flush = time.monotonic()
+            except OSError as e:
+                logging.error(f"Writing the output failed: {e}\n")
+                print(f"ERROR: Writing the output failed: {e}")
+                self.error = e
+
+            if task is not None and task[0] in ('drain', 'stop'):
+                if task[0] == 'stop':
+                    for f in self.files.values():
+                        try:
+                            f.close()
+                        except OSError:
+                            pass
+                    self.files = {}
+                task[1].set()
+                if task[0] == 'stop':
+                    return
+
+    def _flush(self, fsync):
+        for f in self.files.values():
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
@@ -0,0 +1,351 @@
+from bs4 import BeautifulSoup, Tag
+import re
+import dom_pruning
+import tree_to_markdown
+import html2text
+import json
+import time
+
+
+METADATA_FIELDS = ('title', 'date', 'author')
+
+
+def find_in_json_rec(d, target_key): 
+    """
+    Returns the first value of target_key found in nested dicts/lists, None if there is none
+    """
+    if isinstance(d, dict):
+        for key, value in d.items():
+            if key == target_key:
+                return value
+            elif isinstance(value, dict):
+                result = find_in_json_rec(value, target_key)
+                if result:
+                    return result
+            elif isinstance(value, list):
+                for item in value:
+                    result = find_in_json_rec(item, target_key)
+                    if result:
+                        return result
+    return None
+
+
+class PageExtractor: 
+    """
+    Extracts hrefs, metadata and text from a loaded page. 
+    Only depends on the settings, so it can run in the crawler process or in a separate extraction process 
+    (see init_worker and extract_in_worker). 
+    """
+    def __init__(self, settings) -> None:
+        self.settings = settings
+
+        date_pattern_str = r'(?i)\d{1,4}\D{1,3}(\d{1,2}|janvier|février|fevrier|mars|avril|mai|juin|juillet|aout|août|septembre|octobre|novembre|décembre|decembre)\D{1,3}\d{1,4}'
+        self.date_pattern = re.compile(date_pattern_str)
+
+        volume_string = r'\b(?:[Vv]ol(?:ume)?|[Nn]um(?:éro)?|[Nn]o?|[ÉéEe]d(?:ition)?|Issue|Iss|Livraison|Livr)[\Wº°]{1,3}([IVXLC]+|\d+)'
+        self.volume_pattern = re.compile(volume_string) # group 1 returns the number either in arabic or roman numerals
+
+        # Metadata rules, compiled once: field -> (tag, attrib, name, json_pattern)
+        # Fields which can never match (neither tag nor json_pattern) are left out
+        self.metadata_rules = {}
+        for field in METADATA_FIELDS:
+            field_settings = settings['metadata'][field]
+            json_pattern = field_settings.get('json_pattern')
+            if json_pattern or field_settings['tag']:
+                self.metadata_rules[field] = (field_settings['tag'], field_settings['attrib'], field_settings['name'], json_pattern)
+
+
+    def extract(self, content): 
+        """
+        Parses a page and runs link, metadata and text extraction on it
+        Args: 
+        content: The page as received - bytes (encoding detected while parsing) or string
+        Returns: 
+        dict with all hrefs of the page, metadata, text and percentage, 
+        and the duration (in s) of each step under 'timings' (see crawl_stats)
+        """
+        timings = {}
+        start_time = time.perf_counter()
+        soup = BeautifulSoup(content, 'lxml')
+        hrefs = [raw_link.get('href') for raw_link in soup.find_all('a', href=True)]
+        parsed_time = time.perf_counter()
+        timings['parse'] = parsed_time - start_time
+        # Extracting metadata
+        title, date, date_fallback_flag, author, volume = self.extract_metadata(soup)
+        metadata_time = time.perf_counter()
+        timings['metadata'] = metadata_time - parsed_time
+        # Extracting text
+        complete_text, text, percentage = self.extract_text(soup, timings) # Modifies soup! 
+        # Everything in extract_text apart from html2text is spent pruning the tree
+        timings['prune'] = time.perf_counter() - metadata_time - timings['html2text']
+        return {'hrefs': hrefs, 
+                'title': title, 
+                'date': date, 
+                'date_fallback_flag': date_fallback_flag, 
+                'author': author, 
+                'volume': volume, 
+                'text': text, 
+                'percentage': percentage, 
+                'timings': timings}
+
+
+    def extract_text(self, soup, timings=None): 
+        """
+        Args: 
+        timings: dict to which the time spent in html2text is added (key 'html2text'), if given
+        """
+        if timings is not None: 
+            timings.setdefault('html2text', 0.0)
+         
+        def get_check_pattern_func(valid_patterns:list): 
+            """
+            Returns a filter function, which matches it's tag input to the valid patterns
+            Args: 
+            pattern: A list of dicts, with a single tag configuration (tag, attrib, name) per dict.  
+                All 2 keys have to be presents, values may be empty strings
+            """
+            def check_pattern_func(tag): 
+                """
+                Filter function, checks if input matches valid patterns. 
+                """
+                if tag is not None: 
+                    for pattern in valid_patterns: 
+                        if pattern['tag'] and not pattern['attrib']: # Only tag specified
+                            if tag.name == pattern['tag']: 
+                                return True
+                        elif pattern['tag'] and pattern['attrib']: # Tag and attrib and name specified
+                            assert pattern['name'], "If an 'attrib' is used as selector, please also add a value for 'name'!"
+                            name_values_for_attrib = tag.get(pattern['attrib'], '')
+                            name_values_for_attrib = name_values_for_attrib if isinstance(name_values_for_attrib, list) else name_values_for_attrib.split()
+                            if tag.name == pattern['tag']: 
+                                all_names_match = True
+                                for name in pattern['name'].split():
+                                    if name not in name_values_for_attrib: 
+                                        all_names_match = False
+                                if all_names_match:
+                                    return True
+                        else: # Only attrib and name specified
+                            assert pattern['name'], "If an 'attrib' is used as selector, please also add a value for 'name'!"
+                            name_values_for_attrib = tag.get(pattern['attrib'], '')
+                            name_values_for_attrib = name_values_for_attrib if isinstance(name_values_for_attrib, list) else name_values_for_attrib.split()
+                            all_names_match = True
+                            for name in pattern['name'].split():
+                                if name not in name_values_for_attrib: 
+                                    all_names_match = False
+                            if all_names_match:
+                                return True
+                return False
+            
+            return check_pattern_func
+        
+        # Remove invisible elements
+        if soup.find(lambda tag: tag.has_attr('data-visible')): # If playwright was used
+            pass
+            # Deletes all non-visible elements as long as they are tags (pure strings directly in the html are ignored)
+            match_func = lambda tag: (not tag.has_attr('data-visible') or tag['data-visible'] != 'true') if isinstance(tag, Tag) else True
+            #dom_pruning.prune_tree(soup, match_func, del_matches=True)
+        else: 
+            match_func = lambda tag: ('display: none' or 'visibility: hidden' or 'opacity: 0' or 'font-size:0px') in tag.get('style', '').lower()
+            dom_pruning.prune_tree(soup, match_func, del_matches=True)
+
+        # Remove all links without text and all images
+        match_func = lambda tag: tag.name == 'img' or (tag.name == 'a' and tag.get_text(strip=True) == '')
+        dom_pruning.prune_tree(soup, match_func, del_matches=True)
+
+        html2text_start = time.perf_counter()
+        complete_text = self.html_to_text(soup)
+        if timings is not None: 
+            timings['html2text'] += time.perf_counter() - html2text_start
+
+        extraction_settings = self.settings['text_extraction']
+        patterns_include = extraction_settings['specific_tags_include']
+        patterns_exclude = extraction_settings['specific_tags_exclude']
+
+        include_tags_specified = False
+        exclude_tags_specified = False
+        for el in patterns_include: 
+            if el['tag'] or el['attrib'] or el['name']: 
+                include_tags_specified = True
+                break
+        for el in patterns_exclude: 
+            if el['tag'] or el['attrib'] or el['name']: 
+                exclude_tags_specified = True
+                break
+        tree_pruned = False
+        # Extract text by tags if settings contain specified tags
+        if include_tags_specified: 
+            include_match_func = get_check_pattern_func(patterns_include)
+            dom_pruning.prune_tree(soup, include_match_func)
+            tree_pruned = True
+        if exclude_tags_specified: 
+            exclude_match_func = get_check_pattern_func(patterns_exclude)
+            dom_pruning.prune_tree(soup, exclude_match_func, del_matches=True)
+            tree_pruned = True
+        # Extract text by <p> (html paragraphs)
+        if extraction_settings['only_paragraphs']:
+            include_match_func = get_check_pattern_func([{'tag': 'p', 'attrib': '', 'name': ''}])
+            dom_pruning.prune_tree(soup, include_match_func)
+            tree_pruned = True
+        # Extract text by paragraphs and headers
+        elif extraction_settings['only_paragraphs_and_headers']:
+            include_match_func = get_check_pattern_func([{'tag': 'p', 'attrib': '', 'name': ''}, \
+                                                {'tag': 'h1', 'attrib': '', 'name': ''}, \
+                                                {'tag': 'h2', 'attrib': '', 'name': ''}, \
+                                                {'tag': 'h3', 'attrib': '', 'name': ''}, \
+                                                {'tag': 'h4', 'attrib': '', 'name': ''}, \
+                                                {'tag': 'h5', 'attrib': '', 'name': ''}, \
+                                                {'tag': 'h6', 'attrib': '', 'name': ''}])
+            dom_pruning.prune_tree(soup, include_match_func)
+            tree_pruned = True
+        if tree_pruned: 
+            html2text_start = time.perf_counter()
+            text = self.html_to_text(soup)
+            if timings is not None: 
+                timings['html2text'] += time.perf_counter() - html2text_start
+        else: # Fallback option: Extract all text
+            text = complete_text
+        percentage = round((len(text) / len(complete_text) if len(complete_text) > 0 else 1)*100)
+
+        return complete_text, text, percentage
+
+
+    def extract_metadata(self, soup):
+        """
+        Finds title, date and author in a single walk over the tree, following the rules compiled in __init__. 
+        Per field, the first matching tag in document order is used; JSON scripts are parsed at most once per page. 
+        """
+        metadata = {field: None for field in METADATA_FIELDS}
+        pending = dict(self.metadata_rules)
+        json_cache = {} # id of script tag -> parsed JSON
+        if pending:
+            for tag in soup.descendants:
+                if not isinstance(tag, Tag):
+                    continue
+                for field, (tag_name, attrib, name, json_pattern) in list(pending.items()):
+                    # Fields with a json_pattern but without tag (None) accept any tag, as find_all(None) did - 
+                    # an empty tag name ('') matches no tag, as find_all('') did
+                    if tag_name is not None and tag.name != tag_name:
+                        continue
+                    if attrib and name:
+                        if not (tag.has_attr(attrib) and name in tag.get(attrib, [])):
+                            continue
+                        value = None if json_pattern else (tag.get('content', '') or tag.get_text() or tag.get('value', ''))
+                    elif attrib and not json_pattern:
+                        value = tag.get(attrib)
+                    else:
+                        value = None if json_pattern else tag.get_text(separator=' ')
+
+                    # Extraction from yoast seo / JSON-LD script
+                    if json_pattern:
+                        if id(tag) not in json_cache:
+                            json_text = tag.get_text()
+                            json_cache[id(tag)] = json.loads(json_text) if json_text else None
+                        if json_cache[id(tag)] is not None:
+                            value = find_in_json_rec(json_cache[id(tag)], json_pattern)
+                    metadata[field] = value
+                    del pending[field]
+                if not pending:
+                    break
+
+        title, date, author = metadata['title'], metadata['date'], metadata['author']
+        date_settings = self.settings['metadata']['date']
+        volume_settings = self.settings['metadata']['volume']
+
+        # Date: Fallback method - extract first date-like string from the beginning of the website text
+        date_fallback = False
+        if not date:
+            if date_settings['use_fallback_method']:
+                date_match = re.search(self.date_pattern, self.get_text_window(soup, date_settings['fallback_window']))
+                if date_match:
+                    date = date_match.group()
+                    date_fallback = True # Flag used in output
+
+        # Automatical extraction of volume numbers from title
+        volume = None
+        if volume_settings['extract_volume'] and title is not None:
+            vol_match = re.search(self.volume_pattern, title)
+            if vol_match:
+                volume = vol_match.group(1)
+
+        return title, date, date_fallback, author, volume
+
+
+    def get_text_window(self, soup, max_chars):
+        """
+        Returns the beginning of soup.get_text(), collecting strings only until *max_chars* characters are reached 
+        (the whole text if max_chars is empty or 0)
+        """
+        if not max_chars:
+            return soup.get_text()
+        strings = []
+        length = 0
+        for string in soup.strings: # Same strings as get_text()
+            strings.append(string)
+            length += len(string)
+            if length >= max_chars:
+                break
+        return ''.join(strings)[:max_chars]
+
+
+    def html_to_text(self, soup): 
+        """
+        Converts the soup to plain text using html2text. 
+        Creates a new html2text object each time to reduce the impact of a html2text bug, 
+        where part of the content is accumulated at the end of the Markdown text. 
+        *markdownify* would be an alternative, but html2text output is more similar to the website formatting
+        """
+        def text_cleanup(text):
+            """
+            Can be used to clean the Markdown output of html2text. 
+            """
+            # Cleanup spaces
+            text = re.sub(r'---LINE_BREAK_PLACEHOLDER---', '\n', text)
+            text = re.sub(r'[\u200B-\u200D\uFEFF]', ' ', text)# Remove zero-width-spaces
+            text = re.sub(r'^\s+\n', '', text) # Remove spaces at start of text
+            #text = re.sub(r'[^\S\r\n]*\n[^\S\r\n]*',  '\n', text) # Summarize leading spaces + linebreak + trailing spaces as single linebreak
+            text = re.sub(r'\s+\Z', '', text) # Remove trailing whitespaces - leading whitespaces already removed by summarizing
+            text = re.sub(r'\n\s*\n', '\n\n', text) # Combine multi-linebreaks into one
+
+            # Cleanup markdown
+            # To reformat / clean up links: (?<![!\\\s*_])\[\s*(.*?)\s*\]
+
+            #text = re.sub(r'^[^\S\r\n]*\\?-\s*', '- ', text, flags=re.MULTILINE) # Escapte Aufzählungsstriche zu normalen 
+            #text = re.sub(r'\\\.', '.', text) # Escapte Punkte zu normalen Punkten
+            #text = re.sub(r'^>\s*', r'', text, flags=re.MULTILINE) # Einschub mit > entfernen
+            #text = re.sub(r'^([^\S\r\n]*\*[^\S\r\n]*){2,}', r'* ', text, flags=re.MULTILINE) # Mehrere Sterne zu einem 
+            #text = re.sub(r'^([^\S\r\n]*\*[^\S\r\n]*)+\n', r'\n', text, flags=re.MULTILINE) # Verirrte Sterne löschen
+            
+            return text
+        
+        h = html2text.HTML2Text()
+        h.ignore_links = False
+        h.ignore_images = True
+        h.single_line_break = False
+        h.asterisk_emphasis = True
+        h.body_width = 0
+        h.unicode_snob = True
+        h.ignore_tables = True
+        h.escape_snob = True
+        h.dash_unordered_list = True
+        h.protect_links = True
+        # The tree is passed to html2text directly instead of serializing and parsing it again
+        return text_cleanup(tree_to_markdown.tree_to_markdown(h, soup))
+
+
+# Extractor of an extraction process, created once per process by init_worker
+_worker_extractor = None
+
+
+def init_worker(settings): 
+    """
+    Initializer of the extraction processes
+    """
+    global _worker_extractor
+    _worker_extractor = PageExtractor(settings)
+
+
+def extract_in_worker(content): 
+    """
+    Runs PageExtractor.extract in an extraction process
+    """
+    return _worker_extractor.extract(content)
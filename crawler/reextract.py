@@ -0,0 +1,114 @@
+import argparse
+import collections
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent import futures
+
+import frontier
+import handle_output
+import handle_settings
+import html_archive
+import page_extraction
+from run_crawler import start_logging, stop_logging
+
+
+def get_starting_url(folder):
+    """
+    Returns the starting page of the crawl saved in folder, None if it is unknown
+    """
+    if not frontier.CrawlStateStore.exists(folder):
+        return None
+    state_store = frontier.CrawlStateStore(folder)
+    starting_url = state_store.get_info('starting_url')
+    state_store.close()
+    return starting_url
+
+
+def reextract(folder, output_dir, settings, processes):
+    """
+    Extracts metadata and text of all pages saved in the html archive of folder again, with settings,
+    and writes them (after quality filters and duplicate filter, in the order of the crawl) to a new text output in output_dir.
+    Parsing and extraction run in *processes* separate processes, without any network access.
+    Returns:
+    Number of pages read, number of pages written
+    """
+    pages = html_archive.iter_saved_pages(folder)
+    first_page = next(pages, None)
+    if first_page is None:
+        print(f'No pages saved in {folder}')
+        return 0, 0
+    starting_url = get_starting_url(folder) or first_page[0]
+    output_handler = handle_output.TerminalOutput(settings['output'], folder=output_dir, filename=handle_output.get_output_filename(starting_url))
+    # Only set by record_output, which prints the progress of a crawl - here the progress is printed below
+    output_handler.do_print = False
+
+    def iter_all_pages():
+        yield first_page
+        yield from pages
+
+    # 'spawn' as in Crawler.scrape
+    extraction_pool = futures.ProcessPoolExecutor(processes,
+                                                  mp_context=multiprocessing.get_context('spawn'),
+                                                  initializer=page_extraction.init_worker,
+                                                  initargs=(settings,))
+    # Futures in the order of the pages, at most max_pending at a time, so that memory stays constant for archives of any size
+    pending = collections.deque()
+    max_pending = 4*processes
+    read_count = 0
+    written_count = 0
+    start_time = time.time()
+    try:
+        def write_next():
+            url, future = pending.popleft()
+            page_data = future.result()
+            return output_handler.write_output(url, page_data['text'], page_data['title'], page_data['date'],
+                                               page_data['author'], page_data['volume'], page_data['percentage'])
+
+        for url, content in iter_all_pages():
+            pending.append((url, extraction_pool.submit(page_extraction.extract_in_worker, content)))
+            read_count += 1
+            if len(pending) >= max_pending:
+                written_count += write_next()
+            if read_count % 1000 == 0:
+                print(f'{read_count} pages extracted, {written_count} written ({read_count/(time.time() - start_time):.0f} pages/s)')
+        while pending:
+            written_count += write_next()
+        output_handler.finish()
+    finally:
+        extraction_pool.shutdown(cancel_futures=True)
+        output_handler.close()
+    logging.info(f"Re-extracted {read_count} pages of {folder}, {written_count} written to {output_handler.output_file_path}\n")
+    return read_count, written_count
+
+
+# Guard needed for the extraction processes, which import this module when starting
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extracts the pages saved by an earlier crawl again with new settings (text_extraction, metadata, '
+                                                 'output filters), from the html archive in its output directory - no page is loaded again.')
+    parser.add_argument('folder', help='Output directory of the crawl, containing the html archive (or all_pages_html.txt)')
+    parser.add_argument('--settings', default=None, help='Settings file to use (default: settings.yaml of the output directory)')
+    parser.add_argument('--output', default=None, help='Directory for the new text output (default: reextracted in the output directory)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Number of extraction processes (default: number of cores)')
+    args = parser.parse_args()
+
+    output_dir = args.output or os.path.join(args.folder, 'reextracted')
+    if os.path.exists(output_dir) and any(name.startswith('scraped_pages_') for name in os.listdir(output_dir)):
+        parser.error(f'{output_dir} already contains a text output, please choose another directory with --output')
+    os.makedirs(output_dir, exist_ok=True)
+    # The settings are kept with the new output, to know how it was extracted
+    shutil.copyfile(args.settings or os.path.join(args.folder, 'settings.yaml'), os.path.join(output_dir, 'settings.yaml'))
+    settings = handle_settings.read_settings_file(output_dir)
+    settings['dir'] = output_dir
+    # A shared duplicate index already holds the pages of the original crawl, all of which would be rejected as duplicates
+    settings['output']['file']['doublons']['index_path'] = None
+
+    log_listener = start_logging(output_dir)
+    try:
+        start_time = time.time()
+        read_count, written_count = reextract(args.folder, output_dir, settings, max(1, args.processes))
+        print(f'{read_count} pages extracted in {time.time() - start_time:.0f} s, {written_count} written to {output_dir}')
+    finally:
+        stop_logging(log_listener)
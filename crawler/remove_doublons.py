@@ -1,10 +1,106 @@
 from datasketch import MinHash, MinHashLSH
 import logging
+import sqlite3
+
+
+class PersistentLSH: 
+    """
+    LSH index of MinHashes saved in a SQLite database, with the same bands as MinHashLSH (and thus the same results). 
+    Can be shared by several crawler processes (and reused by later runs): check and insert happen in one transaction. 
+
+    Texts are identified by key (url) and run (e.g. output directory) - a text saved again under the same key 
+    in the same run (a page loaded again after resuming) is not considered as duplicate of itself. 
+    """
+    def __init__(self, path, threshold, num_perm, run_id='') -> None:
+        self.run_id = run_id
+        # Number and size of the bands, as chosen by MinHashLSH
+        self.hashranges = MinHashLSH(threshold=threshold, num_perm=num_perm).hashranges
+        # Waits up to a minute if another process is writing
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        # Index pages are read from a memory map instead of copied into the cache of each process
+        self.connection.execute('PRAGMA mmap_size=1073741824')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS lsh_bands (band INTEGER NOT NULL, hash BLOB NOT NULL, key TEXT NOT NULL, run TEXT NOT NULL, '
+                                'UNIQUE (band, hash, key, run))')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS lsh_info (key TEXT PRIMARY KEY, value)')
+        self._check_parameters({'threshold': threshold, 'num_perm': num_perm, 
+                                'scheme': getattr(MinHash(num_perm=num_perm), 'scheme', 'legacy')})
+
+    def _check_parameters(self, parameters): 
+        """
+        Saves the parameters of a new index, or checks that they match those of an existing one
+        """
+        self.connection.execute('BEGIN IMMEDIATE')
+        try: 
+            for key, value in parameters.items(): 
+                row = self.connection.execute('SELECT value FROM lsh_info WHERE key = ?', (key,)).fetchone()
+                if row is None: 
+                    self.connection.execute('INSERT INTO lsh_info (key, value) VALUES (?, ?)', (key, value))
+                elif row[0] != value: 
+                    raise ValueError(f"The duplicate index was created with {key} = {row[0]}, can not be used with {key} = {value}")
+            self.connection.execute('COMMIT')
+        except: 
+            self.connection.execute('ROLLBACK')
+            raise
+
+    def _get_band_hashes(self, minhash): 
+        # Same band hashes as MinHashLSH
+        return [(band, bytes(minhash.hashvalues[start:end].byteswap().data)) for band, (start, end) in enumerate(self.hashranges)]
+
+    def query(self, minhash, key=None): 
+        """
+        Returns the keys of all texts with at least one identical band
+        Args: 
+        key: Key of the queried text, not returned for texts saved under this key in the same run
+        """
+        candidates = set()
+        for band, band_hash in self._get_band_hashes(minhash): 
+            for candidate_key, run in self.connection.execute('SELECT key, run FROM lsh_bands WHERE band = ? AND hash = ?', (band, band_hash)): 
+                if candidate_key != key or run != self.run_id: 
+                    candidates.add(candidate_key)
+        return list(candidates)
+
+    def insert(self, key, minhash): 
+        self.connection.executemany('INSERT OR IGNORE INTO lsh_bands (band, hash, key, run) VALUES (?, ?, ?, ?)', 
+                                    ((band, band_hash, key, self.run_id) for band, band_hash in self._get_band_hashes(minhash)))
+
+    def query_and_insert(self, key, minhash): 
+        """
+        Inserts minhash if no similar text is found - without another process inserting in between
+        Returns: 
+        Keys of the similar texts (empty if minhash was inserted)
+        """
+        self.connection.execute('BEGIN IMMEDIATE')
+        try: 
+            result = self.query(minhash, key)
+            if not result: 
+                self.insert(key, minhash)
+            self.connection.execute('COMMIT')
+        except: 
+            self.connection.execute('ROLLBACK')
+            raise
+        return result
+
+    def close(self): 
+        self.connection.close()
+
 
 class MinHashFilter: 
-    def __init__(self, threshold = 0.8) -> None:
+    def __init__(self, threshold = 0.8, num_perm=128, index_path=None, run_id='') -> None:
+        """
+        Args: 
+        index_path: If given, the LSH index is saved in this SQLite file - shared with earlier runs and other crawler processes. 
+            If None, the index is only kept in memory. 
+        run_id: Identifies the current run in a shared index (e.g. the output directory)
+        """
         # Create an LSH index
-        self.lsh = MinHashLSH(threshold=threshold, num_perm=128)
+        if index_path: 
+            self.lsh = PersistentLSH(index_path, threshold, num_perm, run_id)
+        else: 
+            self.lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        # Permutations are the same for every MinHash (fixed seed) - generated once and copied for each text, as in MinHash.bulk
+        self.empty_minhash = MinHash(num_perm=num_perm)
 
     def add_article(self, article_text:str, url:str):
         """
@@ -19,7 +115,34 @@ class MinHashFilter:
         Returns True if article_text is not similar to any other reference text
         """
         m = self._get_minhash(article_text)
-        result = self.lsh.query(m)
+        return self._check_minhash(m, verbose)
+
+    def check_and_add(self, article_text:str, url:str, verbose:bool = True):
+        """
+        Same as check_new_article followed by add_article if the article is new, but hashes the text only once. 
+        Returns True if article_text is not similar to any other reference text (and was added)
+        """
+        m = self._get_minhash(article_text)
+        if isinstance(self.lsh, PersistentLSH): 
+            # Check and insert in one transaction, so that no other crawler process adds a similar text in between
+            result = self.lsh.query_and_insert(url, m)
+            return self._report_duplicates(result, verbose)
+        if not self._check_minhash(m, verbose): 
+            return False
+        self.lsh.insert(url, m)
+        return True
+
+    def close(self): 
+        if isinstance(self.lsh, PersistentLSH): 
+            self.lsh.close()
+
+    def _check_minhash(self, m, verbose):
+        return self._report_duplicates(self.lsh.query(m), verbose)
+
+    def _report_duplicates(self, result, verbose): 
+        """
+        Returns True if result (similar texts in the index) is empty
+        """
         if result: 
             if verbose: 
                 print('Found duplicate, discarding...')
@@ -27,22 +150,18 @@ class MinHashFilter:
             return False
         return True
 
-    def _get_minhash(self, text, num_perm=128):
+    def _get_minhash(self, text):
         # Tokenize text by splitting on whitespace or any preferred tokenizer
         tokens = [token.lower() for token in text.split() if len(token) > 1]
         
-        # Creating shingles/ngrams
-        n = 3
-        shingles = set()
-        for i in range(len(tokens) - n + 1):
-            shingle = ' '.join(tokens[i:i + n])  # Form a shingle of k words
-            shingles.add(shingle)
+        # Creating shingles/ngrams of 3 words
+        shingles = set(map(' '.join, zip(tokens, tokens[1:], tokens[2:])))
 
         # Create MinHash object with a number of permutations (hash functions)
-        m = MinHash(num_perm=num_perm)
+        m = self.empty_minhash.copy()
         
-        # Update the MinHash object with each token
-        for s in shingles:
-            m.update(s.encode('utf8'))
+        # Update the MinHash object with all shingles at once (vectorized with numpy)
+        if shingles: 
+            m.update_batch([s.encode('utf8') for s in shingles])
         
         return m
\ No newline at end of file
@@ -0,0 +1,158 @@
+import argparse
+import contextlib
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+import traceback
+
+import crawler
+import frontier
+import handle_settings
+import work_queue
+from run_crawler import start_logging, stop_logging
+
+
+def crawl_site(url, output_dir, settings_path, request_slots):
+    """
+    Crawls a single site of the batch into output_dir - resumes the crawl saved there, if any
+    """
+    resume = frontier.CrawlStateStore.has_checkpoint(output_dir)
+    if not resume:
+        # Nothing was saved before the previous attempt stopped - resuming would find an empty queue and mark the site as done
+        frontier.CrawlStateStore.remove(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+        shutil.copyfile(settings_path, os.path.join(output_dir, 'settings.yaml'))
+    settings = handle_settings.read_settings_file(output_dir)
+    settings['dir'] = output_dir
+    # A port can only be used by one of the crawls running in parallel - their stats are in crawl_stats.json
+    settings['output']['stats']['port'] = None
+
+    log_listener = start_logging(output_dir)
+    try:
+        logging.info(f"Batch crawl of {url}{' (resumed)' if resume else ''}\n")
+        # Output of the crawls running in parallel would be mixed up in the terminal - it is only kept in the log files
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            site_crawler = crawler.Crawler(settings, url, resume=resume, request_slots=request_slots)
+            site_crawler.scrape()
+    finally:
+        stop_logging(log_listener)
+
+
+def run_worker(index, queue_path, settings_path, request_slots):
+    """
+    Takes sites from the work queue and crawls them one after the other, until none is left
+    """
+    worker = work_queue.get_worker_name(index)
+    site_queue = work_queue.SiteQueue(queue_path)
+    try:
+        while True:
+            site = site_queue.claim(worker)
+            if site is None:
+                break
+            url, output_dir = site
+            print(f"[{worker}] Crawling {url} -> {output_dir}", flush=True)
+
+            # Heartbeats keep the site assigned to this worker - sent with a separate connection, as sqlite connections are not shared between threads
+            stop_heartbeat = threading.Event()
+            def send_heartbeats():
+                heartbeat_queue = work_queue.SiteQueue(queue_path)
+                try:
+                    while not stop_heartbeat.wait(work_queue.HEARTBEAT_INTERVAL):
+                        heartbeat_queue.heartbeat(url, worker)
+                finally:
+                    heartbeat_queue.close()
+            heartbeat_thread = threading.Thread(target=send_heartbeats, daemon=True)
+            heartbeat_thread.start()
+
+            error = None
+            interrupted = False
+            try:
+                crawl_site(url, output_dir, settings_path, request_slots)
+            except KeyboardInterrupt:
+                error = 'Interrupted'
+                interrupted = True
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+                with open(os.path.join(output_dir, 'batch_error.log'), 'a', encoding='utf-8') as fw:
+                    fw.write(traceback.format_exc() + '\n')
+            finally:
+                stop_heartbeat.set()
+                heartbeat_thread.join()
+            site_queue.finish(url, worker, error)
+            if error:
+                print(f"[{worker}] FAILED {url}: {error}", flush=True)
+            else:
+                print(f"[{worker}] Finished {url}", flush=True)
+            if interrupted:
+                break
+    finally:
+        site_queue.close()
+
+
+def read_seeds(path):
+    """
+    Returns the starting pages listed in path, one per line (empty lines and lines starting with # are skipped)
+    """
+    with open(path, 'r', encoding='utf-8') as fr:
+        return [line.strip() for line in fr if line.strip() and not line.strip().startswith('#')]
+
+
+def print_status(site_queue):
+    counts = site_queue.get_status_counts()
+    print('Sites: ' + ', '.join(f'{counts.get(status, 0)} {status}' for status in ('pending', 'running', 'done', 'failed')))
+    for url, output_dir, status, worker, attempts, error in site_queue.iter_sites():
+        if status in ('running', 'failed'):
+            print(f'  {status}: {url} ({output_dir}, worker {worker}, {attempts} attempts){" - " + error if error else ""}')
+
+
+# Guard needed for the worker and extraction processes, which import this module when starting
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crawls many sites without interaction: the sites are taken from a shared work queue '
+                                                 '(SQLite file) by parallel worker processes - also on several machines, if the file is on a shared drive.')
+    parser.add_argument('queue', help='Work queue file, created if missing')
+    parser.add_argument('--seeds', help='File with the starting pages to add to the queue, one per line')
+    parser.add_argument('--settings', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings_template.yaml'),
+                        help='Settings file used for all new sites (default: settings_template.yaml)')
+    parser.add_argument('--output', default='.', help='Directory in which each site gets its own output directory')
+    parser.add_argument('--processes', type=int, default=4, help='Number of worker processes on this machine (0: only add seeds)')
+    parser.add_argument('--max-requests', type=int, default=None,
+                        help='Requests in flight at most across all worker processes started by this command, i.e. per machine - '
+                             'not shared with other machines using the same queue (default: no limit beyond the settings of each crawl)')
+    parser.add_argument('--retry-failed', action='store_true', help='Crawl failed sites again (resuming their crawl state)')
+    parser.add_argument('--status', action='store_true', help='Only show the state of the queue')
+    args = parser.parse_args()
+
+    site_queue = work_queue.SiteQueue(args.queue)
+    if args.status:
+        print_status(site_queue)
+        site_queue.close()
+        sys.exit(0)
+    if args.seeds:
+        added_count = site_queue.add_sites(read_seeds(args.seeds), args.output)
+        print(f'Added {added_count} sites to the queue')
+    if args.retry_failed:
+        print(f'{site_queue.retry_failed()} failed sites queued again')
+    site_queue.close()
+
+    # 'spawn' as the workers start threads and processes of their own
+    context = multiprocessing.get_context('spawn')
+    request_slots = context.BoundedSemaphore(args.max_requests) if args.max_requests else None
+    workers = [context.Process(target=run_worker, args=(index, os.path.abspath(args.queue), os.path.abspath(args.settings), request_slots))
+               for index in range(max(0, args.processes))]
+    for worker_process in workers:
+        worker_process.start()
+    try:
+        for worker_process in workers:
+            worker_process.join()
+    except KeyboardInterrupt:
+        # The workers are interrupted as well - their sites are marked as failed, to be resumed with --retry-failed
+        print('Interrupted - waiting for the workers to stop')
+        for worker_process in workers:
+            worker_process.join()
+
+    site_queue = work_queue.SiteQueue(args.queue)
+    print_status(site_queue)
+    site_queue.close()
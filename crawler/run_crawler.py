@@ -1,62 +1,89 @@
 import logging
 from logging import FileHandler
-from logging.handlers import MemoryHandler
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
+import queue
 import threading
 import handle_settings
 import crawler
+import frontier
 import os
 import time
-import re
-
-
-    
-dir = handle_settings.request_settings()
-settings = handle_settings.read_settings_file(dir)
-# save dir path in settings
-settings['dir'] = dir
-
-# Init logger
-# Set up file handler
-log_file = os.path.join(dir, 'console_output.log')
-file_handler = FileHandler(log_file, encoding='utf-8')
-# Set up memory handler that buffers 10 log records before writing to the file
-memory_handler = MemoryHandler(capacity=50, flushLevel=logging.ERROR, target=file_handler)
-# Configure logging to use memory handler
-logging.basicConfig(handlers=[memory_handler], level=logging.INFO)
-# Prevent verbose logging from requests
-logging.getLogger("requests").setLevel(logging.WARNING)
-print('\nSettings: ', settings, '\n')
-
-# Init crawler
-starting_page = handle_settings.request_starting_page()
-crawler = crawler.Crawler(settings, starting_page)
-
-# Start thread to update *pages_to_be_ignored*
-def keep_settings_updated(): 
-    while True: 
-        time.sleep(60)
-        actualized_settings = handle_settings.read_settings_file(dir)
-        if actualized_settings['general']['pages_to_be_ignored']: 
-            old_ignored_pages = crawler.ignored_pages
-            new_ignored_pages = re.sub(r'(/|\\)', r'\\\1', '|'.join(actualized_settings['general']['pages_to_be_ignored']))
-            if new_ignored_pages != old_ignored_pages: 
-                crawler.ignored_pages = new_ignored_pages
-                logging.warning(f'Using new settings: Ignoring "{new_ignored_pages}" instead of "{old_ignored_pages}"\n')
-                print(f'Using new settings: Ignoring "{new_ignored_pages}" instead of "{old_ignored_pages}"\n')
-                # Delete all unwanted elements from queue
-                del_count = 0
-                for el in list(crawler.queue): 
-                    if re.search(new_ignored_pages, el): 
-                        crawler.queue.discard(el)
-                        del_count += 1
-                logging.warning(f'Deleted {del_count} elements from queue\n')
-                print(f'Deleted {del_count} elements from queue\n')
-
-reload_thread = threading.Thread(target=keep_settings_updated)
-reload_thread.daemon = True
-reload_thread.start()
-
-# Start crawler
-crawler.scrape()
 
 
+def start_logging(dir): 
+    """
+    Sends all log records to console_output.log in dir
+    Returns: 
+    QueueListener writing the log file, to be stopped at the end of the crawl
+    """
+    # Set up file handler
+    log_file = os.path.join(dir, 'console_output.log')
+    file_handler = FileHandler(log_file, encoding='utf-8')
+    # Set up memory handler that buffers 10 log records before writing to the file
+    memory_handler = MemoryHandler(capacity=50, flushLevel=logging.ERROR, target=file_handler)
+    # Log records are passed to the memory handler by a separate thread, so that writing the log never stalls the crawl
+    log_queue = queue.Queue()
+    log_listener = QueueListener(log_queue, memory_handler)
+    log_listener.start()
+    logging.basicConfig(handlers=[QueueHandler(log_queue)], level=logging.INFO, force=True)
+    # Prevent verbose logging from requests
+    logging.getLogger("requests").setLevel(logging.WARNING)
+    return log_listener
+
+
+def stop_logging(log_listener): 
+    """
+    Writes the remaining log records of start_logging to the log file and closes it
+    """
+    log_listener.stop()
+    for memory_handler in log_listener.handlers: 
+        file_handler = memory_handler.target
+        memory_handler.close() # Flushes to file_handler
+        file_handler.close()
+
+
+# Guard needed for the extraction processes, which import this module when starting
+if __name__ == '__main__': 
+    dir, resume = handle_settings.request_settings()
+    settings = handle_settings.read_settings_file(dir)
+    # save dir path in settings
+    settings['dir'] = dir
+
+    log_listener = start_logging(dir)
+    print('\nSettings: ', settings, '\n')
+
+    # Init crawler
+    if resume: 
+        state_store = frontier.CrawlStateStore(dir)
+        starting_page = state_store.get_info('starting_url')
+        state_store.close()
+    else: 
+        starting_page = handle_settings.request_starting_page()
+    crawler = crawler.Crawler(settings, starting_page, resume=resume)
+
+    # Start thread to update *pages_to_be_ignored*
+    def keep_settings_updated(): 
+        while True: 
+            time.sleep(60)
+            actualized_settings = handle_settings.read_settings_file(dir)
+            if actualized_settings['general']['pages_to_be_ignored']: 
+                old_ignored_pages = crawler.link_filter.ignored_pages
+                crawler.link_filter.set_ignored_pages(actualized_settings['general']['pages_to_be_ignored'])
+                new_ignored_pages = crawler.link_filter.ignored_pages
+                if new_ignored_pages != old_ignored_pages: 
+                    logging.warning(f'Using new settings: Ignoring "{new_ignored_pages}" instead of "{old_ignored_pages}"\n')
+                    print(f'Using new settings: Ignoring "{new_ignored_pages}" instead of "{old_ignored_pages}"\n')
+                    # Delete all unwanted elements from queue
+                    del_count = crawler.queue.remove_matching(crawler.link_filter.is_ignored)
+                    logging.warning(f'Deleted {del_count} elements from queue\n')
+                    print(f'Deleted {del_count} elements from queue\n')
+
+    reload_thread = threading.Thread(target=keep_settings_updated)
+    reload_thread.daemon = True
+    reload_thread.start()
+
+    # Start crawler
+    try: 
+        crawler.scrape()
+    finally: 
+        stop_logging(log_listener)
@@ -0,0 +1,84 @@
+import json
+
+
+FIELDS = ['url', 'title', 'date', 'author', 'volume', 'percentage', 'text']
+BEGIN_MARKER = '<begin-of-url>'
+PART_MARKER = '<separate-parts>'
+END_MARKER = '<end-of-url>'
+
+
+def page_to_json(url, title, date, author, volume, percentage, text):
+    """
+    Returns a page as a single line of JSON (with linebreak), as written to scraped_pages_*.jsonl
+    """
+    page = {'url': url, 'title': title, 'date': date, 'author': author, 'volume': volume, 'percentage': percentage, 'text': text}
+    return json.dumps(page, ensure_ascii=False) + '\n'
+
+
+def iter_scraped_pages(path):
+    """
+    Streams the pages of a scraped_pages_* file one by one, so that files of any size can be read in constant memory.
+    Args:
+    path: .jsonl file, or .txt file with <begin-of-url> / <separate-parts> / <end-of-url> blocks
+    Yields:
+    dict with url, title, date, author, volume, percentage and text of a page (None if missing,
+    volume and percentage are not saved in .txt files)
+    """
+    if path.endswith('.jsonl'):
+        with open(path, 'r', encoding='utf-8') as fr:
+            for line in fr:
+                if line.strip():
+                    page = json.loads(line)
+                    yield {field: page.get(field) for field in FIELDS}
+    else:
+        yield from _iter_txt_pages(path)
+
+
+def _iter_txt_pages(path):
+    # Markers are always written on their own line - text between them is collected line by line
+    parts = None
+    lines = []
+    with open(path, 'r', encoding='utf-8') as fr:
+        for line in fr:
+            marker = line.strip()
+            if marker == BEGIN_MARKER:
+                parts = []
+                lines = []
+            elif parts is None:
+                continue
+            elif marker == PART_MARKER:
+                parts.append(''.join(lines))
+                lines = []
+            elif marker == END_MARKER:
+                parts.append(''.join(lines))
+                parts = [part.strip() or None for part in parts]
+                parts += [None] * (5 - len(parts))
+                url, title, date, author = parts[:4]
+                text = '\n'.join(part for part in parts[4:] if part) or None
+                yield {'url': url, 'title': title, 'date': date, 'author': author, 'volume': None, 'percentage': None, 'text': text}
+                parts = None
+            else:
+                lines.append(line)
+
+
+def jsonl_to_parquet(jsonl_path, parquet_path, batch_size=10000):
+    """
+    Converts a .jsonl output file to Parquet, in batches of *batch_size* pages (needs pyarrow)
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet output needs the package pyarrow: pip install pyarrow")
+
+    schema = pa.schema([('url', pa.string()), ('title', pa.string()), ('date', pa.string()), ('author', pa.string()),
+                        ('volume', pa.string()), ('percentage', pa.int64()), ('text', pa.string())])
+    with pq.ParquetWriter(parquet_path, schema, compression='zstd') as writer:
+        batch = []
+        for page in iter_scraped_pages(jsonl_path):
+            batch.append(page)
+            if len(batch) == batch_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
@@ -0,0 +1,174 @@
+import gzip
+import io
+import logging
+import time
+import xml.etree.ElementTree as ET
+from urllib.robotparser import RobotFileParser
+
+import requests
+import urllib3
+from requests.exceptions import RequestException
+
+
+# Name matched against the User-agent groups of robots.txt - the one requests sends
+ROBOTS_USER_AGENT = requests.utils.default_user_agent()
+# Sitemap indexes may nest and link each other - at most this many sitemaps are read
+MAX_SITEMAPS = 10000
+# robots.txt answering with a server error (or not at all) is loaded again this many times, after ROBOTS_RETRY_WAIT s (doubled each time)
+ROBOTS_ATTEMPTS = 3
+ROBOTS_RETRY_WAIT = 5
+# As for too many requests, a server error of robots.txt does not mean that there are no rules (RFC 9309, 2.3.1.4)
+ROBOTS_SERVER_ERROR_CODES = (429,)
+
+
+class RobotsRules:
+    """
+    Rules of a robots.txt for the crawler: parsed by urllib.robotparser, except Crawl-delay, 
+    which is also read with decimals (robotparser only accepts whole seconds)
+    """
+    def __init__(self, url, lines, user_agent=ROBOTS_USER_AGENT) -> None:
+        self.user_agent = user_agent
+        self.parser = RobotFileParser(url)
+        self.parser.parse(lines)
+        self.sitemaps = self.parser.site_maps() or []
+        self.crawl_delay = self._parse_crawl_delay(lines)
+
+    def can_fetch(self, url):
+        return self.parser.can_fetch(self.user_agent, url)
+
+    def _parse_crawl_delay(self, lines):
+        """
+        Returns the Crawl-delay (in s) of the group for user_agent (as matched by robotparser), else of the group '*'
+        """
+        delays = {} # user agent of group -> delay
+        group_agents = []
+        in_agent_lines = False
+        for line in lines:
+            key, _, value = line.split('#', 1)[0].partition(':')
+            key = key.strip().lower()
+            value = value.strip()
+            if key == 'user-agent':
+                if not in_agent_lines: # Start of a new group
+                    group_agents = []
+                group_agents.append(value.lower())
+                in_agent_lines = True
+            elif key:
+                in_agent_lines = False
+                if key == 'crawl-delay':
+                    try:
+                        delay = float(value)
+                    except ValueError:
+                        continue
+                    for agent in group_agents:
+                        delays.setdefault(agent, delay)
+
+        name = self.user_agent.split('/')[0].lower()
+        for agent, delay in delays.items():
+            if agent != '*' and agent in name:
+                return delay
+        return delays.get('*')
+
+
+def fetch_robots(session, base_url):
+    """
+    Loads and parses the robots.txt of a website, following RFC 9309:
+    a missing robots.txt (4xx) allows all pages, a server error (5xx, 429) or no answer disallows all pages,
+    as the rules are unknown - after ROBOTS_ATTEMPTS attempts.
+    Args:
+    session: requests session used for the crawl
+    base_url: Scheme and host of the website, e.g. 'https://example.com'
+    Returns:
+    RobotsRules, None if the website has no robots.txt (everything allowed)
+    """
+    robots_url = base_url + '/robots.txt'
+    for attempt in range(1, ROBOTS_ATTEMPTS + 1):
+        try:
+            r = session.get(robots_url, timeout=30)
+        except RequestException as e:
+            error = str(e)
+        else:
+            if r.status_code == 200:
+                return RobotsRules(robots_url, r.text.splitlines())
+            if r.status_code < 500 and r.status_code not in ROBOTS_SERVER_ERROR_CODES:
+                logging.info(f"No robots.txt found ({r.status_code}), all pages allowed\n")
+                return None
+            error = f"HTTP {r.status_code}"
+        if attempt < ROBOTS_ATTEMPTS:
+            wait = ROBOTS_RETRY_WAIT * 2**(attempt - 1)
+            logging.warning(f"Could not load {robots_url} ({error}), trying again in {wait} s\n")
+            print(f"WARNING: Could not load {robots_url} ({error}), trying again in {wait} s")
+            time.sleep(wait)
+    logging.warning(f"Could not load {robots_url} ({error}), all pages disallowed - try again later or set robots_txt to False\n")
+    print(f"WARNING: Could not load {robots_url} ({error}), all pages disallowed - try again later or set robots_txt to False")
+    return RobotsRules(robots_url, ['User-agent: *', 'Disallow: /'])
+
+
+def iter_sitemap_urls(session, sitemap_urls):
+    """
+    Streams the pages listed in sitemaps, following sitemap indexes.
+    Sitemaps are parsed while they are downloaded (gzipped or not), so that their size does not matter.
+    Args:
+    session: requests session used for the crawl
+    sitemap_urls: Urls of the sitemaps to start with (e.g. from robots.txt)
+    Yields:
+    url, lastmod (string as in the sitemap, None if missing)
+    """
+    pending = list(sitemap_urls)
+    read_sitemaps = set()
+    while pending and len(read_sitemaps) < MAX_SITEMAPS:
+        sitemap_url = pending.pop(0)
+        if sitemap_url in read_sitemaps:
+            continue
+        read_sitemaps.add(sitemap_url)
+        for entry_type, loc, lastmod in _iter_sitemap_entries(session, sitemap_url):
+            if entry_type == 'sitemap':
+                pending.append(loc)
+            else:
+                yield loc, lastmod
+
+
+def _iter_sitemap_entries(session, sitemap_url):
+    """
+    Yields ('url' or 'sitemap', loc, lastmod) for each entry of a sitemap or sitemap index
+    """
+    try:
+        r = session.get(sitemap_url, timeout=30, stream=True)
+    except RequestException as e:
+        logging.warning(f"Could not load sitemap {sitemap_url}: {e}\n")
+        return
+    with r:
+        if r.status_code != 200:
+            logging.info(f"Could not load sitemap {sitemap_url}: {r.status_code}\n")
+            return
+        count = 0
+        try:
+            # Content-Encoding is decoded by urllib3, .xml.gz files are still gzipped
+            r.raw.decode_content = True
+            r.raw.auto_close = False # Else closed at the end of the data, before the buffered reader is done
+            stream = io.BufferedReader(r.raw)
+            if stream.peek(2)[:2] == b'\x1f\x8b':
+                stream = gzip.GzipFile(fileobj=stream)
+            root = None
+            for event, element in ET.iterparse(stream, events=('start', 'end')):
+                if root is None:
+                    root = element
+                if event != 'end':
+                    continue
+                tag = element.tag.rsplit('}', 1)[-1]
+                if tag in ('url', 'sitemap'):
+                    loc = lastmod = None
+                    for child in element:
+                        child_tag = child.tag.rsplit('}', 1)[-1]
+                        if child_tag == 'loc' and child.text:
+                            loc = child.text.strip()
+                        elif child_tag == 'lastmod' and child.text:
+                            lastmod = child.text.strip()
+                    if loc:
+                        count += 1
+                        yield tag, loc, lastmod
+                    # Entries are dropped once read, so that only one is held in memory at a time
+                    root.clear()
+        except (ET.ParseError, OSError, urllib3.exceptions.HTTPError) as e:
+            logging.warning(f"Could not read sitemap {sitemap_url} completely: {e}\n")
+            print(f"WARNING: Could not read sitemap {sitemap_url} completely: {e}")
+        logging.info(f"Read sitemap {sitemap_url}: {count} entries\n")
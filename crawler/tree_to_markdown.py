@@ -0,0 +1,63 @@
+import re
+
+from html2text.utils import pad_tables_in_text
+from bs4 import Tag, NavigableString, Comment, Declaration, Doctype, CData, ProcessingInstruction
+
+
+# Strings bs4 writes as markup (comments, doctype...) - html.parser passes them to handlers html2text ignores
+MARKUP_STRING_TYPES = (Comment, Declaration, Doctype, CData, ProcessingInstruction)
+# Text inside these tags is written without escaping, html.parser passes it on in one piece
+CDATA_CONTENT_TAGS = ('script', 'style')
+ESCAPED_CHARACTERS = {'&': 'amp', '<': 'lt', '>': 'gt'}
+ESCAPED_CHARACTERS_PATTERN = re.compile(r'([&<>])')
+
+
+def tree_to_markdown(h, soup):
+    """
+    Converts a bs4 tree to Markdown with the html2text object h, without serializing it to a string first.
+
+    The tree is walked directly and the parser callbacks of h are called in the same order and with the same
+    arguments as if str(soup) had been passed to h.handle(): adjacent strings are merged, and text is split at
+    the characters bs4 would have escaped as entities (&, <, >).
+    """
+    h.start = True
+    pending_text = []
+
+    def flush_text(cdata_tag):
+        if not pending_text:
+            return
+        text = ''.join(pending_text)
+        pending_text.clear()
+        if cdata_tag:
+            h.handle_data(text.replace("</' + 'script>", "</ignore>"))
+            return
+        for part in ESCAPED_CHARACTERS_PATTERN.split(text):
+            if part in ESCAPED_CHARACTERS:
+                h.handle_entityref(ESCAPED_CHARACTERS[part])
+            elif part:
+                h.handle_data(part)
+
+    # Stack of (tag, iterator over its children), the end tag is handled once the iterator is exhausted
+    stack = [(soup, iter(soup.contents))]
+    while stack:
+        tag, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            flush_text(tag.name in CDATA_CONTENT_TAGS)
+            stack.pop()
+            if tag is not soup:
+                h.handle_endtag(tag.name.lower())
+        elif isinstance(child, Tag):
+            flush_text(tag.name in CDATA_CONTENT_TAGS)
+            attrs = [(name.lower(), ' '.join(value) if isinstance(value, list) else value) for name, value in child.attrs.items()]
+            h.handle_starttag(child.name.lower(), attrs)
+            stack.append((child, iter(child.contents)))
+        elif isinstance(child, MARKUP_STRING_TYPES):
+            flush_text(tag.name in CDATA_CONTENT_TAGS)
+        elif isinstance(child, NavigableString):
+            pending_text.append(str(child))
+
+    markdown = h.optwrap(h.finish())
+    if h.pad_tables:
+        return pad_tables_in_text(markdown)
+    return markdown
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import re
+import socket
+import sqlite3
+import time
+
+
+# A site whose worker sent no sign of life for this long (in s) is handed to another worker, which resumes it
+LEASE_TIMEOUT = 600
+HEARTBEAT_INTERVAL = 60
+
+
+def site_dir_name(url):
+    """
+    Name of the output directory of a site, e.g. 'https://www.example.com/fr/' -> 'www_example_com_fr'
+    """
+    return re.sub('(?<=_)_|(?<=^)_|_+$', '', re.sub(r'\W|https?|html', '_', url[:100]))
+
+
+class SiteQueue:
+    """
+    Work queue of a batch crawl: one row per site in a SQLite file, from which any number of worker processes
+    (also on several machines, if the file is on a shared drive) take the next site to crawl.
+
+    Each site goes from 'pending' to 'running' to 'done' or 'failed'. Running sites are renewed by heartbeats -
+    if a worker dies, its site is taken over by another worker after LEASE_TIMEOUT and resumed from its crawl state.
+    Uses the rollback journal instead of WAL, which does not work on network drives.
+    """
+    def __init__(self, path) -> None:
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=DELETE')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS sites (url TEXT PRIMARY KEY, output_dir TEXT UNIQUE NOT NULL, '
+                                "status TEXT NOT NULL DEFAULT 'pending', worker TEXT, heartbeat REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+                                'started REAL, finished REAL, error TEXT)')
+
+    def add_sites(self, urls, output_root):
+        """
+        Adds the sites of urls (starting pages) not in the queue yet, each with its own directory in output_root
+        Returns:
+        Number of added sites
+        """
+        added_count = 0
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            for url in urls:
+                if self.connection.execute('SELECT 1 FROM sites WHERE url = ?', (url,)).fetchone():
+                    continue
+                output_dir = os.path.join(os.path.abspath(output_root), site_dir_name(url))
+                if self.connection.execute('SELECT 1 FROM sites WHERE output_dir = ?', (output_dir,)).fetchone():
+                    output_dir += '_' + hashlib.blake2b(url.encode('utf-8'), digest_size=4).hexdigest()
+                self.connection.execute('INSERT INTO sites (url, output_dir) VALUES (?, ?)', (url, output_dir))
+                added_count += 1
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        return added_count
+
+    def claim(self, worker):
+        """
+        Takes the next pending site (or a running site whose worker stopped sending heartbeats)
+        Args:
+        worker: Name of the calling worker, see get_worker_name
+        Returns:
+        url, output_dir of the site - None if no site is left
+        """
+        now = time.time()
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.connection.execute("SELECT url, output_dir FROM sites WHERE status = 'pending' "
+                                          "OR (status = 'running' AND heartbeat < ?) ORDER BY status, rowid LIMIT 1",
+                                          (now - LEASE_TIMEOUT,)).fetchone()
+            if row is not None:
+                self.connection.execute("UPDATE sites SET status = 'running', worker = ?, heartbeat = ?, started = ?, attempts = attempts + 1 "
+                                        'WHERE url = ?', (worker, now, now, row[0]))
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        return row
+
+    def heartbeat(self, url, worker):
+        self.connection.execute("UPDATE sites SET heartbeat = ? WHERE url = ? AND worker = ? AND status = 'running'", (time.time(), url, worker))
+
+    def finish(self, url, worker, error=None):
+        """
+        Marks a site as 'done', or as 'failed' with the error
+        """
+        self.connection.execute('UPDATE sites SET status = ?, finished = ?, error = ? WHERE url = ? AND worker = ?',
+                                ('failed' if error else 'done', time.time(), error, url, worker))
+
+    def retry_failed(self):
+        """
+        Sets all failed sites back to 'pending' - they are resumed from their crawl state
+        Returns:
+        Number of sites
+        """
+        return self.connection.execute("UPDATE sites SET status = 'pending', error = NULL WHERE status = 'failed'").rowcount
+
+    def get_status_counts(self):
+        """
+        Returns:
+        dict status -> number of sites
+        """
+        return dict(self.connection.execute('SELECT status, COUNT(*) FROM sites GROUP BY status'))
+
+    def iter_sites(self):
+        """
+        Yields:
+        url, output_dir, status, worker, attempts, error of all sites
+        """
+        yield from self.connection.execute('SELECT url, output_dir, status, worker, attempts, error FROM sites ORDER BY rowid')
+
+    def close(self):
+        self.connection.close()
+
+
+def get_worker_name(index):
+    """
+    Name identifying a worker process across machines
+    """
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'